@@ -1,13 +1,62 @@
 import os
 import pytz
-from sqlmodel import create_engine
+from sqlalchemy.engine import make_url
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Reads its settings from the environment when imported
+from app.db.engine import create_async_db_engine, create_db_engine, in_memory  # noqa: E402
+
 IST = pytz.timezone("Asia/Kolkata")
 
 HTML_TEMPLATES = Jinja2Templates(directory="./static/HTML")
 
-db_engine = create_engine(os.getenv("SQL_DB_URL", "sqlite:///acm.db"))
+SQL_DB_URL = os.getenv("SQL_DB_URL", "sqlite:///acm.db")
+
+# async: the endpoints await the database through an async driver, sync: every query runs in the threadpool
+DB_MODE = os.getenv("DB_MODE", "async")
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def read_url(url: str) -> str | None:
+    """
+    Database the reads go to: READ_SQL_DB_URL (a replica), else a separate read only pool on the same SQLite file
+    (WAL lets it read while the writer writes). None when the reads share the writer's engine
+    """
+    if os.getenv("READ_SQL_DB_URL"):
+        return os.getenv("READ_SQL_DB_URL")
+    if make_url(url).get_backend_name() == "sqlite" and not in_memory(url) and os.getenv("SQLITE_READ_POOL", "1") != "0":
+        return url
+    return None
+
+
+def async_url(url: str) -> str:
+    """
+    Same database with the async driver (aiosqlite / asyncpg)
+    """
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(
+        hide_password=False
+    )
+
+
+db_engine = create_db_engine(SQL_DB_URL)
+
+async_db_engine = (
+    create_async_db_engine(os.getenv("ASYNC_SQL_DB_URL") or async_url(SQL_DB_URL))
+    if DB_MODE == "async"
+    else None
+)
+
+READ_SQL_DB_URL = read_url(SQL_DB_URL)
+
+read_db_engine = create_db_engine(READ_SQL_DB_URL, read_only=True) if READ_SQL_DB_URL else None
+
+async_read_db_engine = (
+    create_async_db_engine(os.getenv("ASYNC_READ_SQL_DB_URL") or async_url(READ_SQL_DB_URL), read_only=True)
+    if READ_SQL_DB_URL and DB_MODE == "async"
+    else None
+)
@@ -1,15 +1,273 @@
+"""
+Sessions of the requests
+
+With DB_MODE=async (default) the endpoints get an AsyncSession on the async engine, so a request waiting on the
+database doesn't hold one of the threads of the threadpool. With DB_MODE=sync they get the plain Session wrapped
+in SyncSession, which has the same awaitable methods and runs each of them in the threadpool, so the endpoints
+are written once for both modes.
+Helpers written against the sync Session API (they are shared with the background jobs) are called with
+`await db.run_sync(helper, *args)`, which works the same way in both modes.
+
+Reads (GET / HEAD) go to the read engines when there are any (a replica, or a read only pool on the SQLite file),
+everything else to the writer, see EngineRouter. GET endpoints which write use get_write_db instead of get_db.
+
+Configuration (environment variables):
+    READ_AFTER_WRITE_SECONDS -> How long the reads of a client go to the writer after it wrote (default: 5)
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from hashlib import sha256
+from typing import Any, AsyncIterator, Callable, TypeVar
+from weakref import WeakKeyDictionary
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import QueuePool
 from sqlmodel import SQLModel, Session
-from app.config import db_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.config import async_db_engine, async_read_db_engine, db_engine, read_db_engine
+from app.utils import search
 from . import models  # Sets the metadata for the create_table() to create tables
 
+T = TypeVar("T")
+
+READ_AFTER_WRITE_SECONDS = float(os.getenv("READ_AFTER_WRITE_SECONDS", 5))
+
 
 def create_table(engine):
     """
-    Creates all the tables by using the meta of the SQLModel class
+    Creates all the tables by using the meta of the SQLModel class, their indexes and the search index of the blogs
     """
     SQLModel.metadata.create_all(engine)
+    ensure_columns(engine)
+    ensure_indexes(engine)
+    search.create_index(engine)
+
+
+def ensure_columns(engine):
+    """
+    create_all() doesn't change the tables which already exist, this adds the nullable columns of the models which
+    are missing in an existing database (other changes still need a migration)
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        quote = conn.dialect.identifier_preparer.quote
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+
+
+def ensure_indexes(engine):
+    """
+    create_all() only creates the indexes of new tables, this adds the indexes of the models which are missing
+    in an existing database
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+class SyncSession:
+    """
+    Session with the awaitable interface of AsyncSession
+    """
+
+    def __init__(self, session: Session) -> None:
+        self.sync_session = session
+
+    @property
+    def info(self) -> dict:
+        return self.sync_session.info
+
+    def add(self, instance: Any) -> None:
+        self.sync_session.add(instance)
+
+    def add_all(self, instances: Any) -> None:
+        self.sync_session.add_all(instances)
+
+    async def exec(self, statement: Any, **kwargs: Any) -> Any:
+        return await run_in_threadpool(self.sync_session.exec, statement, **kwargs)
+
+    async def execute(self, statement: Any, **kwargs: Any) -> Any:
+        return await run_in_threadpool(self.sync_session.execute, statement, **kwargs)
+
+    async def get(self, entity: Any, ident: Any, **kwargs: Any) -> Any:
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance: Any) -> None:
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self) -> None:
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self) -> None:
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance: Any, **kwargs: Any) -> None:
+        await run_in_threadpool(self.sync_session.refresh, instance, **kwargs)
+
+    async def run_sync(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self) -> None:
+        await run_in_threadpool(self.sync_session.close)
+
+
+# What the endpoints get from get_db()
+DBSession = AsyncSession | SyncSession
 
+_session_slots: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[Engine, asyncio.Semaphore]] = WeakKeyDictionary()
 
-def get_db():
-    with Session(db_engine) as session:
+
+def _slots(engine: Engine) -> asyncio.Semaphore | None:
+    """
+    A SyncSession keeps its connection between the awaits, so when more sessions than the pool has connections
+    are open, the threadpool fills up with threads waiting for a connection and the sessions which hold the
+    connections can't get a thread to finish. The extra sessions wait here instead, without holding a thread
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        return None
+    slots = _session_slots.setdefault(asyncio.get_running_loop(), {})
+    if engine not in slots:
+        slots[engine] = asyncio.Semaphore(pool.size() + pool._max_overflow)
+    return slots[engine]
+
+
+@asynccontextmanager
+async def open_session(engine: Engine, async_engine: AsyncEngine | None = None) -> AsyncIterator[DBSession]:
+    """
+    AsyncSession when there is an async engine, otherwise SyncSession.
+    Attributes stay loaded after commit, an async session can't lazy load them later
+    """
+    if async_engine is not None:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            session.info["engine"] = engine
+            yield session
+    else:
+        async with _slots(engine) or nullcontext():
+            session = SyncSession(Session(engine, expire_on_commit=False))
+            session.info["engine"] = engine
+            try:
+                yield session
+            finally:
+                await session.close()
+
+
+def get_engine(db: DBSession) -> Engine:
+    """
+    Sync engine of the session's database, for the work which runs in threads (streaming, background jobs)
+    """
+    return db.info["engine"]
+
+
+# Sync engine and (in DB_MODE=async) the async engine of the same database
+Engines = tuple[Engine, AsyncEngine | None]
+
+
+class EngineRouter:
+    """
+    Sends the reads to the reader and everything else to the writer. A client which has just sent a write keeps
+    reading from the writer for stick_for seconds, so it sees its own change even when the reader (a replica) is
+    behind. Clients are told apart by their access token, or by their address when they don't send one.
+    The recent writers are kept in this process, so behind several workers the window is per worker
+    """
+
+    READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(
+        self,
+        writer: Engines,
+        reader: Engines | None = None,
+        stick_for: float = READ_AFTER_WRITE_SECONDS,
+        size: int = 10000,
+    ) -> None:
+        self.writer = writer
+        self.reader = reader or writer
+        self.stick_for = stick_for
+        self.size = size
+        self.reads = 0
+        self.writes = 0
+        self.sticky_reads = 0
+        self._wrote_at: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _client(request: Request) -> str:
+        client = request.headers.get("authorization") or (request.client.host if request.client else "")
+        return sha256(client.encode()).hexdigest()
+
+    def _recently_wrote(self, key: str) -> bool:
+        with self._lock:
+            wrote_at = self._wrote_at.get(key)
+            if wrote_at is not None and wrote_at + self.stick_for <= time.monotonic():
+                del self._wrote_at[key]
+                wrote_at = None
+            return wrote_at is not None
+
+    def _wrote(self, key: str) -> None:
+        with self._lock:
+            self._wrote_at.pop(key, None)
+            self._wrote_at[key] = time.monotonic()
+            while len(self._wrote_at) > self.size:
+                self._wrote_at.popitem(last=False)
+
+    def route(self, request: Request, write: bool = False) -> Engines:
+        """
+        Engines for the request. The client is marked as a writer before its write even starts, so a read sent
+        right after the response can't miss it
+        """
+        key = self._client(request)
+        if write or request.method not in self.READ_METHODS:
+            self.writes += 1
+            if self.reader is not self.writer and self.stick_for > 0:
+                self._wrote(key)
+            return self.writer
+        if self.reader is not self.writer and self._recently_wrote(key):
+            self.sticky_reads += 1
+            return self.writer
+        self.reads += 1
+        return self.reader
+
+    def session(self, request: Request, write: bool = False):
+        return open_session(*self.route(request, write))
+
+    def metrics(self) -> dict:
+        return {
+            "replica": self.reader is not self.writer,
+            "reads": self.reads,
+            "writes": self.writes,
+            "sticky_reads": self.sticky_reads,
+        }
+
+
+db_router = EngineRouter(
+    (db_engine, async_db_engine),
+    (read_db_engine, async_read_db_engine) if read_db_engine is not None else None,
+)
+
+
+async def get_db(request: Request):
+    async with db_router.session(request) as session:
+        yield session
+
+
+async def get_write_db(request: Request):
+    """
+    get_db() which always uses the writer, for the GET endpoints which change data (like the links sent by mail)
+    """
+    async with db_router.session(request, write=True) as session:
         yield session
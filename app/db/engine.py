@@ -0,0 +1,145 @@
+"""
+Engines of the database, with the pool settings and (for SQLite) the pragmas every connection is opened with
+
+A bare SQLite connection uses the rollback journal, so a writer blocks all the readers and a second writer fails
+right away with "database is locked". Every connection here switches to WAL (readers don't block the writer and
+the other way round), waits up to SQLITE_BUSY_TIMEOUT for the lock instead of failing, and only syncs to disk at
+checkpoints (synchronous=NORMAL is durable in WAL mode except for the last transactions on a power loss).
+PRAGMA optimize keeps the query planner statistics up to date, it runs at startup and then every
+SQLITE_OPTIMIZE_SECONDS.
+Read only engines (the readers of app.db.db.EngineRouter) also set query_only, so a write by mistake fails
+instead of taking the write lock.
+
+Configuration (environment variables):
+    DB_POOL_SIZE -> Connections kept open in the pool (default: 5)
+    DB_MAX_OVERFLOW -> Connections opened beyond DB_POOL_SIZE under load (default: 10)
+    DB_POOL_TIMEOUT -> Seconds to wait for a connection from the pool (default: 30)
+    DB_POOL_RECYCLE -> Seconds after which a connection is reopened, -1 never (default: 1800, -1 for SQLite)
+    DB_POOL_PRE_PING -> Checks the connection before using it (default: 1, 0 for SQLite)
+    SQLITE_JOURNAL_MODE -> (default: WAL)
+    SQLITE_SYNCHRONOUS -> (default: NORMAL)
+    SQLITE_BUSY_TIMEOUT -> Milliseconds to wait for a lock (default: 5000)
+    SQLITE_MMAP_SIZE -> Bytes of the database read through mmap (default: 256 MiB)
+    SQLITE_CACHE_SIZE -> Page cache of each connection, negative is in KiB (default: -65536, 64 MiB)
+    SQLITE_TEMP_STORE -> (default: MEMORY)
+    SQLITE_OPTIMIZE_SECONDS -> (default: 3600)
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import create_engine
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+POOL_RECYCLE = os.getenv("DB_POOL_RECYCLE")
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING")
+
+OPTIMIZE_SECONDS = float(os.getenv("SQLITE_OPTIMIZE_SECONDS", 3600))
+
+
+def _choice(name: str, default: str, choices: set[str]) -> str:
+    value = os.getenv(name, default).upper()
+    if value not in choices:
+        raise ValueError(f"{name} has to be one of {', '.join(sorted(choices))}")
+    return value
+
+
+# Name -> value, in the order they are set
+PRAGMAS = {
+    # busy_timeout comes first, switching to WAL needs the lock
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
+    "journal_mode": _choice("SQLITE_JOURNAL_MODE", "WAL", {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}),
+    "synchronous": _choice("SQLITE_SYNCHRONOUS", "NORMAL", {"OFF", "NORMAL", "FULL", "EXTRA"}),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", -64 * 1024)),
+    "temp_store": _choice("SQLITE_TEMP_STORE", "MEMORY", {"DEFAULT", "FILE", "MEMORY"}),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def in_memory(url: str) -> bool:
+    return make_url(url).database in (None, "", ":memory:")
+
+
+def engine_options(url: str) -> dict[str, Any]:
+    """
+    Pool settings of the engine for the url
+    """
+    sqlite = make_url(url).get_backend_name() == "sqlite"
+    if sqlite and in_memory(url):
+        # A single connection shared by the whole process, there is no pool to size
+        return {}
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        # Server connections get dropped by the server / proxies when idle, SQLite files don't
+        "pool_recycle": int(POOL_RECYCLE) if POOL_RECYCLE else (-1 if sqlite else 1800),
+        "pool_pre_ping": POOL_PRE_PING != "0" if POOL_PRE_PING else not sqlite,
+    }
+
+
+def tune_sqlite(engine: Engine, read_only: bool = False) -> None:
+    """
+    Sets PRAGMAS on every new connection of the engine (the sync_engine of an async engine)
+    """
+    pragmas = dict(PRAGMAS)
+    if in_memory(str(engine.url)):
+        del pragmas["journal_mode"]  # In memory databases have no journal file
+    if read_only:
+        pragmas["query_only"] = 1
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection: Any, _: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+
+def create_db_engine(url: str, read_only: bool = False, **kwargs: Any) -> Engine:
+    engine = create_engine(url, **{**engine_options(url), **kwargs})
+    if engine.dialect.name == "sqlite":
+        tune_sqlite(engine, read_only)
+    return engine
+
+
+def create_async_db_engine(url: str, read_only: bool = False, **kwargs: Any) -> AsyncEngine:
+    engine = create_async_engine(url, **{**engine_options(url), **kwargs})
+    if engine.dialect.name == "sqlite":
+        tune_sqlite(engine.sync_engine, read_only)
+    return engine
+
+
+def optimize(engine: Engine) -> None:
+    """
+    PRAGMA optimize on SQLite, nothing on other databases (they keep their own statistics up to date)
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as conn:
+        # 0x10002 also looks at the tables this connection didn't query (SQLite 3.46+, older versions ignore the flag)
+        conn.exec_driver_sql("PRAGMA optimize = 0x10002")
+        conn.commit()
+
+
+async def run_optimizer(engine: Engine) -> None:
+    """
+    Optimizes at startup and then periodically, runs until it is cancelled
+    """
+    while True:
+        try:
+            await run_in_threadpool(optimize, engine)
+        except Exception:
+            logger.exception("Couldn't optimize the database")
+        await asyncio.sleep(OPTIMIZE_SECONDS)
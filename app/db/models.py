@@ -1,5 +1,6 @@
 from datetime import datetime, date
 from uuid import UUID, uuid4
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
@@ -19,6 +20,13 @@ class Users(SQLModel, table=True):
 
 
 class Members(SQLModel, table=True):
+    __table_args__ = (
+        # /members/search filters by season, then team and position, sorted by joined_at
+        Index("ix_members_season_team_position", "season", "team", "position"),
+        Index("ix_members_team", "team"),
+        Index("ix_members_joined_at_reg_no", "joined_at", "reg_no"),
+    )
+
     reg_no: int = Field(..., primary_key=True, index=True)
     name: str
     email: str = Field(..., unique=True, index=True)
@@ -53,6 +61,9 @@ class ResetPassword(SQLModel, table=True):
 
 
 class Events(SQLModel, table=True):
+    # upcoming/past and the pages are ranges of start
+    __table_args__ = (Index("ix_events_start_id", "start", "id"),)
+
     id: UUID = Field(..., default_factory=uuid4, primary_key=True, index=True)
     name: str
     description: str
@@ -62,16 +73,47 @@ class Events(SQLModel, table=True):
     venue: str
     fee: float
     image_url: str
+    # Seats of the event, None for no limit (the seats taken are in Event_Seats)
+    capacity: int | None = None
+
+
+class Event_Seats(SQLModel, table=True):
+    event_id: UUID = Field(..., primary_key=True)
+    taken: int
 
 
 class Event_Registeration(SQLModel, table=True):
+    __table_args__ = (
+        # The pending list is paginated by event, then user, and the bulk verification updates only pending rows
+        Index("ix_event_registeration_status_event_id_user_reg_no", "status", "event_id", "user_reg_no"),
+    )
+
     user_reg_no: int = Field(..., primary_key=True, index=True)
     event_id: UUID = Field(..., primary_key=True, index=True)
     transaction_id: str | None = Field(..., unique=True)
     screenshot_id: str | None = Field(..., unique=True)
-    status: str = Field(..., index=True)
+    status: str
+
+
+class Payment_Proofs(SQLModel, table=True):
+    # id is the screenshot_id, the file is stored by its sha256 (see app/utils/payment_proofs.py). The ids of the
+    # uploads are made from the sha256, the screenshots moved from the old layout keep their own (so sha256 can repeat)
+    id: str = Field(..., primary_key=True)
+    sha256: str = Field(..., index=True)
+    extension: str
+    size: int
+    uploaded_by: str | None = None
+    uploaded_from: str | None = None
+    uploaded_at: datetime
+
 
 class Blogs(SQLModel, table=True):
+    # The pages are sorted by date
+    __table_args__ = (
+        Index("ix_blogs_date_id", "date", "id"),
+        Index("ix_blogs_author_date_id", "author", "date", "id"),
+    )
+
     id: UUID = Field(..., default_factory=uuid4, primary_key=True, index=True)
     title: str 
     description: str
@@ -79,3 +121,54 @@ class Blogs(SQLModel, table=True):
     author: str
     image_url: str | None
 
+
+class Campaign(SQLModel, table=True):
+    id: UUID = Field(..., default_factory=uuid4, primary_key=True, index=True)
+    subject: str
+    body: str
+    unsubscribe_url: str
+    status: str = Field(..., index=True)
+    rate: float
+    total: int
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    last_email: str | None = None
+    created_by: str
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    # Run of a worker on the campaign and until when it holds it (see app/utils/campaign.py)
+    runner: str | None = None
+    lease_until: datetime | None = None
+
+
+class Campaign_Delivery(SQLModel, table=True):
+    campaign_id: UUID = Field(..., primary_key=True, index=True)
+    email: str = Field(..., primary_key=True)
+    status: str
+    error: str | None = None
+    time: datetime
+
+
+class Counters(SQLModel, table=True):
+    name: str = Field(..., primary_key=True)
+    value: int
+
+
+class Idempotency_Keys(SQLModel, table=True):
+    # key is the SHA-256 of the client, the route and its Idempotency-Key header (see app/utils/idempotency.py)
+    key: str = Field(..., primary_key=True)
+    # None while the first request is in flight
+    status_code: int | None = None
+    content_type: str | None = None
+    body: bytes | None = None
+    request_hash: str | None = None
+    created_at: datetime
+    expires_at: datetime = Field(..., index=True)
+
+
+class Table_Versions(SQLModel, table=True):
+    name: str = Field(..., primary_key=True)
+    version: int
+    updated_at: datetime
@@ -1,20 +1,81 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .db import db
+from .db import db, engine as db_engine_utils
 from . import config
-from .routers import users, members, events, payment_proof, blogs, achievements, mail, export
+from .routers import users, members, events, payment_proof, images, blogs, achievements, mail, export, metrics
+from .utils import mail as mail_utils, campaign as campaign_utils, counters, payment_proofs, images as image_utils
+from .utils.security import EqualTimingMiddleware
+from .utils.idempotency import HEADER as IDEMPOTENCY_HEADER, REPLAYED_HEADER, IdempotencyMiddleware, idempotency_keys
+from .utils.uploads import BodySizeLimitMiddleware, FORM_OVERHEAD_BYTES, MAX_BYTES as UPLOAD_MAX_BYTES
+from .utils.pagination import NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER
 
-app = FastAPI(title="ACM-SIST APIs", version="2.0.0")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Continues the campaigns which were stopped in the middle by a restart
+    campaign_utils.resume_all(config.db_engine)
+    # Screenshots uploaded before the registry
+    await run_in_threadpool(payment_proofs.import_legacy, config.db_engine)
+    # Repairs any drift of the /achievements counters now and then periodically
+    reconciler = asyncio.create_task(counters.run_reconciler(config.db_engine))
+    # Keeps the statistics of the query planner up to date
+    optimizer = asyncio.create_task(db_engine_utils.run_optimizer(config.db_engine))
+    # Forgets the expired idempotency keys
+    purger = asyncio.create_task(idempotency_keys.run_purger())
+    yield
+    reconciler.cancel()
+    optimizer.cancel()
+    purger.cancel()
+    for engine in (config.async_db_engine, config.async_read_db_engine):
+        if engine is not None:
+            await engine.dispose()
+    await run_in_threadpool(image_utils.shutdown)
+    # Delivers the mails which are still in the queue before exiting
+    await run_in_threadpool(mail_utils.shutdown)
+
+
+app = FastAPI(title="ACM-SIST APIs", version="2.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 db.create_table(config.db_engine)
 
-# Allows All Domain to access the API
-app.add_middleware(CORSMiddleware, allow_origins=["*"])
+# Both found and not found accounts should take the same time to respond
+app.add_middleware(
+    EqualTimingMiddleware,
+    routes={("POST", "/users/verify"), ("POST", "/users/forgot_password")},
+)
+
+# Retries with the same Idempotency-Key get the response of the first request
+app.add_middleware(
+    IdempotencyMiddleware,
+    routes={("POST", "/events/register"), ("POST", "/payment_proof/")},
+)
+
+# Uploads are cut off as soon as they go over the limit
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        ("POST", "/payment_proof/"): UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+        ("POST", "/images/"): UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+    },
+)
+
+# Allows All Domain to access the API. Added last so it wraps the other middlewares, their responses need the
+# CORS headers too
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["Authorization", "Content-Type", IDEMPOTENCY_HEADER],
+    expose_headers=[NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER, REPLAYED_HEADER],
+)
 
-for api in (users, members, events, payment_proof, blogs, achievements, mail, export):
+for api in (users, members, events, payment_proof, images, blogs, achievements, mail, export, metrics):
     app.include_router(api.router)
 
 
@@ -25,4 +86,6 @@ def get_favicon():
 
 
 # Acts like a CDN
+image_utils.ROOT.mkdir(exist_ok=True)
+app.mount(image_utils.URL_PREFIX, image_utils.ImmutableStaticFiles(directory=image_utils.ROOT), name="images")
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -1,11 +1,15 @@
 import os
+import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from hashlib import sha256
 from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import EmailStr
-from sqlmodel import Session, select
-from app.db.db import get_db
+from sqlmodel import select
+from app.db.db import DBSession, get_db
 from app.db.models import Members, Users
 from . import schema, config
 
@@ -13,6 +17,97 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 oauth2_scheme_no_error = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
 
+class PrincipalCache:
+    """
+    LRU cache of the users/members resolved from the access tokens, so an authenticated request doesn't
+    have to decode the token and query the database every time.
+    Entries are keyed by the hash of the token, live until the token expires (at most ttl seconds)
+    and are dropped with invalidate() when the row behind them changes.
+    """
+
+    def __init__(self, size: int, ttl: float) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.enabled = size > 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, Users | Members]] = OrderedDict()
+        self._keys_by_email: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Users | Members | None:
+        if not self.enabled:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                self._remove(key)
+            self.misses += 1
+        return None
+
+    def set(self, token: str, principal: Users | Members) -> None:
+        if not self.enabled:
+            return
+        # The token is already verified by the caller, only the expiry is needed here
+        expires_at = min(jwt.get_unverified_claims(token)["exp"], time.time() + self.ttl)
+        key = self._key(token)
+        # Detached copy so it is not tied to the session of this request
+        principal = type(principal)(**principal.model_dump())
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at, principal)
+            self._keys_by_email.setdefault(principal.email, set()).add(key)
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *emails: str | None) -> None:
+        """
+        Drops every cached token of those emails, called whenever their Users/Members/Auth row changes
+        """
+        with self._lock:
+            for email in emails:
+                for key in self._keys_by_email.pop(email, set()):
+                    self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_email.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            keys = self._keys_by_email.get(entry[1].email)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_email[entry[1].email]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+principal_cache = PrincipalCache(
+    int(os.getenv("AUTH_CACHE_SIZE", 1024)), float(os.getenv("AUTH_CACHE_TTL", 300))
+)
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     _data = data.copy()
     expire = datetime.now(config.IST) + (
@@ -137,28 +232,36 @@ def get_member_email(token: str, invalid_token_exception):
     raise invalid_token_exception
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: DBSession = Depends(get_db)
 ):
+    cached = principal_cache.get(token)
+    if isinstance(cached, Users):
+        return cached
     invalid_token_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Access Token"
     )
     email = get_user_email(token, invalid_token_exception)
-    user = db.exec(select(Users).where(Users.email == email)).first()
+    user = (await db.exec(select(Users).where(Users.email == email))).first()
     if user:
+        principal_cache.set(token, user)
         return user
     raise invalid_token_exception
 
 
-def get_current_member(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+async def get_current_member(
+    token: str = Depends(oauth2_scheme), db: DBSession = Depends(get_db)
 ):
+    cached = principal_cache.get(token)
+    if isinstance(cached, Members):
+        return cached
     invalid_token_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Access Token"
     )
 
     email = get_member_email(token, invalid_token_exception)
-    member = db.exec(select(Members).where(Members.email == email)).first()
+    member = (await db.exec(select(Members).where(Members.email == email))).first()
     if member:
+        principal_cache.set(token, member)
         return member
     raise invalid_token_exception
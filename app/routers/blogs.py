@@ -1,57 +1,89 @@
 from datetime import date
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, Query, status 
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status 
 from sqlmodel import Session, select
 from app import oauth2, schema
-from app.db.db import get_db
+from app.db.db import DBSession, get_db
 from app.db.models import Blogs
+from app.utils import http_cache, search as blog_search
+from app.utils.cache import response_cache
+from app.utils.serialization import columns, dump_json
+from app.utils.pagination import PageParams, keyset, model_key, next_page, set_total_count
 
 router = APIRouter(prefix="/blogs")
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def create_blog(data: schema.BlogCreate, db: Session = Depends(get_db), _: schema.MemberOut = Depends(oauth2.get_current_member)):
+async def create_blog(data: schema.BlogCreate, db: DBSession = Depends(get_db), _: schema.MemberOut = Depends(oauth2.get_current_member)):
     blog = Blogs(**data.model_dump())
     db.add(blog)
-    db.commit()
-    db.refresh(blog)
+    await db.run_sync(http_cache.bump, "blogs")
+    await db.commit()
+    await response_cache.invalidate("blogs")
+    await db.refresh(blog)
     return blog
 
-@router.get("/search", response_model=list[schema.BlogOut])
-def get_blogs(_id: UUID | None = Query(None, alias="id"), title: str | None = None, author: str | None = None, _date: date | None = Query(None, alias="date"), db: Session = Depends(get_db)):
-    query = select(Blogs)
-    filters = {}
-    if _id:
-        filters["id"] = _id
-    if author:
-        filters["author"] = author
-    if title:
-        filters["title"] = title
-    if _date:
-        filters["date"] = _date
-    if filters:
-        query = query.filter_by(**filters)
-    blogs = db.exec(query).all()
-    return blogs
+@router.get("/search", response_model=list[schema.BlogSearchOut], dependencies=[Depends(http_cache.Conditional("blogs"))])
+async def get_blogs(request: Request, response: Response, q: str | None = Query(None, max_length=200, description="Words to search in the title, description and author, best matches first"), _id: UUID | None = Query(None, alias="id"), title: str | None = None, author: str | None = None, _date: date | None = Query(None, alias="date"), order: schema.SortOrder = schema.SortOrder.DESC, page: PageParams = Depends(), db: DBSession = Depends(get_db)):
+    if q is not None and not blog_search.terms(q):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Nothing to search for"
+        )
+
+    def search(db: Session, response: Response) -> bytes:
+        query = select(Blogs)
+        filters = {}
+        if _id:
+            filters["id"] = _id
+        if author:
+            filters["author"] = author
+        if title:
+            filters["title"] = title
+        if _date:
+            filters["date"] = _date
+        if filters:
+            query = query.filter_by(**filters)
+        if q is not None:
+            # Best match first, order doesn't apply
+            blogs = blog_search.search_blogs(db, query, q, page, response)
+            return dump_json(schema.BlogSearchOut, [{**blog.model_dump(), "snippet": snippet} for blog, snippet in blogs])
+        set_total_count(db, query, page, response, None if filters else Blogs.__tablename__)
+        # Latest blogs first by default
+        sort_columns = [Blogs.date, Blogs.id]
+        blogs = db.execute(
+            keyset(query.with_only_columns(*columns(Blogs, schema.BlogOut)), sort_columns, page, order == schema.SortOrder.DESC)
+        ).all()
+        blogs = next_page(blogs, page, model_key(sort_columns), response)
+        return dump_json(schema.BlogOut, blogs)
+
+    params = {"q": q, "id": _id, "title": title, "author": author, "date": _date, "order": order, "page": page}
+    params["versions"] = http_cache.versions(request)
+    tags = [f"blogs:{_id}"] if _id else ["blogs"]
+    return await response_cache.respond("blogs/search", params, tags, response, lambda res: db.run_sync(search, res))
 
 @router.patch("/", response_model=schema.BlogOut)
-def update_blog(data: schema.BlogUpdate, db: Session = Depends(get_db), _: schema.MemberOut = Depends(oauth2.get_current_member)):
-    blog = db.exec(select(Blogs).where(Blogs.id == data.id)).first()
+async def update_blog(data: schema.BlogUpdate, db: DBSession = Depends(get_db), _: schema.MemberOut = Depends(oauth2.get_current_member)):
+    blog = (await db.exec(select(Blogs).where(Blogs.id == data.id))).first()
     if blog:
         for k, v in data.model_dump().items():
             if k.startswith("new_") and v is not None:
                 setattr(blog, k.replace("new_", ""), v)
-        db.commit()
-        db.refresh(blog)
+        await db.run_sync(http_cache.bump, "blogs")
+        await db.commit()
+        await response_cache.invalidate("blogs", f"blogs:{blog.id}")
+        await db.refresh(blog)
     return blog
 
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
-def delete_blog(data: schema.BlogDelete, db: Session = Depends(get_db), _: schema.MemberOut = Depends(oauth2.get_current_member)):
-    blog = db.exec(select(Blogs).where(Blogs.id == data.id)).first()
+async def delete_blog(data: schema.BlogDelete, db: DBSession = Depends(get_db), _: schema.MemberOut = Depends(oauth2.get_current_member)):
+    blog = (await db.exec(select(Blogs).where(Blogs.id == data.id))).first()
     if not blog:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Blog doesn't exist"
         )
-    db.delete(blog)
-    db.commit()
+    await db.delete(blog)
+    await db.run_sync(http_cache.bump, "blogs")
+    await db.commit()
+    await response_cache.invalidate("blogs", f"blogs:{data.id}")
 
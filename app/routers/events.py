@@ -1,38 +1,62 @@
 from datetime import datetime
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.exc import IntegrityError
-from sqlmodel import Session, or_, select
+from sqlalchemy import case, tuple_
+from sqlmodel import Session, func, or_, select, update
 from app import oauth2, schema
 from app.config import IST
-from pathlib import Path
-from app.db.db import get_db
-from app.db.models import Events, Event_Registeration
+from app.db.db import DBSession, get_db
+from app.db.models import Events, Event_Registeration, Event_Seats, Payment_Proofs, Users
+from app.utils import counters, http_cache, seats
+from app.utils.cache import response_cache
+from app.utils.serialization import columns, dump_json
+from app.utils.pagination import PageParams, keyset, model_key, next_page, set_total_count
 
 router = APIRouter(prefix="/events")
 
 
 @router.post("/", response_model=schema.EventOut)
-def create_event(
+async def create_event(
     data: schema.CreateEvent,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_db),
     _: schema.MemberOut = Depends(oauth2.get_current_member),
 ):
     event = Events(**data.model_dump())
     db.add(event)
-    db.commit()
-    db.refresh(event)
-    event.start = event.start.astimezone(IST)
-    event.end = event.end.astimezone(IST)
+    if event.capacity is not None:
+        await db.run_sync(seats.ensure, event.id)
+    await db.run_sync(counters.add, "events_count")
+    await db.run_sync(http_cache.bump, "events")
+    await db.commit()
+    await response_cache.invalidate("events")
+    await db.refresh(event)
     return event
 
 
-@router.get("/search", response_model=list[schema.EventOut])
-def search_events(
+def last_started(db: Session, request: Request) -> datetime | None:
+    """
+    Start of the latest event which has already started, upcoming/past results change when an event starts
+    """
+    if "upcoming" not in request.query_params and "past" not in request.query_params:
+        return None
+    return db.exec(select(func.max(Events.start)).where(Events.start <= datetime.now(IST))).one()
+
+
+@router.get(
+    "/search",
+    response_model=list[schema.EventOut],
+    dependencies=[Depends(http_cache.Conditional("events", moment=last_started))],
+)
+async def search_events(
+    request: Request,
+    response: Response,
     _id: UUID | None = Query(None, alias="id"),
     upcoming: bool = Query(False),
     past: bool = Query(False),
-    db: Session = Depends(get_db),
+    order: schema.SortOrder = schema.SortOrder.ASC,
+    page: PageParams = Depends(),
+    db: DBSession = Depends(get_db),
 ):
     current_time = datetime.now(IST)
     if upcoming and past:
@@ -40,28 +64,48 @@ def search_events(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You can't use both past and upcoming at the same time. If you want to get all the events then send the same request with neither of past nor upcomming",
         )
-    query = select(Events)
-    if _id:
-        query = query.where(Events.id == _id)
-    elif upcoming:
-        query = query.filter(or_(Events.start > current_time))
-    elif past:
-        query = query.filter(or_(Events.start <= current_time))
-    events = db.exec(query).all()
-    if events:
-        for event in events:
-            event.start = event.start.astimezone(IST)
-            event.end = event.end.astimezone(IST)
-    return events
+
+    def search(db: Session, response: Response) -> bytes:
+        query = select(Events)
+        if _id:
+            query = query.where(Events.id == _id)
+        elif upcoming:
+            query = query.filter(or_(Events.start > current_time))
+        elif past:
+            query = query.filter(or_(Events.start <= current_time))
+        set_total_count(
+            db, query, page, response, None if _id or upcoming or past else Events.__tablename__
+        )
+        sort_columns = [Events.start, Events.id]
+        events = db.execute(
+            keyset(query.with_only_columns(*columns(Events, schema.EventOut)), sort_columns, page, order == schema.SortOrder.DESC)
+        ).all()
+        events = next_page(events, page, model_key(sort_columns), response)
+        return dump_json(schema.EventOut, events)
+
+    params = {"id": _id, "upcoming": upcoming, "past": past, "order": order, "page": page}
+    params["versions"] = http_cache.versions(request)
+    if upcoming or past:
+        # Same results until the next event starts
+        params["started"] = await db.run_sync(last_started, request)
+    tags = [f"events:{_id}"] if _id else ["events"]
+    return await response_cache.respond(
+        "events/search", params, tags, response, lambda res: db.run_sync(search, res)
+    )
 
 
 @router.patch("/", response_model=schema.EventOut)
-def update_event(
+async def update_event(
     data: schema.EventUpdate,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_db),
     _: schema.MemberOut = Depends(oauth2.get_current_member),
 ):
-    event = db.exec(select(Events).where(Events.id == data.id)).first()
+    if data.remove_capacity and data.new_capacity is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You can't use both new_capacity and remove_capacity at the same time",
+        )
+    event = (await db.exec(select(Events).where(Events.id == data.id))).first()
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Event does not exist"
@@ -70,33 +114,55 @@ def update_event(
     for k, v in event_new_data.items():
         if k.startswith("new_") and v is not None:
             setattr(event, k.replace("new_", ""), v)
-    db.commit()
-    db.refresh(event)
+    if data.remove_capacity:
+        event.capacity = None
+        # Counted again from the registrations if the event gets a capacity later
+        event_seats = await db.get(Event_Seats, event.id)
+        if event_seats:
+            await db.delete(event_seats)
+    elif event.capacity is not None:
+        event_seats = await db.run_sync(seats.ensure, event.id)
+        if event_seats.taken > event.capacity:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"{event.name} already has {event_seats.taken} registrations, "
+                "the capacity can't be less than that",
+            )
+    await db.run_sync(http_cache.bump, "events")
+    await db.commit()
+    await response_cache.invalidate("events", f"events:{event.id}")
+    await db.refresh(event)
     return event
 
 
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
-def delete_event(
+async def delete_event(
     data: schema.EventDelete,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_db),
     _: schema.MemberOut = Depends(oauth2.get_current_member),
 ):
-    event = db.exec(select(Events).where(Events.id == data.id)).first()
+    event = (await db.exec(select(Events).where(Events.id == data.id))).first()
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Event does not exist"
         )
-    db.delete(event)
-    db.commit()
+    await db.delete(event)
+    event_seats = await db.get(Event_Seats, data.id)
+    if event_seats:
+        await db.delete(event_seats)
+    await db.run_sync(counters.add, "events_count", -1)
+    await db.run_sync(http_cache.bump, "events")
+    await db.commit()
+    await response_cache.invalidate("events", f"events:{data.id}")
 
 
 @router.post("/register")
-def register_event(
+async def register_event(
     data: schema.RegisterEventCreate,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_db),
     current_user: schema.UserOut = Depends(oauth2.get_current_user),
 ):
-    event = db.exec(select(Events).where(Events.id == data.event_id)).first()
+    event = (await db.exec(select(Events).where(Events.id == data.event_id))).first()
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Event does not exist"
@@ -112,7 +178,7 @@ def register_event(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Screenshot of the payment ₹{event.fee} is required for verification"
             )
-        if not Path(f"payment_proof/{data.screenshot_id}").exists():
+        if not await db.get(Payment_Proofs, data.screenshot_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Did you upload the screenshot? We couldn't able to find that screenshot which belongs to that ID"
@@ -125,32 +191,161 @@ def register_event(
     event_reg_data["user_reg_no"] = current_user.reg_no
     event_reg_data["status"] = payment_status
     event_reg = Event_Registeration(**event_reg_data)
+    # Checked before taking a seat, so a registered user gets told so even when the event is full
+    if await db.get(Event_Registeration, (current_user.reg_no, event.id)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You have already registed for this event")
+    # The seat is the first write of the transaction, the registration is rolled back with it if it fails
+    if event.capacity is not None and not await db.run_sync(seats.take, event.id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"{event.name} is full"
+        )
     try:
         db.add(event_reg)
-        db.commit()
-        db.refresh(event_reg)
+        await db.run_sync(counters.add, "registrations_count")
+        await db.run_sync(http_cache.bump, "event_registeration")
+        if event_reg.status == "verified" and event_reg.transaction_id:
+            await db.run_sync(counters.add, "verified_payments_count")
+        await db.commit()
+        await db.refresh(event_reg)
     except IntegrityError as e:
         if str(e.orig).endswith("transaction_id"):
             message = "Transaction ID already used"
-        elif str(e.orig).endswith("screenshot_url"):
-            message = "This screenshot url is already used"
+        elif str(e.orig).endswith("screenshot_id"):
+            message = "This screenshot is already used"
         else:
             message = "You have already registed for this event"
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message)
     return event_reg
 
-@router.get("/me")
-def get_my_events(db: Session = Depends(get_db), current_user: schema.UserOut = Depends(oauth2.get_current_user)):
-    my_events_reg = db.exec(select(Event_Registeration).where(Event_Registeration.user_reg_no == current_user.reg_no)).all()
-    my_events = []
-    for my_event_reg in my_events_reg:
-        my_events.append(
-            db.exec(select(Events).where(Events.id == my_event_reg.event_id)).first()
+@router.get("/me", response_model=list[schema.MyEventOut])
+async def get_my_events(
+    response: Response,
+    payment_status: schema.PaymentStatus | None = Query(None, alias="status"),
+    upcoming: bool = Query(False),
+    past: bool = Query(False),
+    page: PageParams = Depends(),
+    db: DBSession = Depends(get_db),
+    current_user: schema.UserOut = Depends(oauth2.get_current_user),
+):
+    """
+    Registrations of the current user along with their events, latest event first.
+    The next page is requested with the X-Next-Cursor header of the response as cursor
+    """
+    if upcoming and past:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You can't use both past and upcoming at the same time",
+        )
+    # Registrations and their events in a single query
+    query = (
+        select(Event_Registeration, Events)
+        .join(Events, Events.id == Event_Registeration.event_id)
+        .where(Event_Registeration.user_reg_no == current_user.reg_no)
+    )
+    if payment_status:
+        query = query.where(Event_Registeration.status == payment_status.value)
+    if upcoming:
+        query = query.where(Events.start > datetime.now(IST))
+    elif past:
+        query = query.where(Events.start <= datetime.now(IST))
+    rows = (await db.exec(keyset(query, [Events.start, Events.id], page, descending=True))).all()
+    rows = next_page(rows, page, lambda row: (row[1].start, row[1].id), response)
+    return [{**event_reg.model_dump(), "event": event} for event_reg, event in rows]
+
+@router.get("/verify", response_model=list[schema.PendingRegistrationOut])
+async def get_pending_verification(
+    response: Response,
+    event_id: UUID | None = Query(None),
+    page: PageParams = Depends(),
+    db: DBSession = Depends(get_db),
+    _: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    """
+    Registrations waiting for their payment to be verified along with their users, by event.
+    The next page is requested with the X-Next-Cursor header of the response as cursor
+    """
+    query = (
+        select(Event_Registeration, Users)
+        .join(Users, Users.reg_no == Event_Registeration.user_reg_no, isouter=True)
+        .where(Event_Registeration.status == schema.PaymentStatus.PENDING.value)
+    )
+    if event_id:
+        query = query.where(Event_Registeration.event_id == event_id)
+    await db.run_sync(set_total_count, query, page, response)
+    sort_columns = [Event_Registeration.event_id, Event_Registeration.user_reg_no]
+    rows = (await db.exec(keyset(query, sort_columns, page))).all()
+    rows = next_page(rows, page, lambda row: (row[0].event_id, row[0].user_reg_no), response)
+    return [{**event_reg.model_dump(), "user": user} for event_reg, user in rows]
+
+
+def apply_decisions(db: Session, decisions: list[schema.VerificationDecision]) -> list[dict]:
+    """
+    Sets the status of the pending registrations of decisions with a single UPDATE, as part of the caller's
+    transaction. Returns the result of every decision
+    """
+    key = tuple_(Event_Registeration.user_reg_no, Event_Registeration.event_id)
+    pairs = [(decision.user_reg_no, decision.event_id) for decision in decisions]
+    verified = [pair for pair, decision in zip(pairs, decisions) if decision.decision == schema.PaymentDecision.VERIFY]
+    new_status = case((key.in_(verified), schema.PaymentStatus.VERIFY.value), else_=schema.PaymentStatus.REJECT.value)
+    updated = db.execute(
+        update(Event_Registeration)
+        .where(Event_Registeration.status == schema.PaymentStatus.PENDING.value, key.in_(pairs))
+        .values(status=new_status)
+        .returning(
+            Event_Registeration.user_reg_no,
+            Event_Registeration.event_id,
+            Event_Registeration.status,
+            Event_Registeration.transaction_id,
         )
-    return {"events": my_events, "events_reg": my_events_reg}
+        .execution_options(synchronize_session=False)
+    ).all()
+    current = {(row[0], row[1]): row[2] for row in updated}
+    # Only the payments with a transaction id are counted, like in register_event()
+    newly_verified = sum(1 for row in updated if row[2] == schema.PaymentStatus.VERIFY.value and row[3])
+    if newly_verified:
+        counters.add(db, "verified_payments_count", newly_verified)
+    seats.release(db, [row[1] for row in updated if row[2] == schema.PaymentStatus.REJECT.value])
+    if updated:
+        http_cache.bump(db, "event_registeration")
 
-@router.get("/verify", response_model=list[schema.RegisterEventOut])
-def get_pending_verification(db: Session = Depends(get_db), _: schema.MemberOut = Depends(oauth2.get_current_member)):
-    events_reg = db.exec(select(Event_Registeration).where(Event_Registeration.status == "pending")).all()
-    return events_reg
+    unchanged = [pair for pair in pairs if pair not in current]
+    if unchanged:
+        rows = db.execute(
+            select(Event_Registeration.user_reg_no, Event_Registeration.event_id, Event_Registeration.status)
+            .where(key.in_(unchanged))
+        ).all()
+        existing = {(row[0], row[1]): row[2] for row in rows}
+    else:
+        existing = {}
+    return [
+        {
+            "user_reg_no": pair[0],
+            "event_id": pair[1],
+            "updated": pair in current,
+            "status": current.get(pair) or existing.get(pair),
+        }
+        for pair in pairs
+    ]
+
+
+@router.post("/verify", response_model=list[schema.VerificationResult])
+async def verify_payments(
+    data: schema.BulkVerification,
+    db: DBSession = Depends(get_db),
+    _: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    """
+    Verifies or rejects the payments of up to 1000 pending registrations at once, in a single transaction.
+    Registrations which aren't pending anymore are left as they are (updated is false)
+    """
+    pairs = {(decision.user_reg_no, decision.event_id) for decision in data.decisions}
+    if len(pairs) != len(data.decisions):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A registration can only have one decision"
+        )
+    results = await db.run_sync(apply_decisions, data.decisions)
+    await db.commit()
+    return results
 
@@ -1,39 +1,236 @@
+"""
+The exports are streamed: rows are fetched BATCH_SIZE at a time with a server side cursor (yield_per)
+and every batch is written out as a CSV chunk (optionally gzip compressed) before the next one is fetched,
+so the memory stays the same whatever the size of the table is.
+The streams read through the sync engine, Starlette iterates them in the threadpool so the CSV/ZIP/gzip work
+doesn't run on the event loop.
+
+/export/snapshot streams a ZIP with the CSV of every table plus a manifest.json (row count and SHA-256 of each CSV).
+All the tables are read in a single read transaction so they are consistent with each other.
+When the manifest of a previous snapshot is posted, the tables whose row count and checksum didn't change
+are left out of the archive, which is also how an interrupted backup is resumed.
+"""
+
+import os
 import csv
+import json
+import zlib
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from hashlib import sha256
 from io import StringIO
-from fastapi import APIRouter, Depends
+from typing import Iterable, Iterator
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.responses import StreamingResponse
-from sqlmodel import Session, select
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import SQLModel, select
 from app import oauth2, schema
-from app.db.db import get_db
+from app.config import IST
+from app.db.db import DBSession, get_db, get_engine
 from app.db.models import Blogs, Event_Registeration, Events, Mailing_List, Users, Members
 
+BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+TABLES: dict[str, type[SQLModel]] = {
+    "users": Users,
+    "members": Members,
+    "events": Events,
+    "event_registeration": Event_Registeration,
+    "blogs": Blogs,
+    "mailing_list": Mailing_List,
+}
+
 router = APIRouter(prefix="/export")
 
+
+def accepts_gzip(request: Request) -> bool:
+    for encoding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = encoding.strip().partition(";")
+        if name.strip().lower() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+def csv_chunks(
+    conn: Connection,
+    model: type[SQLModel],
+    columns: list[str],
+    stats: dict[str, int] | None = None,
+) -> Iterator[bytes]:
+    """
+    Yields the CSV of those columns one batch of rows at a time, ordered by the primary key.
+    The number of rows is added to stats["rows"]
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    query = select(*(getattr(model, column) for column in columns)).order_by(
+        *model.__table__.primary_key.columns
+    )
+    # Plain rows from the connection, there is no need to build the ORM objects just to write them out
+    result = conn.execution_options(yield_per=BATCH_SIZE).execute(query)
+    for rows in result.partitions():
+        writer.writerows(rows)
+        if stats is not None:
+            stats["rows"] = stats.get("rows", 0) + len(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def table_chunks(engine: Engine, model: type[SQLModel], columns: list[str]) -> Iterator[bytes]:
+    with engine.connect() as conn:
+        yield from csv_chunks(conn, model, columns)
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31 writes the gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+@contextmanager
+def snapshot_connection(engine: Engine) -> Iterator[Connection]:
+    """
+    Connection whose queries all see the database at the same point in time
+    """
+    with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite only begins a transaction before INSERT/UPDATE/DELETE, never for SELECT
+            conn.exec_driver_sql("BEGIN")
+        else:
+            conn.execution_options(isolation_level="REPEATABLE READ")
+        yield conn
+
+
+class ZipStream:
+    """
+    Write only file for zipfile which keeps just the bytes that are not streamed out yet
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def table_checksum(conn: Connection, model: type[SQLModel], columns: list[str]) -> tuple[int, str]:
+    stats = {"rows": 0}
+    digest = sha256()
+    for chunk in csv_chunks(conn, model, columns, stats):
+        digest.update(chunk)
+    return stats["rows"], digest.hexdigest()
+
+
+def snapshot_chunks(
+    engine: Engine, previous: dict[str, schema.SnapshotTable] | None = None
+) -> Iterator[bytes]:
+    stream = ZipStream()
+    manifest = {"created_at": datetime.now(IST).isoformat(), "tables": {}}
+    with snapshot_connection(engine) as conn:
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, model in TABLES.items():
+                columns = list(model.__annotations__.keys())
+                old = (previous or {}).get(name)
+                if old:
+                    # Checksum pass without writing anything, within the same transaction
+                    rows, checksum = table_checksum(conn, model, columns)
+                    if (rows, checksum) == (old.rows, old.sha256):
+                        manifest["tables"][name] = {
+                            "rows": rows,
+                            "sha256": checksum,
+                            "columns": columns,
+                            "unchanged": True,
+                        }
+                        continue
+                stats = {"rows": 0}
+                digest = sha256()
+                with archive.open(f"{name}.csv", "w", force_zip64=True) as member:
+                    for chunk in csv_chunks(conn, model, columns, stats):
+                        digest.update(chunk)
+                        member.write(chunk)
+                        data = stream.pop()
+                        if data:
+                            yield data
+                manifest["tables"][name] = {
+                    "rows": stats["rows"],
+                    "sha256": digest.hexdigest(),
+                    "columns": columns,
+                    "file": f"{name}.csv",
+                }
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    yield stream.pop()
+
+
 @router.get("/")
-def get_export(
+async def get_export(
+    request: Request,
     table: schema.Tables,
-    db: Session = Depends(get_db), 
+    columns: list[str] | None = Query(None),
+    db: DBSession = Depends(get_db),
     _: schema.MemberOut = Depends(oauth2.get_current_member)
 ):
-    table_map = {
-        "users": Users,
-        "members": Members,
-        "events": Events,
-        "event_registeration": Event_Registeration,
-        "blogs": Blogs,
-        "mailing_list": Mailing_List
-    }
-    db_data = db.exec(select(table_map[table.value])).all()
-    mem_data = StringIO()
-    writer = csv.writer(mem_data)
-    csv_title = list(table_map[table.value].__annotations__.keys())
-    writer.writerow(csv_title)
-    for data in db_data:
-        data_dict = data.model_dump()
-        ordered_data = []
-        for title in csv_title:
-            ordered_data.append(data_dict[title])
-        writer.writerow(ordered_data)
-    mem_data.seek(0)
-    return StreamingResponse(mem_data, media_type="text/csv")
+    model = TABLES[table.value]
+    table_columns = list(model.__annotations__.keys())
+    if columns:
+        unknown = [column for column in columns if column not in table_columns]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown columns for {table.value}: {', '.join(unknown)}",
+            )
+    chunks = table_chunks(get_engine(db), model, columns or table_columns)
+    headers = {"Content-Disposition": f'attachment; filename="{table.value}.csv"'}
+    if accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+        chunks = gzip_chunks(chunks)
+    return StreamingResponse(chunks, media_type="text/csv", headers=headers)
+
+
+def snapshot_response(chunks: Iterator[bytes]) -> StreamingResponse:
+    file_name = f"acm-snapshot-{datetime.now(IST).strftime('%Y%m%d-%H%M%S')}.zip"
+    return StreamingResponse(
+        chunks,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'},
+    )
+
+
+@router.get("/snapshot")
+async def get_snapshot(
+    db: DBSession = Depends(get_db),
+    _: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    """
+    Full backup of the database as a ZIP of CSV files
+    """
+    return snapshot_response(snapshot_chunks(get_engine(db)))
 
+
+@router.post("/snapshot")
+async def get_snapshot_since(
+    previous: schema.SnapshotManifest,
+    db: DBSession = Depends(get_db),
+    _: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    """
+    Same as GET /export/snapshot but leaves out the tables which didn't change since the posted manifest.json
+    """
+    return snapshot_response(snapshot_chunks(get_engine(db), previous.tables))
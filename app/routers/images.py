@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from app.utils import images
+from app import schema, oauth2
+
+router = APIRouter(prefix="/images")
+
+
+@router.post("/", response_model=schema.ImageOut, status_code=status.HTTP_201_CREATED)
+async def upload_image(
+    kind: schema.ImageKind = Query(...),
+    image_file: UploadFile = File(),
+    _: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    """
+    Event poster or member avatar, the returned url goes into image_url / avatar_url
+    """
+    if not image_file.filename:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The image has no file name"
+        )
+    url = await images.store(image_file, kind.value)
+    return {"url": url, "variants": images.variants(url)}
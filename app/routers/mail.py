@@ -1,10 +1,17 @@
+from datetime import datetime
+from uuid import UUID
 from pydantic import EmailStr
 from email_validator import validate_email, EmailUndeliverableError
-from fastapi import APIRouter, status, HTTPException, Depends
-from sqlmodel import Session, select
+from fastapi import APIRouter, Query, Request, status, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import func, select
 from sqlalchemy.exc import IntegrityError
-from app.db.db import get_db
-from app.db.models import Mailing_List
+from app import oauth2, schema
+from app.config import IST
+from app.db.db import DBSession, get_db, get_engine, get_write_db
+from app.db.models import Campaign, Mailing_List
+from app.utils import campaign as campaign_utils
+from app.utils.rate_limit import RateLimit
 
 router = APIRouter(prefix="/mail", tags=["Mail"])
 
@@ -12,6 +19,7 @@ router = APIRouter(prefix="/mail", tags=["Mail"])
 @router.get(
     "/subscribe",
     status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(RateLimit("subscribe"))],
     responses={
         201: {
             "description": "Successful Response",
@@ -35,14 +43,15 @@ router = APIRouter(prefix="/mail", tags=["Mail"])
         },
     },
 )
-def subscribe(email: EmailStr, db: Session = Depends(get_db)):
+async def subscribe(email: EmailStr, db: DBSession = Depends(get_write_db)):
     """
     Adds the email to mailing list
     """
     try:
-        email = validate_email(email, check_deliverability=True).normalized # Checks if the domain can get email
+        # Checks if the domain can get email
+        email = (await run_in_threadpool(validate_email, email, check_deliverability=True)).normalized
         db.add(Mailing_List(email=email))
-        db.commit()
+        await db.commit()
     except IntegrityError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -76,16 +85,64 @@ def subscribe(email: EmailStr, db: Session = Depends(get_db)):
         },
     },
 )
-def unsubscribe(email: EmailStr, db: Session = Depends(get_db)):
+async def unsubscribe(email: EmailStr, db: DBSession = Depends(get_write_db)):
     """
     Removes the email from mailing list
     """
-    res = db.exec(select(Mailing_List).where(Mailing_List.email == email)).first()
+    res = (await db.exec(select(Mailing_List).where(Mailing_List.email == email))).first()
     if not res:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Oops! Your email not found in our mailing list",
         )
-    db.delete(res)
-    db.commit()
+    await db.delete(res)
+    await db.commit()
     return {"msg": "You've successfully unsubscribed to our mailing list"}
+
+
+@router.post(
+    "/campaign",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schema.CampaignOut,
+)
+async def create_campaign(
+    request: Request,
+    data: schema.CampaignCreate,
+    db: DBSession = Depends(get_db),
+    current_member: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    """
+    Sends the mail to everyone in the mailing list in the background
+    """
+    campaign = Campaign(
+        subject=data.subject,
+        body=data.body,
+        unsubscribe_url=f"{request.url.scheme}://{request.url.hostname}/mail/unsubscribe",
+        status=schema.CampaignStatus.PENDING.value,
+        rate=campaign_utils.DEFAULT_RATE if data.rate is None else data.rate,
+        total=(await db.exec(select(func.count()).select_from(Mailing_List))).one(),
+        created_by=current_member.email,
+        created_at=datetime.now(IST),
+    )
+    db.add(campaign)
+    await db.commit()
+    await db.refresh(campaign)
+    campaign_utils.start(get_engine(db), campaign.id)
+    return campaign_utils.report(campaign)
+
+
+@router.get("/campaign", response_model=schema.CampaignOut)
+async def get_campaign(
+    _id: UUID = Query(..., alias="id"),
+    db: DBSession = Depends(get_db),
+    _: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    """
+    Shows the progress and the throughput of the campaign
+    """
+    campaign = await db.get(Campaign, _id)
+    if not campaign:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Campaign does not exist"
+        )
+    return campaign_utils.report(campaign)
@@ -1,23 +1,30 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, Query, status, HTTPException
+from fastapi import APIRouter, Depends, Query, Request, Response, status, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
-from app.db.db import get_db
-from app.config import IST
-from app.utils.security import check_pass, hash_, verify
+from app.db.db import DBSession, get_db
+from app.utils.security import check_pass, hash_async, needs_rehash, verify_async
 from email_validator import validate_email
 from app.db.models import Members, Auth
+from app.utils import counters, http_cache
+from app.utils.cache import response_cache
+from app.utils.rate_limit import RateLimit
+from app.utils.serialization import columns, dump_json
+from app.utils.pagination import PageParams, keyset, model_key, next_page, set_total_count
 from .. import config, schema, oauth2
 
 router = APIRouter(prefix="/members", tags=["Members"])
 
 
 @router.post("/", response_model=schema.MemberOut, status_code=status.HTTP_201_CREATED)
-def create_member(data: schema.MemberCreate, db: Session = Depends(get_db)):
-    data.email = validate_email(data.email, check_deliverability=True).normalized
+async def create_member(data: schema.MemberCreate, db: DBSession = Depends(get_db)):
+    data.email = (
+        await run_in_threadpool(validate_email, data.email, check_deliverability=True)
+    ).normalized
     check_pass(data.password)
-    data.password = hash_(data.password)
+    data.password = await hash_async(data.password)
     _data = data.model_dump()
     _data["position"] = data.position.value
     _data["team"] = data.team.value
@@ -28,99 +35,143 @@ def create_member(data: schema.MemberCreate, db: Session = Depends(get_db)):
         db.add(member)
         auth = Auth(email=data.email, password=data.password, account_type="member")
         db.add(auth)
-        db.commit()
-        db.refresh(member)
+        await db.run_sync(counters.add, "members_count")
+        await db.run_sync(http_cache.bump, "members")
+        await db.commit()
+        await response_cache.invalidate("members")
+        await db.refresh(member)
     except IntegrityError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Member already exist"
         )
-    member.joined_at = member.joined_at.astimezone(config.IST)
     return member
 
 
-@router.post("/login")
-def login_member(
-    data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+@router.post("/login", dependencies=[Depends(RateLimit("login", email_field="username"))])
+async def login_member(
+    data: OAuth2PasswordRequestForm = Depends(), db: DBSession = Depends(get_db)
 ):
-    auth = db.exec(
-        select(Auth)
-        .where(Auth.email == data.username)
-        .where(Auth.account_type == "member")
+    auth = (
+        await db.exec(
+            select(Auth)
+            .where(Auth.email == data.username)
+            .where(Auth.account_type == "member")
+        )
     ).first()
-    if not auth or not verify(data.password, auth.password):
+    if not auth or not await verify_async(data.password, auth.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials"
         )
+    # Upgrades the hash if the bcrypt cost was changed since the password was set
+    if needs_rehash(auth.password):
+        auth.password = await hash_async(data.password)
+        await db.commit()
     access_token = oauth2.create_access_token(
         {"email": auth.email, "account_type": "member"}
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@router.get("/search", response_model=list[schema.MemberOut])
-def search_member(
+@router.get(
+    "/search",
+    response_model=list[schema.MemberOut],
+    dependencies=[Depends(http_cache.Conditional("members"))],
+)
+async def search_member(
+    request: Request,
+    response: Response,
     team: schema.TeamType | None = None,
     season: int | None = Query(None, ge=1),
     position: schema.PositionType | None = None,
     chapter: schema.ChapterType | None = None,
-    db: Session = Depends(get_db),
+    sort: schema.MemberSort = schema.MemberSort.JOINED_AT,
+    order: schema.SortOrder = schema.SortOrder.ASC,
+    page: PageParams = Depends(),
+    db: DBSession = Depends(get_db),
 ):
-    query = select(Members)
-    filters = {}
-    if team:
-        filters["team"] = team.value
-    if season:
-        filters["season"] = season
-    if position:
-        filters["position"] = position.value
-    if chapter:
-        filters["chapter"] = chapter.value
-
-    if filters:
-        query = query.filter_by(**filters)
-
-    members = db.exec(query).all()
-
-    if members:
-        for member in members:
-            member.joined_at = member.joined_at.astimezone(IST)
-    return members
+    def search(db: Session, response: Response) -> bytes:
+        query = select(Members)
+        filters = {}
+        if team:
+            filters["team"] = team.value
+        if season:
+            filters["season"] = season
+        if position:
+            filters["position"] = position.value
+        if chapter:
+            filters["chapter"] = chapter.value
+
+        if filters:
+            query = query.filter_by(**filters)
+
+        set_total_count(
+            db, query, page, response, None if filters else Members.__tablename__
+        )
+        # reg_no is unique so it is also the tiebreak of joined_at
+        sort_columns = [getattr(Members, sort.value)]
+        if sort != schema.MemberSort.REG_NO:
+            sort_columns.append(Members.reg_no)
+        members = db.execute(
+            keyset(query.with_only_columns(*columns(Members, schema.MemberOut)), sort_columns, page, order == schema.SortOrder.DESC)
+        ).all()
+        members = next_page(members, page, model_key(sort_columns), response)
+        return dump_json(schema.MemberOut, members)
+
+    params = {
+        "team": team,
+        "season": season,
+        "position": position,
+        "chapter": chapter,
+        "sort": sort,
+        "order": order,
+        "page": page,
+        "versions": http_cache.versions(request),
+    }
+    return await response_cache.respond(
+        "members/search", params, ["members"], response, lambda res: db.run_sync(search, res)
+    )
 
 
 @router.patch("/")
-def update_member(
+async def update_member(
     data: schema.MemberUpdate,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_db),
     current_member: schema.MemberOut = Depends(oauth2.get_current_member),
 ):
     email = current_member.email
-    member = db.exec(select(Members).where(Members.email == email)).first()
+    member = (await db.exec(select(Members).where(Members.email == email))).first()
     if member:
         for k, v in data.model_dump().items():
             if k.startswith("new_") and v is not None:
                 setattr(member, k.replace("new_", ""), v)
-        db.commit()
-        db.refresh(member)
+        await db.run_sync(http_cache.bump, "members")
+        await db.commit()
+        await response_cache.invalidate("members")
+        await db.refresh(member)
+        oauth2.principal_cache.invalidate(email, member.email)
     return member
 
 
 @router.post("/reset_password")
-def reset_password_member(
+async def reset_password_member(
     data: schema.SetResetPassword,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_db),
     current_member: schema.MemberOut = Depends(oauth2.get_current_member),
 ):
     email = current_member.email
-    auth = db.exec(
-        select(Auth).where(Auth.email == email).where(Auth.account_type == "member")
+    auth = (
+        await db.exec(
+            select(Auth).where(Auth.email == email).where(Auth.account_type == "member")
+        )
     ).first()
     check_pass(data.new_password)
     if auth:
-        auth.password = hash_(data.new_password)
-        db.commit()
+        auth.password = await hash_async(data.new_password)
+        await db.commit()
+        oauth2.principal_cache.invalidate(email)
     return {"msg": "Successfully Updated your password"}
 
 
 @router.get("/me", response_model=schema.MemberOut)
-def get_member(current_member: schema.MemberOut = Depends(oauth2.get_current_member)):
+async def get_member(current_member: schema.MemberOut = Depends(oauth2.get_current_member)):
     return current_member
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends
+from app import schema, oauth2
+from app.db.db import db_router
+from app.utils import mail, security
+from app.utils.cache import response_cache
+from app.utils.rate_limit import rate_limiter
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get("/")
+async def get_metrics(_: schema.MemberOut = Depends(oauth2.get_current_member)):
+    """
+    Shows the internal counters of the server like password hashing queue and latency
+    """
+    return {
+        "password_hashing": security.hasher.metrics(),
+        "mail": mail.get_sender().metrics(),
+        "auth_cache": oauth2.principal_cache.metrics(),
+        "response_cache": await response_cache.metrics(),
+        "db_routing": db_router.metrics(),
+        "rate_limit": await rate_limiter.metrics(),
+    }
@@ -1,40 +1,51 @@
-from pathlib import Path
-from secrets import token_urlsafe
-from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile, status
 from fastapi.responses import FileResponse
-from app.utils.security import is_valid_image
+from app.db.db import DBSession, get_db
+from app.db.models import Payment_Proofs
+from app.utils import payment_proofs
 from app import schema, oauth2
 
 router = APIRouter(prefix="/payment_proof")
 
+
+def get_uploader(token: str | None = Depends(oauth2.oauth2_scheme_no_error)) -> str | None:
+    # Uploading doesn't need an account, the uploader is recorded when there is a valid token
+    if not token:
+        return None
+    try:
+        return oauth2.get_payload(token, HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)).get("email")
+    except HTTPException:
+        return None
+
+
 @router.post("/")
-async def upload_payment_screenshot(image_file: UploadFile = File()):
-    file_content = await image_file.read()
+async def upload_payment_screenshot(
+    request: Request,
+    image_file: UploadFile = File(),
+    uploader: str | None = Depends(get_uploader),
+    db: DBSession = Depends(get_db),
+):
     file_name = image_file.filename
     if not file_name:
         raise HTTPException(
             status_code=status.HTTP_418_IM_A_TEAPOT,
             detail="o.o You don't have the screenshot image?"
         )
-    if not is_valid_image(file_name, file_content):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Only JPG, JPEG and PNG image files are allowed"
-        )
-    ID = token_urlsafe(32)
-    new_filename = f"{ID}.{file_name.split('.')[-1]}"
-    file_path = Path("payment_proof") / new_filename
-    with file_path.open("wb") as buffer:
-        buffer.write(file_content)
-    return {"screenshot_id": new_filename}
+    proof, duplicate = await payment_proofs.store(
+        db, image_file, uploader, request.client.host if request.client else None
+    )
+    return {"screenshot_id": proof.id, "duplicate": duplicate}
 
 @router.get("/view")
-def get_payment_screenshot(_id: str = Query(..., alias="id"), _: schema.MemberOut = Depends(oauth2.get_current_member)):
-    screenshot_path = Path("payment_proof") / _id
-    if not screenshot_path.exists():
+async def get_payment_screenshot(
+    _id: str = Query(..., alias="id"),
+    db: DBSession = Depends(get_db),
+    _: schema.MemberOut = Depends(oauth2.get_current_member),
+):
+    proof = await db.get(Payment_Proofs, _id)
+    if not proof:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="There isn't any Screenshot which belongs to that ID"
         )
-    return FileResponse(screenshot_path)
-
+    return FileResponse(payment_proofs.path_of(proof))
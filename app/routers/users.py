@@ -1,41 +1,52 @@
 """
 NOTES:
     1) Since we are using SQLite, SQLite doesn't store timezone information in database so we have to specify the timezone explictly using .astimezone() in datetime object
-    2) pretend_like_sending_mail() is used to prevent User Account Enumeration Attack. It will wait for few seconds which is almost the same seconds as the time it took to send the actual mail
+    2) POST /users/verify and /users/forgot_password are padded to the same response time by the EqualTimingMiddleware (see main.py) to prevent User Account Enumeration Attack
     3) Mostly it will give the same error message if it's caused by the actual error or if the user account is not found.
         Example:
             Gives Invalid/Expired Verification Token even if the user account doesn't exist or the user already verified
+    4) Login, signup and forgot_password are rate limited per address and per email (see app/utils/rate_limit.py)
 """
 
 from datetime import datetime, timedelta
 from secrets import token_urlsafe
 from fastapi import APIRouter, HTTPException, Request, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from fastapi.responses import HTMLResponse
 from pydantic import EmailStr
 from sqlalchemy.exc import IntegrityError
-from sqlmodel import Session, select
+from sqlmodel import select
 from email_validator import validate_email
 from app.config import IST
-from app.db.db import get_db
+from app.db.db import DBSession, get_db, get_write_db
 from app.db.models import Auth, Users, Verify, ResetPassword
+from app.utils import counters, http_cache
+from app.utils.rate_limit import RateLimit
 from app.utils.mail import send, verification_mail, reset_password_mail
-from app.utils.security import check_pass, hash_, verify, pretend_like_sending_mail
+from app.utils.security import check_pass, hash_async, needs_rehash, verify_async
 from .. import schema, oauth2
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schema.UserOut)
-def create_user(
-    request: Request, data: schema.CreateUser, db: Session = Depends(get_db)
+@router.post(
+    "/",
+    status_code=status.HTTP_201_CREATED,
+    response_model=schema.UserOut,
+    dependencies=[Depends(RateLimit("signup"))],
+)
+async def create_user(
+    request: Request, data: schema.CreateUser, db: DBSession = Depends(get_db)
 ):
     check_pass(data.password)
     # Checks whether the email domain can get emails and normalize the email
-    data.email = validate_email(data.email, check_deliverability=True).normalized
+    data.email = (
+        await run_in_threadpool(validate_email, data.email, check_deliverability=True)
+    ).normalized
     # Adds login details to Auth table
     user_auth = Auth(
-        email=data.email, password=hash_(data.password), account_type="user"
+        email=data.email, password=await hash_async(data.password), account_type="user"
     )
     # Crafting required data to store in Users table
     user_data = data.model_dump()
@@ -45,8 +56,10 @@ def create_user(
     try:
         db.add(user)
         db.add(user_auth)
-        db.commit()
-        db.refresh(user)
+        await db.run_sync(counters.add, "users_count")
+        await db.run_sync(http_cache.bump, "users")
+        await db.commit()
+        await db.refresh(user)
     except IntegrityError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="User already exist"
@@ -54,7 +67,7 @@ def create_user(
     # Adds the verify token to Verify table for to use when the user clicks on the verify button in email
     verification_token = token_urlsafe(32)
     db.add(Verify(email=data.email, token=verification_token, time=datetime.now(IST)))
-    db.commit()
+    await db.commit()
     # Send verification email to the user
     verify_link = f"{request.url.scheme}://{request.url.hostname}/users/verify?token={verification_token}&email={data.email}"
     # Only send email if the email is not test mail
@@ -73,21 +86,27 @@ def create_user(
     return user
 
 
-@router.post("/login")
-def login_user(
-    data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+@router.post("/login", dependencies=[Depends(RateLimit("login", email_field="username"))])
+async def login_user(
+    data: OAuth2PasswordRequestForm = Depends(), db: DBSession = Depends(get_db)
 ):
-    auth = db.exec(
-        select(Auth)
-        .where(Auth.email == data.username)
-        .where(Auth.account_type == "user")
+    auth = (
+        await db.exec(
+            select(Auth)
+            .where(Auth.email == data.username)
+            .where(Auth.account_type == "user")
+        )
     ).first()
-    if not auth or not verify(data.password, auth.password):
+    if not auth or not await verify_async(data.password, auth.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials"
         )
+    # Upgrades the hash if the bcrypt cost was changed since the password was set
+    if needs_rehash(auth.password):
+        auth.password = await hash_async(data.password)
+        await db.commit()
     # Checks whether the user verified their account or not
-    user = db.exec(select(Users).where(Users.email == data.username)).first()
+    user = (await db.exec(select(Users).where(Users.email == data.username))).first()
     if not user or not user.verified:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Account Not Verified Yet"
@@ -99,18 +118,19 @@ def login_user(
 
 
 @router.get("/verify")
-def verify_user(token: str, email: EmailStr, db: Session = Depends(get_db)):
-    verify = db.exec(select(Verify).where(Verify.email == email)).first()
+async def verify_user(token: str, email: EmailStr, db: DBSession = Depends(get_write_db)):
+    verify = (await db.exec(select(Verify).where(Verify.email == email))).first()
     # Checks whether the token is correct or not
     if verify and verify.token == token:
         verify.time = verify.time.astimezone(IST)
         # Only valid if verified within 10 minutes
         if datetime.now(IST) <= verify.time + timedelta(minutes=10):
-            db.delete(verify)
-            user_data = db.exec(select(Users).where(Users.email == email)).first()
+            await db.delete(verify)
+            user_data = (await db.exec(select(Users).where(Users.email == email))).first()
             if user_data:
                 user_data.verified = True
-            db.commit()
+            await db.commit()
+            oauth2.principal_cache.invalidate(email)
             return {"msg": "Verified successfully"}
     # Sends the same message for both invalid/expire token and user not found
     raise HTTPException(
@@ -120,14 +140,14 @@ def verify_user(token: str, email: EmailStr, db: Session = Depends(get_db)):
 
 
 @router.post("/verify")
-def send_verify_user_mail(
-    request: Request, data: schema.Verify, db: Session = Depends(get_db)
+async def send_verify_user_mail(
+    request: Request, data: schema.Verify, db: DBSession = Depends(get_db)
 ):
-    user = db.exec(select(Users).where(Users.email == data.email)).first()
+    user = (await db.exec(select(Users).where(Users.email == data.email))).first()
     verification_token = token_urlsafe(32)
 
     if user and not user.verified:
-        verify = db.exec(select(Verify).where(Verify.email == data.email)).first()
+        verify = (await db.exec(select(Verify).where(Verify.email == data.email))).first()
         if verify:
             # Since we are using SQLite
             # SQLite doesn't store timezone information so we have to specify the timezone explictly again
@@ -142,7 +162,7 @@ def send_verify_user_mail(
                 )
             verify.token = verification_token
             verify.time = datetime.now(IST)
-            db.commit()
+            await db.commit()
 
         verify_link = f"{request.url.scheme}://{request.url.hostname}/users/verify?token={verification_token}&email={data.email}"
         send(
@@ -150,23 +170,23 @@ def send_verify_user_mail(
             "ACM-SIST Account Verification",
             verification_mail(request, verify_link),
         )
-    else:
-        pretend_like_sending_mail()
     return {
         "msg": "You will get an email to verify your account if we found your account in our database and your account is not already verified"
     }
 
 
-@router.post("/forgot_password")
-def forgot_password(
-    request: Request, data: schema.ForgotPassword, db: Session = Depends(get_db)
+@router.post("/forgot_password", dependencies=[Depends(RateLimit("forgot_password"))])
+async def forgot_password(
+    request: Request, data: schema.ForgotPassword, db: DBSession = Depends(get_db)
 ):
-    auth = db.exec(
-        select(Auth).where(Auth.email == data.email).where(Auth.account_type == "user")
+    auth = (
+        await db.exec(
+            select(Auth).where(Auth.email == data.email).where(Auth.account_type == "user")
+        )
     ).first()
     if auth:
-        reset_pass = db.exec(
-            select(ResetPassword).where(ResetPassword.email == data.email)
+        reset_pass = (
+            await db.exec(select(ResetPassword).where(ResetPassword.email == data.email))
         ).first()
         reset_token = token_urlsafe(32)
         if reset_pass:
@@ -181,14 +201,14 @@ def forgot_password(
                 )
             reset_pass.time = datetime.now(IST)
             reset_pass.token = reset_token
-            db.commit()
+            await db.commit()
         else:
             db.add(
                 ResetPassword(
                     email=data.email, token=reset_token, time=datetime.now(IST)
                 )
             )
-            db.commit()
+            await db.commit()
         reset_url = f"{request.url.scheme}://{request.url.hostname}/users/reset_password?token={reset_token}&email={data.email}"
         if data.email.startswith("test-acm-sist"):
             from tests import test_users
@@ -198,16 +218,13 @@ def forgot_password(
             send(
                 [data.email], "Reset Password", reset_password_mail(request, reset_url)
             )
-    else:
-        # If the user account is not found
-        pretend_like_sending_mail()
     return {
         "msg": "You will get an email to reset your password if we found your account in our database"
     }
 
 
 @router.get("/reset_password")
-def get_reset_password(request: Request, email: EmailStr, token: str):
+async def get_reset_password(request: Request, email: EmailStr, token: str):
     """
     This endpoint is used by the forgot_password which sends the link to this endpoint through email
     Shows Reset Password Webpage
@@ -245,30 +262,33 @@ def get_reset_password(request: Request, email: EmailStr, token: str):
 
 
 @router.post("/reset_password")
-def reset_password(
+async def reset_password(
     data: schema.SetResetPassword,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_db),
     email: EmailStr | None = Depends(oauth2.get_current_user_email_or_none),
 ):
     # Runs this if block if the user gave all the required data to reset their password
     if data.reset_token and data.email:
-        reset_pass = db.exec(
-            select(ResetPassword).where(ResetPassword.email == data.email)
+        reset_pass = (
+            await db.exec(select(ResetPassword).where(ResetPassword.email == data.email))
         ).first()
         if reset_pass and reset_pass.token == data.reset_token:
             if data.new_password == data.confirm_password:
                 reset_pass.time = reset_pass.time.astimezone(IST)
                 if reset_pass.time + timedelta(minutes=10) >= datetime.now(IST):
-                    auth = db.exec(
-                        select(Auth)
-                        .where(Auth.email == data.email)
-                        .where(Auth.account_type == "user")
+                    auth = (
+                        await db.exec(
+                            select(Auth)
+                            .where(Auth.email == data.email)
+                            .where(Auth.account_type == "user")
+                        )
                     ).first()
                     if auth:
                         check_pass(data.new_password)
-                        auth.password = hash_(data.new_password)
-                        db.delete(reset_pass)
-                        db.commit()
+                        auth.password = await hash_async(data.new_password)
+                        await db.delete(reset_pass)
+                        await db.commit()
+                        oauth2.principal_cache.invalidate(data.email)
                         return {"msg": "Password Updated Successfully"}
                     # If auth is None then it will raise Invalid/Expired Token
                     # It shouldn't show that the user is not found
@@ -282,12 +302,13 @@ def reset_password(
         )
     # Runs this if block if the user is logged in
     if email:
-        auth = db.exec(select(Auth).where(Auth.email == email)).first()
+        auth = (await db.exec(select(Auth).where(Auth.email == email))).first()
         if auth:
             if data.new_password == data.confirm_password:
                 check_pass(data.new_password)
-                auth.password = hash_(data.new_password)
-                db.commit()
+                auth.password = await hash_async(data.new_password)
+                await db.commit()
+                oauth2.principal_cache.invalidate(email)
                 return {"msg": "Password Updated"}
             else:
                 raise HTTPException(
@@ -302,5 +323,5 @@ def reset_password(
 
 
 @router.get("/me", response_model=schema.UserOut)
-def get_user(current_user: schema.UserOut = Depends(oauth2.get_current_user)):
+async def get_user(current_user: schema.UserOut = Depends(oauth2.get_current_user)):
     return current_user
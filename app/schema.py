@@ -1,12 +1,50 @@
 from enum import Enum
+from typing import Annotated
 from uuid import UUID
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, PlainSerializer, computed_field
 from datetime import datetime, date
+from app.config import IST
+from app.utils import images
+
+
+# Sent in IST whatever the timezone of the value (SQLite gives them back without one)
+ISTDateTime = Annotated[datetime, PlainSerializer(lambda value: value.astimezone(IST), return_type=datetime)]
+
+
+class ImageKind(Enum):
+    EVENTS = "events"
+    MEMBERS = "members"
+
+
+class ImageVariants(BaseModel):
+    # JPEG of each size
+    thumbnail: str
+    card: str
+    full: str
+    # For <img srcset>, WebP and JPEG
+    srcset: str
+    jpeg_srcset: str
+
+
+class ImageOut(BaseModel):
+    url: str
+    variants: ImageVariants
+
+
+def variants_of(url: str | None) -> ImageVariants | None:
+    urls = images.variants(url)
+    return ImageVariants(**urls) if urls else None
 
 
 class PaymentStatus(Enum):
     PENDING = "pending"
     VERIFY = "verified"
+    REJECT = "rejected"
+
+
+class PaymentDecision(Enum):
+    VERIFY = "verified"
+    REJECT = "rejected"
 
 
 class ChapterType(Enum):
@@ -29,6 +67,22 @@ class PositionType(Enum):
     MEMBER = "member"
 
 
+class SortOrder(Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+class CountMode(Enum):
+    NONE = "none"
+    EXACT = "exact"
+    ESTIMATE = "estimate"
+
+
+class MemberSort(Enum):
+    JOINED_AT = "joined_at"
+    REG_NO = "reg_no"
+
+
 class Tables(Enum):
     USERS = "users"
     MEMBERS = "members"
@@ -38,12 +92,51 @@ class Tables(Enum):
     MAILING_LIST = "mailing_list"
 
 
+class CampaignStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+
+
+class SnapshotTable(BaseModel):
+    rows: int
+    sha256: str
+
+
+class SnapshotManifest(BaseModel):
+    tables: dict[str, SnapshotTable]
+
+
 class Mail(BaseModel):
     email: list[str]
     subject: str
     body: str
 
 
+class CampaignCreate(BaseModel):
+    subject: str = Field(..., min_length=1)
+    body: str = Field(..., min_length=1)
+    rate: float | None = Field(None, ge=0)
+
+
+class CampaignOut(BaseModel):
+    id: UUID
+    subject: str
+    status: CampaignStatus
+    rate: float
+    total: int
+    sent: int
+    failed: int
+    skipped: int
+    processed: int
+    created_by: str
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+    elapsed: float
+    throughput: float
+
+
 class UserBase(BaseModel):
     reg_no: int
     name: str = Field(..., min_length=2)
@@ -97,7 +190,12 @@ class MemberUpdate(BaseModel):
 
 
 class MemberOut(MemberBase):
-    joined_at: datetime
+    joined_at: ISTDateTime
+
+    @computed_field
+    @property
+    def avatar_variants(self) -> ImageVariants | None:
+        return variants_of(self.avatar_url)
 
 
 class Token(BaseModel):
@@ -129,6 +227,7 @@ class EventBase(BaseModel):
     venue: str
     fee: float
     image_url: str
+    capacity: int | None = Field(None, ge=1)
 
 
 class CreateEvent(EventBase):
@@ -145,6 +244,9 @@ class EventUpdate(BaseModel):
     new_venue: str | None = None
     new_fee: float | None = None
     new_image_url: str | None = None
+    new_capacity: int | None = Field(None, ge=1)
+    # Takes the limit off, new_capacity being None leaves it as it is
+    remove_capacity: bool = False
 
 
 class EventDelete(BaseModel):
@@ -153,6 +255,13 @@ class EventDelete(BaseModel):
 
 class EventOut(EventBase):
     id: UUID
+    start: ISTDateTime
+    end: ISTDateTime
+
+    @computed_field
+    @property
+    def image_variants(self) -> ImageVariants | None:
+        return variants_of(self.image_url)
 
 
 class RegisterEventBase(BaseModel):
@@ -170,6 +279,32 @@ class RegisterEventOut(RegisterEventBase):
     status: PaymentStatus
 
 
+class MyEventOut(RegisterEventOut):
+    event: EventOut
+
+
+class PendingRegistrationOut(RegisterEventOut):
+    user: UserOut | None
+
+
+class VerificationDecision(BaseModel):
+    user_reg_no: int
+    event_id: UUID
+    decision: PaymentDecision
+
+
+class BulkVerification(BaseModel):
+    decisions: list[VerificationDecision] = Field(..., min_length=1, max_length=1000)
+
+
+class VerificationResult(BaseModel):
+    user_reg_no: int
+    event_id: UUID
+    # Whether this request changed the registration, status is the current one (None if there is no such registration)
+    updated: bool
+    status: PaymentStatus | None
+
+
 class BlogBase(BaseModel):
     title: str
     description: str
@@ -194,3 +329,7 @@ class BlogDelete(BaseModel):
 class BlogOut(BlogBase):
     id: UUID
 
+class BlogSearchOut(BlogOut):
+    # Part of the description around the matched words, only when searching with q
+    snippet: str | None = None
+
@@ -0,0 +1,253 @@
+"""
+Server side cache of the read endpoints
+
+Responses are cached as the final JSON bytes plus the pagination headers, keyed by the endpoint and its parsed
+(so normalized) parameters. Every entry belongs to tags like "events" (any list of events) or "events:<id>"
+(lookups of that event). The key of an entry includes the current version of its tags, so invalidate() only has
+to bump the versions of the affected tags: the old entries can't be reached anymore and age out by TTL / LRU,
+and a response which was computed from data older than the invalidation can never be stored under the new key.
+Concurrent misses for the same key in a worker wait for the first one instead of all querying the database.
+
+The tag versions of the in memory backend only see the writes of their own worker, so the endpoints also have the
+Table_Versions which http_cache.Conditional read for their ETag in their parameters (http_cache.versions()): a
+write in any worker changes the key in all of them, and a body is never served under a newer ETag than its data.
+
+Configuration (environment variables):
+    RESPONSE_CACHE_URL -> redis:// URL to share the cache between workers, needs the redis package (default: in memory)
+    RESPONSE_CACHE_SIZE -> Max entries of the in memory cache, 0 turns the cache off (default: 1024)
+    RESPONSE_CACHE_MAX_BYTES -> Max total size of the in memory cache (default: 32 MiB)
+    RESPONSE_CACHE_TTL -> Seconds an entry is served for (default: 60)
+"""
+
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from enum import Enum
+from hashlib import sha256
+from typing import Any, Awaitable, Callable, Iterable
+from fastapi import Response
+from app.utils.pagination import NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER
+
+CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+
+
+class MemoryBackend:
+    """
+    LRU of the entries of this process, bounded by the number of entries and their total size
+    """
+
+    def __init__(self, size: int, max_bytes: int) -> None:
+        self.size = size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._versions: dict[str, int] = {}
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            self._entries.move_to_end(key)
+            return entry[1]
+        if entry:
+            self._remove(key)
+        return None
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + ttl, value)
+        self.bytes += len(value)
+        while len(self._entries) > self.size or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        self.bytes -= len(self._entries.pop(key)[1])
+
+    async def versions(self, tags: list[str]) -> list[int]:
+        return [self._versions.get(tag, 0) for tag in tags]
+
+    async def bump(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    async def count(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Entries and tag versions in Redis (or anything speaking its protocol), shared by all the workers
+    """
+
+    def __init__(self, client: Any, prefix: str = "acm:cache:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        import redis.asyncio  # Only needed when the cache is shared
+
+        return cls(redis.asyncio.Redis.from_url(url))
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    async def versions(self, tags: list[str]) -> list[int]:
+        values = await self.client.mget([f"{self.prefix}tag:{tag}" for tag in tags])
+        return [int(value or 0) for value in values]
+
+    async def bump(self, tags: Iterable[str]) -> None:
+        async with self.client.pipeline() as pipe:
+            for tag in tags:
+                pipe.incr(f"{self.prefix}tag:{tag}")
+            await pipe.execute()
+
+    async def clear(self) -> None:
+        keys = [key async for key in self.client.scan_iter(f"{self.prefix}*")]
+        if keys:
+            await self.client.delete(*keys)
+
+    async def count(self) -> int:
+        return len([key async for key in self.client.scan_iter(f"{self.prefix}*") if b":tag:" not in key])
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "__dict__"):  # Parameter classes like PageParams
+        return {k: _normalize(v) for k, v in sorted(vars(value).items())}
+    return str(value) if value is not None else None
+
+
+def _pack(body: bytes, headers: dict[str, str]) -> bytes:
+    return json.dumps(headers).encode() + b"\n" + body
+
+
+def _unpack(value: bytes) -> tuple[bytes, dict[str, str]]:
+    headers, _, body = value.partition(b"\n")
+    return body, json.loads(headers)
+
+
+class ResponseCache:
+    """
+    headers are the response headers which are stored along with the body (like the pagination headers)
+    """
+
+    def __init__(
+        self,
+        backend: MemoryBackend | RedisBackend,
+        ttl: float,
+        enabled: bool = True,
+        headers: Iterable[str] = (),
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.headers = [header.lower() for header in headers]
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self._flights: dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls, headers: Iterable[str] = ()) -> "ResponseCache":
+        if CACHE_URL:
+            backend = RedisBackend.from_url(CACHE_URL)
+        else:
+            backend = MemoryBackend(CACHE_SIZE, CACHE_MAX_BYTES)
+        return cls(backend, CACHE_TTL, enabled=bool(CACHE_URL) or CACHE_SIZE > 0, headers=headers)
+
+    async def _key(self, name: str, params: dict[str, Any], tags: list[str]) -> str:
+        normalized = {key: _normalize(value) for key, value in params.items()}
+        versions = await self.backend.versions(tags)
+        raw = json.dumps([name, sorted(normalized.items()), list(zip(tags, versions))])
+        return f"{name}:{sha256(raw.encode()).hexdigest()}"
+
+    async def fetch(
+        self,
+        name: str,
+        params: dict[str, Any],
+        tags: list[str],
+        compute: Callable[[Response], Awaitable[bytes]],
+    ) -> tuple[bytes, dict[str, str]]:
+        """
+        Returns the JSON body and headers of the response, compute(response) makes the body on a miss
+        and sets the headers on the response
+        """
+        if not self.enabled:
+            return await self._compute(compute)
+        key = await self._key(name, params, tags)
+        value = await self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return _unpack(value)
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.collapsed += 1
+            return await asyncio.shield(flight)
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        self.misses += 1
+        try:
+            result = await self._compute(compute)
+            await self.backend.set(key, _pack(*result), self.ttl)
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            flight.set_exception(e)
+            flight.exception()  # Nobody may be waiting for it
+            raise
+        finally:
+            del self._flights[key]
+
+    async def _compute(self, compute: Callable[[Response], Awaitable[bytes]]) -> tuple[bytes, dict[str, str]]:
+        response = Response()
+        body = await compute(response)
+        return body, {k: v for k, v in response.headers.items() if k in self.headers}
+
+    async def respond(
+        self,
+        name: str,
+        params: dict[str, Any],
+        tags: list[str],
+        response: Response,
+        compute: Callable[[Response], Awaitable[bytes]],
+    ) -> Response:
+        """
+        fetch() as the response of an endpoint, keeping the headers already set on the endpoint's response
+        """
+        body, headers = await self.fetch(name, params, tags, compute)
+        headers = {**{k: v for k, v in response.headers.items() if k != "content-length"}, **headers}
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    async def invalidate(self, *tags: str) -> None:
+        """
+        Called after the change is committed
+        """
+        await self.backend.bump(tags)
+
+    async def metrics(self) -> dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "entries": await self.backend.count(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "collapsed": self.collapsed,
+        }
+
+
+response_cache = ResponseCache.from_env(headers=(NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER))
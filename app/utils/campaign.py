@@ -0,0 +1,296 @@
+"""
+Mailing list campaigns
+
+A campaign walks through the Mailing_List table in batches ordered by email (keyset pagination)
+so the whole list is never loaded at once. The message is rendered once, every recipient only
+gets its own To and List-Unsubscribe headers.
+The delivery state of every recipient is committed as soon as its mail is sent or has failed, and the last
+email of a batch once the whole batch is done, so a campaign which was stopped by a crash or a restart resumes
+where it stopped without mailing anybody twice (only the mails in flight at the crash can be sent again).
+A mail which the sender doesn't finish within CAMPAIGN_SEND_TIMEOUT seconds is counted as failed.
+The mails are queued as bulk mails, the verification and password reset mails are sent before them.
+
+Every worker resumes the unfinished campaigns at startup, so a campaign is only run by the worker which holds its
+lease in the database. The lease is renewed while the campaign runs, another worker takes the campaign over once
+it has expired for CAMPAIGN_LEASE_SECONDS (its worker was stopped).
+
+Configuration (environment variables):
+    CAMPAIGN_BATCH_SIZE -> Number of recipients fetched from the mailing list at once (default: 200)
+    CAMPAIGN_RATE -> Default mails per second of a campaign, 0 means as fast as the mail sender allows (default: 0)
+    CAMPAIGN_SEND_TIMEOUT -> Seconds to wait for the next mail of a batch to be sent (default: 300)
+    CAMPAIGN_LEASE_SECONDS -> (default: 60)
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent import futures
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from uuid import UUID, uuid4
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, or_, select, update
+from app.config import IST
+from app.db.models import Campaign, Campaign_Delivery, Mailing_List
+from .mail import BULK, MailSender, MailTemplate, get_sender
+
+BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", 200))
+DEFAULT_RATE = float(os.getenv("CAMPAIGN_RATE", 0))
+SEND_TIMEOUT = float(os.getenv("CAMPAIGN_SEND_TIMEOUT", 300))
+LEASE_SECONDS = float(os.getenv("CAMPAIGN_LEASE_SECONDS", 60))
+
+logger = logging.getLogger(__name__)
+
+# Campaign id -> thread running it in this process
+_running: dict[UUID, threading.Thread] = {}
+_running_lock = threading.Lock()
+
+
+class LeaseLost(Exception):
+    """
+    Another worker took the campaign over, this one didn't renew its lease in time
+    """
+
+
+class Lease:
+    """
+    Claim of a run on a campaign in the database
+    """
+
+    def __init__(self, engine: Engine, campaign_id: UUID, seconds: float | None = None) -> None:
+        self.engine = engine
+        self.campaign_id = campaign_id
+        self.seconds = LEASE_SECONDS if seconds is None else seconds
+        self.runner = uuid4().hex
+        self._renew_at = 0.0
+
+    def _update(self, *where, **values) -> bool:
+        with Session(self.engine) as db:
+            updated = db.exec(update(Campaign).where(Campaign.id == self.campaign_id, *where).values(**values)).rowcount
+            db.commit()
+        return updated == 1
+
+    def acquire(self) -> bool:
+        """
+        Whether the campaign was unfinished and nobody else held its lease
+        """
+        now = datetime.now(IST)
+        acquired = self._update(
+            Campaign.status != "completed",
+            or_(Campaign.lease_until.is_(None), Campaign.lease_until <= now),
+            runner=self.runner,
+            lease_until=now + timedelta(seconds=self.seconds),
+        )
+        if acquired:
+            self._renew_at = time.monotonic() + self.seconds / 3
+        return acquired
+
+    def renew(self) -> None:
+        """
+        Extends the lease once a third of it has gone by, raises LeaseLost when another worker has it
+        """
+        if time.monotonic() < self._renew_at:
+            return
+        if not self._update(
+            Campaign.runner == self.runner, lease_until=datetime.now(IST) + timedelta(seconds=self.seconds)
+        ):
+            raise LeaseLost(f"Campaign {self.campaign_id} is run by another worker")
+        self._renew_at = time.monotonic() + self.seconds / 3
+
+    def release(self) -> None:
+        self._update(Campaign.runner == self.runner, runner=None, lease_until=None)
+
+
+def start(engine: Engine, campaign_id: UUID, sender: MailSender | None = None, standby: bool = False) -> bool:
+    """
+    Runs the campaign in a background thread unless it is already running in this process. With standby, a
+    campaign which another worker runs is taken over if that worker stops
+    """
+    with _running_lock:
+        if campaign_id in _running:
+            return False
+        thread = _running[campaign_id] = threading.Thread(
+            target=_run_in_background,
+            args=(engine, campaign_id, sender, standby),
+            name=f"campaign-{campaign_id}",
+            daemon=True,
+        )
+    thread.start()
+    return True
+
+
+def join(campaign_id: UUID, timeout: float | None = None) -> None:
+    """
+    Blocks until the background thread of the campaign (if any) is over
+    """
+    with _running_lock:
+        thread = _running.get(campaign_id)
+    if thread is not None:
+        thread.join(timeout)
+
+
+def resume_all(engine: Engine) -> None:
+    """
+    Restarts the campaigns which were not completed when the server stopped. Every worker does it, the one
+    which gets the lease of a campaign runs it and the others stand by
+    """
+    with Session(engine) as db:
+        campaign_ids = db.exec(
+            select(Campaign.id).where(Campaign.status.in_(("pending", "running")))
+        ).all()
+    for campaign_id in campaign_ids:
+        start(engine, campaign_id, standby=True)
+
+
+def _run_in_background(engine: Engine, campaign_id: UUID, sender: MailSender | None, standby: bool):
+    try:
+        while not run(engine, campaign_id, sender) and standby:
+            time.sleep(LEASE_SECONDS)
+    except LeaseLost as e:
+        logger.warning("%s", e)
+    except Exception:
+        logger.exception("Campaign %s stopped", campaign_id)
+    finally:
+        with _running_lock:
+            _running.pop(campaign_id, None)
+
+
+def run(
+    engine: Engine,
+    campaign_id: UUID,
+    sender: MailSender | None = None,
+    batch_size: int = BATCH_SIZE,
+    timeout: float = SEND_TIMEOUT,
+) -> bool:
+    """
+    Sends the campaign to the recipients who didn't get it yet. Returns False without sending anything when
+    another worker holds the lease of the campaign
+    """
+    lease = Lease(engine, campaign_id)
+    if not lease.acquire():
+        with Session(engine) as db:
+            campaign = db.get(Campaign, campaign_id)
+            return not campaign or campaign.status == "completed"
+    try:
+        _send(engine, campaign_id, sender or get_sender(), batch_size, timeout, lease)
+    finally:
+        lease.release()
+    return True
+
+
+def _send(
+    engine: Engine, campaign_id: UUID, sender: MailSender, batch_size: int, timeout: float, lease: Lease
+) -> None:
+    with Session(engine) as db:
+        campaign = db.get(Campaign, campaign_id)
+        if campaign.status == "pending":
+            campaign.status = "running"
+            campaign.started_at = datetime.now(IST)
+            db.commit()
+        template = MailTemplate(campaign.subject, campaign.body, sender.user)
+        min_interval = 1 / campaign.rate if campaign.rate > 0 else 0
+        next_send = time.monotonic()
+        while True:
+            query = select(Mailing_List.email).order_by(Mailing_List.email).limit(batch_size)
+            if campaign.last_email is not None:
+                query = query.where(Mailing_List.email > campaign.last_email)
+            emails = db.exec(query).all()
+            if not emails:
+                break
+            # Recipients who already got the mail before the campaign was stopped
+            delivered = set(
+                db.exec(
+                    select(Campaign_Delivery.email)
+                    .where(Campaign_Delivery.campaign_id == campaign.id)
+                    .where(Campaign_Delivery.email.in_(emails))
+                ).all()
+            )
+            pending: dict[futures.Future, str] = {}
+            for email in emails:
+                if email in delivered:
+                    continue
+                # Don't send email if it is a test mail
+                if email.startswith("test-acm-sist"):
+                    campaign.skipped += 1
+                    db.add(_delivery(campaign.id, email, "skipped"))
+                    continue
+                while (wait := next_send - time.monotonic()) > 0:
+                    time.sleep(min(wait, lease.seconds / 3))
+                    lease.renew()
+                next_send = max(next_send, time.monotonic()) + min_interval
+                headers = {
+                    "List-Unsubscribe": f"<{campaign.unsubscribe_url}?{urlencode({'email': email})}>"
+                }
+                future = sender.submit(template.from_addr, email, template.render(email, headers), BULK)
+                pending[future] = email
+                # With a rate, the first mails are sent while the next ones are still being queued
+                _record(db, campaign, pending, [queued for queued in pending if queued.done()])
+                lease.renew()
+            deadline = time.monotonic() + timeout
+            while pending:
+                done, _ = futures.wait(
+                    pending,
+                    timeout=min(max(deadline - time.monotonic(), 0), lease.seconds / 3),
+                    return_when=futures.FIRST_COMPLETED,
+                )
+                if done:
+                    deadline = time.monotonic() + timeout
+                elif time.monotonic() >= deadline:
+                    logger.warning("Campaign %s: %d mails weren't sent in time", campaign.id, len(pending))
+                    done = list(pending)
+                _record(db, campaign, pending, done)
+                lease.renew()
+            campaign.last_email = emails[-1]
+            db.commit()
+        campaign.status = "completed"
+        campaign.finished_at = datetime.now(IST)
+        db.commit()
+
+
+def _record(db: Session, campaign: Campaign, pending: dict[futures.Future, str], done) -> None:
+    """
+    Commits the delivery state of the recipients of the futures in done and removes them from pending. A future
+    which isn't actually done (it timed out) or failed with any error is a failed delivery
+    """
+    for future in done:
+        email = pending.pop(future)
+        if not future.done():
+            campaign.failed += 1
+            db.add(_delivery(campaign.id, email, "failed", "Timed out"))
+        elif future.exception() is not None:
+            campaign.failed += 1
+            db.add(_delivery(campaign.id, email, "failed", str(future.exception())))
+        else:
+            campaign.sent += 1
+            db.add(_delivery(campaign.id, email, "sent"))
+        db.commit()
+
+
+def _delivery(campaign_id: UUID, email: str, status: str, error: str | None = None):
+    return Campaign_Delivery(
+        campaign_id=campaign_id,
+        email=email,
+        status=status,
+        error=error,
+        time=datetime.now(IST),
+    )
+
+
+def report(campaign: Campaign) -> dict:
+    """
+    Progress of the campaign along with its throughput in mails per second
+    """
+    processed = campaign.sent + campaign.failed + campaign.skipped
+    elapsed = 0.0
+    if campaign.started_at:
+        # SQLite doesn't store the timezone so both of them are compared as naive datetimes
+        end = campaign.finished_at or datetime.now(IST)
+        elapsed = (
+            end.replace(tzinfo=None) - campaign.started_at.replace(tzinfo=None)
+        ).total_seconds()
+    data = campaign.model_dump()
+    data["processed"] = processed
+    data["elapsed"] = elapsed
+    data["throughput"] = processed / elapsed if elapsed > 0 else 0.0
+    return data
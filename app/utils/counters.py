@@ -0,0 +1,92 @@
+"""
+Counters behind /achievements
+
+Instead of running COUNT(*) over whole tables on every hit, the create/delete endpoints add to a counter row
+in the same transaction as the change itself, so reading the stats is a single query on a tiny table.
+reconcile() recounts every counter from its table and repairs any drift, it runs at startup and then
+every COUNTER_RECONCILE_SECONDS (default: 3600).
+New stats only need an entry in COUNTERS and a call to add() wherever the rows are created or deleted.
+"""
+
+import os
+import asyncio
+import logging
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, func, select, update
+from app.db.models import Counters, Event_Registeration, Events, Members, Users
+from app.utils import http_cache
+
+RECONCILE_SECONDS = float(os.getenv("COUNTER_RECONCILE_SECONDS", 3600))
+
+logger = logging.getLogger(__name__)
+
+# Counter name -> query which counts it from scratch
+COUNTERS = {
+    "members_count": select(func.count()).select_from(Members),
+    "users_count": select(func.count()).select_from(Users),
+    "events_count": select(func.count()).select_from(Events),
+    "registrations_count": select(func.count()).select_from(Event_Registeration),
+    "verified_payments_count": select(func.count())
+    .select_from(Event_Registeration)
+    .where(Event_Registeration.status == "verified")
+    .where(Event_Registeration.transaction_id.is_not(None)),
+}
+
+
+def add(db: Session, name: str, delta: int = 1) -> None:
+    """
+    Adds delta to the counter as part of the caller's transaction, so it is committed or rolled back along with the change.
+    A counter which doesn't exist yet is left alone, it is created with the right value by reconcile()
+    """
+    db.exec(update(Counters).where(Counters.name == name).values(value=Counters.value + delta))
+
+
+def get_all(db: Session) -> dict[str, int]:
+    values = {counter.name: counter.value for counter in db.exec(select(Counters)).all()}
+    if len(values) < len(COUNTERS):
+        # Not reconciled yet, counted from the tables until the reconciler creates them (db may be read only)
+        values.update({name: db.exec(query).one() for name, query in COUNTERS.items() if name not in values})
+    return {name: values[name] for name in COUNTERS}
+
+
+def reconcile(db: Session) -> dict[str, int]:
+    """
+    Recounts every counter and returns the drift which was repaired
+    """
+    # Locks the counters first, so a change committed while counting can't add to the value which is about to be overwritten
+    db.exec(update(Counters).values(value=Counters.value))
+    current = {counter.name: counter for counter in db.exec(select(Counters)).all()}
+    drift = {}
+    for name, query in COUNTERS.items():
+        actual = db.exec(query).one()
+        counter = current.get(name)
+        if counter is None:
+            db.add(Counters(name=name, value=actual))
+        elif counter.value != actual:
+            drift[name] = actual - counter.value
+            counter.value = actual
+    if drift:
+        # Cached /achievements responses are stale
+        http_cache.bump(db, "counters")
+    db.commit()
+    if drift:
+        logger.warning("Repaired counters drift: %s", drift)
+    return drift
+
+
+def reconcile_engine(engine: Engine) -> dict[str, int]:
+    with Session(engine) as db:
+        return reconcile(db)
+
+
+async def run_reconciler(engine: Engine) -> None:
+    """
+    Reconciles the counters at startup and then periodically, runs until it is cancelled
+    """
+    while True:
+        try:
+            await run_in_threadpool(reconcile_engine, engine)
+        except Exception:
+            logger.exception("Couldn't reconcile the counters")
+        await asyncio.sleep(RECONCILE_SECONDS)
@@ -0,0 +1,136 @@
+"""
+HTTP conditional caching of the public read endpoints
+
+Every table the endpoints read from has a version row in Table_Versions which is bumped in the same transaction
+as any change to the table. The ETag of a response is a hash of the path, the query parameters and those versions,
+so it is known from one small query: a request with a matching If-None-Match (or an If-Modified-Since which is
+not older than the last change) gets 304 before the actual query runs.
+
+Configuration (environment variables):
+    HTTP_CACHE_CONTROL -> Cache-Control of the cached endpoints (default: public, max-age=60)
+"""
+
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import sha256
+from typing import Callable
+from fastapi import Depends, HTTPException, Request, Response, status
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select, update
+from app.config import IST
+from app.db.db import DBSession, get_db
+from app.db.models import Table_Versions
+
+CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "public, max-age=60")
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def bump(db: Session, *tables: str) -> None:
+    """
+    Marks the tables as changed, as part of the caller's transaction. A single upsert, so concurrent first bumps
+    of a table can't both insert its row
+    """
+    now = datetime.now(IST)
+    upsert = UPSERTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        if tables:
+            statement = upsert(Table_Versions).values(
+                [{"name": table, "version": 1, "updated_at": now} for table in tables]
+            )
+            db.exec(
+                statement.on_conflict_do_update(
+                    index_elements=[Table_Versions.name],
+                    set_={"version": Table_Versions.version + 1, "updated_at": now},
+                )
+            )
+        return
+    for table in tables:
+        updated = db.exec(
+            update(Table_Versions)
+            .where(Table_Versions.name == table)
+            .values(version=Table_Versions.version + 1, updated_at=now)
+        ).rowcount
+        if not updated:
+            db.add(Table_Versions(name=table, version=1, updated_at=now))
+
+
+def versions(request: Request) -> list | None:
+    """
+    Versions of the tables (and moment) which the Conditional of the request read, the same in every worker
+    """
+    return getattr(request.state, "table_versions", None)
+
+
+def _aware(moment: datetime) -> datetime:
+    # Datetimes come back from SQLite without the timezone, they are stored in IST
+    return IST.localize(moment) if moment.tzinfo is None else moment
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _not_modified_since(if_modified_since: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        return False
+    # HTTP dates have no fractions of a second
+    return last_modified.replace(microsecond=0) <= since
+
+
+class Conditional:
+    """
+    Dependency which sets ETag, Last-Modified and Cache-Control, or answers 304 when the client's copy is still fresh.
+    moment(db, request) is for results which also change with time (like upcoming events), it returns the latest
+    point in time at which the result changed without any table being changed
+    """
+
+    def __init__(
+        self,
+        *tables: str,
+        moment: Callable[[Session, Request], datetime | None] | None = None,
+    ) -> None:
+        self.tables = tables
+        self.moment = moment
+
+    async def __call__(self, request: Request, response: Response, db: DBSession = Depends(get_db)) -> None:
+        versions, moment = await db.run_sync(self._read, request)
+        changes = [_aware(row.updated_at) for row in versions.values()]
+        if moment is not None:
+            changes.append(_aware(moment))
+
+        data = [(table, versions[table].version if table in versions else 0) for table in self.tables]
+        data.append(moment.isoformat() if moment is not None else None)
+        request.state.table_versions = data
+        key = [request.url.path, *sorted(request.query_params.multi_items()), *data]
+        etag = f'"{sha256(repr(key).encode()).hexdigest()[:32]}"'
+
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        last_modified = max(changes) if changes else None
+        if last_modified:
+            headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+
+        if_none_match = request.headers.get("if-none-match")
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_none_match is not None:
+            fresh = _matches(if_none_match, etag)
+        else:
+            fresh = bool(last_modified and if_modified_since and _not_modified_since(if_modified_since, last_modified))
+        if fresh:
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+
+    def _read(self, db: Session, request: Request) -> tuple[dict[str, Table_Versions], datetime | None]:
+        query = select(Table_Versions).where(Table_Versions.name.in_(self.tables))
+        versions = {row.name: row for row in db.exec(query).all()}
+        return versions, self.moment(db, request) if self.moment else None
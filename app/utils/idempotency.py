@@ -0,0 +1,303 @@
+"""
+Idempotency-Key for the POST endpoints which are retried on flaky networks
+
+A request with an Idempotency-Key header claims the key by inserting its row in Idempotency_Keys, and its response
+is stored in that row once it is sent. A retry with the same key (from the same client, to the same route) gets the
+stored response back with an Idempotent-Replayed header instead of running the endpoint again, and a retry sent
+while the first request is still in flight waits for it. Keys are remembered for IDEMPOTENCY_TTL_SECONDS, the
+expired rows are deleted every IDEMPOTENCY_PURGE_SECONDS.
+
+The body of the request is hashed while it is received (without the multipart boundary, which differs on every
+retry of an upload), a key sent again with a different body gets 422. Server errors aren't stored, the key is
+freed so the request can be retried. A request which is in flight for longer than IDEMPOTENCY_LOCK_SECONDS (its
+worker was stopped) loses the key to the next retry.
+
+Configuration (environment variables):
+    IDEMPOTENCY_TTL_SECONDS -> (default: 86400)
+    IDEMPOTENCY_WAIT_SECONDS -> How long a retry waits for the request in flight before 409 (default: 10)
+    IDEMPOTENCY_LOCK_SECONDS -> (default: 60)
+    IDEMPOTENCY_PURGE_SECONDS -> (default: 3600)
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from hashlib import sha256
+from fastapi import status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, and_, delete, or_, update
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from app.config import IST, db_engine
+from app.db.models import Idempotency_Keys
+
+TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 10))
+LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 60))
+PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", 3600))
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# How often a retry checks the database when the request in flight is on another worker
+POLL_SECONDS = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKeys:
+    """
+    Rows of the keys in the database of engine
+    """
+
+    def __init__(self, engine: Engine, ttl: float, lock: float) -> None:
+        self.engine = engine
+        self.ttl = ttl
+        self.lock = lock
+
+    def claim(self, key: str) -> tuple[bool, Idempotency_Keys | None]:
+        """
+        (True, None) when the key was free and is now in flight, else (False, row of the request which has it).
+        The row can be None when that request has just freed the key
+        """
+        now = datetime.now(IST)
+        with Session(self.engine) as db:
+            # An expired key, or one whose request was lost, is free again
+            db.exec(
+                delete(Idempotency_Keys).where(
+                    Idempotency_Keys.key == key,
+                    or_(
+                        Idempotency_Keys.expires_at <= now,
+                        and_(
+                            Idempotency_Keys.status_code.is_(None),
+                            Idempotency_Keys.created_at <= now - timedelta(seconds=self.lock),
+                        ),
+                    ),
+                )
+            )
+            db.add(Idempotency_Keys(key=key, created_at=now, expires_at=now + timedelta(seconds=self.ttl)))
+            try:
+                db.commit()
+                return True, None
+            except IntegrityError:
+                db.rollback()
+                return False, db.get(Idempotency_Keys, key)
+
+    def complete(self, key: str, request_hash: str, status_code: int, content_type: str | None, body: bytes) -> None:
+        with Session(self.engine) as db:
+            db.exec(
+                update(Idempotency_Keys)
+                .where(Idempotency_Keys.key == key)
+                .values(status_code=status_code, content_type=content_type, body=body, request_hash=request_hash)
+            )
+            db.commit()
+
+    def release(self, key: str) -> None:
+        with Session(self.engine) as db:
+            db.exec(delete(Idempotency_Keys).where(Idempotency_Keys.key == key, Idempotency_Keys.status_code.is_(None)))
+            db.commit()
+
+    def purge(self) -> int:
+        """
+        Deletes the expired keys, returns how many were deleted
+        """
+        with Session(self.engine) as db:
+            deleted = db.exec(delete(Idempotency_Keys).where(Idempotency_Keys.expires_at <= datetime.now(IST))).rowcount
+            db.commit()
+        return deleted
+
+    async def run_purger(self) -> None:
+        """
+        Purges at startup and then periodically, runs until it is cancelled
+        """
+        while True:
+            try:
+                deleted = await run_in_threadpool(self.purge)
+                if deleted:
+                    logger.info("Purged %d expired idempotency keys", deleted)
+            except Exception:
+                logger.exception("Couldn't purge the idempotency keys")
+            await asyncio.sleep(PURGE_SECONDS)
+
+
+idempotency_keys = IdempotencyKeys(db_engine, TTL_SECONDS, LOCK_SECONDS)
+
+
+class _BodyHash:
+    """
+    SHA-256 of a request body without the multipart boundary, fed chunk by chunk
+    """
+
+    def __init__(self, boundary: bytes | None) -> None:
+        self.boundary = boundary
+        self.complete = False
+        self._digest = sha256()
+        self._tail = b""
+
+    def update(self, message: dict) -> None:
+        if message["type"] != "http.request":
+            return
+        data = self._tail + message.get("body", b"")
+        if self.boundary:
+            data = data.replace(self.boundary, b"")
+            # A boundary can be split between two chunks
+            keep = 0 if not message.get("more_body", False) else len(self.boundary) - 1
+            data, self._tail = (data[:-keep], data[-keep:]) if keep else (data, b"")
+        self._digest.update(data)
+        self.complete = not message.get("more_body", False)
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def _boundary(headers: Headers) -> bytes | None:
+    content_type = headers.get("content-type", "")
+    if not content_type.startswith("multipart/"):
+        return None
+    for parameter in content_type.split(";")[1:]:
+        name, _, value = parameter.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode()
+    return None
+
+
+def _error(status_code: int, detail: str, headers: dict[str, str] | None = None) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+
+class IdempotencyMiddleware:
+    """
+    Makes the given routes idempotent for the requests which have an Idempotency-Key header
+    """
+
+    def __init__(self, app, routes: set[tuple[str, str]], keys: IdempotencyKeys = idempotency_keys) -> None:
+        self.app = app
+        self.routes = routes
+        self.keys = keys
+        # Key -> set once the request in flight in this worker has its response stored (or the key freed)
+        self._flights: dict[str, asyncio.Event] = {}
+
+    @staticmethod
+    def _key(scope, headers: Headers, idempotency_key: str) -> str:
+        # Same client as EngineRouter: the access token, or the address without one
+        client = headers.get("authorization") or (scope["client"][0] if scope.get("client") else "")
+        raw = "\n".join((client, scope["method"], scope["path"], idempotency_key))
+        return sha256(raw.encode()).hexdigest()
+
+    async def _wait(self, key: str, deadline: float) -> None:
+        remaining = max(deadline - time.monotonic(), 0)
+        flight = self._flights.get(key)
+        if flight is None:
+            # In flight on another worker
+            await asyncio.sleep(min(remaining, POLL_SECONDS))
+            return
+        try:
+            await asyncio.wait_for(flight.wait(), timeout=remaining)
+        except asyncio.TimeoutError:
+            pass
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get(HEADER)
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            response = _error(
+                status.HTTP_400_BAD_REQUEST, f"{HEADER} should have 1 to {MAX_KEY_LENGTH} characters"
+            )
+            await response(scope, receive, send)
+            return
+
+        key = self._key(scope, headers, idempotency_key)
+        body_hash = _BodyHash(_boundary(headers))
+        deadline = time.monotonic() + WAIT_SECONDS
+        while True:
+            claimed, row = await run_in_threadpool(self.keys.claim, key)
+            if claimed:
+                break
+            if row is not None and row.status_code is not None:
+                await self._replay(row, body_hash, scope, receive, send)
+                return
+            if time.monotonic() >= deadline:
+                response = _error(
+                    status.HTTP_409_CONFLICT,
+                    f"A request with this {HEADER} is still in progress",
+                    headers={"Retry-After": "1"},
+                )
+                await response(scope, receive, send)
+                return
+            await self._wait(key, deadline)
+
+        flight = self._flights[key] = asyncio.Event()
+        response_start = {}
+        response_body = []
+        stored = False
+
+        async def receive_hashed():
+            message = await receive()
+            body_hash.update(message)
+            return message
+
+        async def send_recorded(message):
+            if message["type"] == "http.response.start":
+                response_start.update(message)
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_hashed, send_recorded)
+            status_code = response_start.get("status", status.HTTP_500_INTERNAL_SERVER_ERROR)
+            if status_code < 500:
+                # The same body gives the same hash however much of it the endpoint read
+                while not body_hash.complete:
+                    message = await receive_hashed()
+                    if message["type"] != "http.request":
+                        break
+                if body_hash.complete:
+                    content_type = Headers(raw=response_start.get("headers", [])).get("content-type")
+                    await run_in_threadpool(
+                        self.keys.complete, key, body_hash.hexdigest(), status_code, content_type, b"".join(response_body)
+                    )
+                    stored = True
+        finally:
+            try:
+                if not stored:
+                    # Server error, exception or client gone, the key can be used again
+                    await run_in_threadpool(self.keys.release, key)
+            finally:
+                flight.set()
+                self._flights.pop(key, None)
+
+    async def _replay(self, row: Idempotency_Keys, body_hash: _BodyHash, scope, receive, send) -> None:
+        try:
+            while not body_hash.complete:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return
+                body_hash.update(message)
+        except HTTPException as e:
+            # Like the body size limit
+            response = _error(e.status_code, e.detail, e.headers)
+        else:
+            if body_hash.hexdigest() != row.request_hash:
+                response = _error(
+                    status.HTTP_422_UNPROCESSABLE_ENTITY, f"This {HEADER} was already used for a different request"
+                )
+            else:
+                response = Response(
+                    row.body,
+                    status_code=row.status_code,
+                    media_type=row.content_type,
+                    headers={REPLAYED_HEADER: "true"},
+                )
+        await response(scope, receive, send)
@@ -0,0 +1,186 @@
+"""
+Resized variants of the event posters and member avatars
+
+An uploaded image is stored by the SHA-256 of its content in static/images/<kind>/<sha256>/, next to a WebP and a
+JPEG of every size of VARIANTS (never wider than the original):
+
+    original-<width>.<ext>  thumbnail.webp  thumbnail.jpg  card.webp  card.jpg  full.webp  full.jpg
+
+The URL of the original is what goes into Events.image_url / Members.avatar_url, the URLs of the variants and their
+widths (for srcset) are derived from it. Decoding and encoding images is CPU bound, so it runs on a pool of
+IMAGE_WORKERS processes and doesn't hold the event loop or the GIL. The variants are made once per image (the
+original is moved into place last, an image which is already there is left as it is) and since the content of a
+URL never changes, they are served with an immutable Cache-Control.
+
+Configuration (environment variables):
+    IMAGE_WORKERS -> Processes resizing the images (default: 2)
+    IMAGE_MAX_PIXELS -> Larger images are refused (default: 40 megapixels)
+"""
+
+import os
+import re
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from uuid import uuid4
+from fastapi import HTTPException, UploadFile, status
+from fastapi.staticfiles import StaticFiles
+from PIL import Image, ImageOps, UnidentifiedImageError
+from app.utils.uploads import save_image
+
+ROOT = Path("static/images")
+URL_PREFIX = "/static/images"
+
+WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+
+# Name -> largest width
+VARIANTS = {"thumbnail": 160, "card": 480, "full": 1280}
+# Extension -> Pillow format and options
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_ORIGINAL = re.compile(rf"^{URL_PREFIX}/(?P<base>\w+/[0-9a-f]{{64}})/original-(?P<width>\d+)\.\w+$")
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process which already runs threads can leave their locks held in the child
+        _pool = ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    A pool whose worker died (like killed for using too much memory) can't run anything anymore, the next image
+    gets a new one
+    """
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def widths(width: int) -> dict[str, int]:
+    """
+    Width of each variant of an image that wide
+    """
+    return {name: min(largest, width) for name, largest in VARIANTS.items()}
+
+
+def variants(url: str | None) -> dict[str, str] | None:
+    """
+    URLs of the variants of an image uploaded here: the JPEG of every size plus srcset (WebP) and jpeg_srcset.
+    None for any other URL
+    """
+    match = _ORIGINAL.match(url or "")
+    if not match:
+        return None
+    base = f"{URL_PREFIX}/{match['base']}"
+    sizes = widths(int(match["width"]))
+    urls = {name: f"{base}/{name}.jpg" for name in sizes}
+    # The same width once, when the original is smaller than some of the sizes
+    unique = {width: name for name, width in reversed(sizes.items())}
+    for key, extension in (("srcset", "webp"), ("jpeg_srcset", "jpg")):
+        urls[key] = ", ".join(f"{base}/{name}.{extension} {width}w" for width, name in sorted(unique.items()))
+    return urls
+
+
+def _resize(image: Image.Image, width: int) -> Image.Image:
+    if image.width <= width:
+        return image
+    return image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+
+
+def make_variants(partial: Path, directory: Path, extension: str) -> str:
+    """
+    Runs in the pool: makes the variants of the uploaded file partial in directory and moves it there as the
+    original. Returns the name of the original
+    """
+    existing = next(directory.glob("original-*"), None) if directory.is_dir() else None
+    if existing:
+        partial.unlink()
+        return existing.name
+    with Image.open(partial) as opened:
+        if opened.width * opened.height > MAX_PIXELS:
+            raise Image.DecompressionBombError(f"{opened.width}x{opened.height} is more than {MAX_PIXELS} pixels")
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, width in widths(image.width).items():
+        resized = _resize(image, width)
+        for variant_extension, (image_format, options) in FORMATS.items():
+            if image_format == "JPEG":
+                # JPEG has no transparency, it goes on white
+                variant = Image.new("RGB", resized.size, "white")
+                rgba = resized.convert("RGBA")
+                variant.paste(rgba, mask=rgba)
+            else:
+                variant = resized if resized.mode in ("RGB", "RGBA") else resized.convert("RGBA")
+            target = directory / f"{name}.{variant_extension}"
+            # The same image can be uploaded twice at once, each upload writes its own file
+            temporary = target.with_name(f".{target.name}.{uuid4().hex}.part")
+            try:
+                variant.save(temporary, image_format, **options)
+                os.replace(temporary, target)
+            finally:
+                temporary.unlink(missing_ok=True)
+    original = directory / f"original-{image.width}{extension}"
+    os.replace(partial, original)
+    return original.name
+
+
+async def store(upload: UploadFile, kind: str) -> str:
+    """
+    Saves the uploaded image with its variants, returns the URL of the original
+    """
+    directory = ROOT / kind
+    directory.mkdir(parents=True, exist_ok=True)
+    partial, digest = await save_image(upload, directory)
+    extension = Path(upload.filename or "").suffix.lower()
+    pool = _get_pool()
+    try:
+        name = await asyncio.get_running_loop().run_in_executor(
+            pool, make_variants, partial, directory / digest, extension
+        )
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The image couldn't be processed, please try again in a moment",
+            headers={"Retry-After": "1"},
+        )
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The image couldn't be read or is too large"
+        )
+    finally:
+        partial.unlink(missing_ok=True)
+    return f"{URL_PREFIX}/{kind}/{digest}/{name}"
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    Static files whose content never changes for a given URL
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        return response
@@ -1,10 +1,288 @@
+"""
+Mail delivery
+
+send() only builds the messages and hands them over to a MailSender. The MailSender keeps
+a small pool of long-lived SMTP connections, each one running in its own background thread,
+so the request which asked for the mail returns immediately. The mails somebody is waiting for (verification,
+password reset) are sent before the bulk mails of the campaigns which are already queued.
+
+Configuration (environment variables):
+    MAIL_SERVER, MAIL_PORT, MAIL_USER, MAIL_PASS -> SMTP server and credentials
+    MAIL_STARTTLS -> Use STARTTLS after connecting (default: 1)
+    MAIL_CONNECTIONS -> Number of SMTP connections in the pool (default: 1)
+    MAIL_RATE_LIMIT -> Max mails per second on each connection, 0 means unlimited (default: 0.5)
+    MAIL_MAX_RETRIES -> How many times a mail is retried on temporary failures (default: 3)
+    MAIL_RETRY_DELAY -> Seconds to wait before retrying, multiplied by the attempt (default: 2)
+    MAIL_IDLE_TIMEOUT -> Seconds after which an idle connection is closed (default: 60)
+"""
+
+import re
 import smtplib
 import os
+import queue
+import itertools
+import threading
 import time
+import logging
+from concurrent.futures import Future
 from typing import List
+from email import policy
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+logger = logging.getLogger(__name__)
+
+# Priorities of the queued mails, stop() is queued after all of them
+TRANSACTIONAL = 0
+BULK = 1
+_STOP = 2
+
+
+def is_connection_error(error: OSError) -> bool:
+    """
+    Whether the connection can't be used anymore after this error
+    """
+    return isinstance(
+        error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)
+    ) or not isinstance(error, smtplib.SMTPException)
+
+
+def is_temporary_error(error: OSError) -> bool:
+    """
+    Connection errors and 4xx replies are worth retrying, 5xx replies are permanent
+    """
+    if is_connection_error(error):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code < 500
+    return False
+
+
+class MailSender:
+    """
+    Sends queued mails over a pool of SMTP connections in background threads
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: str = "",
+        password: str = "",
+        connections: int = 1,
+        rate_limit: float = 0.5,
+        max_retries: int = 3,
+        retry_delay: float = 2.0,
+        idle_timeout: float = 60.0,
+        starttls: bool = True,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.connections = max(connections, 1)
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self.starttls = starttls
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "connects": 0}
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        # Keeps the mails of the same priority in order
+        self._sequence = itertools.count()
+        self._workers: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "MailSender":
+        return cls(
+            host=os.getenv("MAIL_SERVER", "smtp.gmail.com"),
+            port=int(os.getenv("MAIL_PORT", 587)),
+            user=os.getenv("MAIL_USER", ""),
+            password=os.getenv("MAIL_PASS", ""),
+            connections=int(os.getenv("MAIL_CONNECTIONS", 1)),
+            rate_limit=float(os.getenv("MAIL_RATE_LIMIT", 0.5)),
+            max_retries=int(os.getenv("MAIL_MAX_RETRIES", 3)),
+            retry_delay=float(os.getenv("MAIL_RETRY_DELAY", 2)),
+            idle_timeout=float(os.getenv("MAIL_IDLE_TIMEOUT", 60)),
+            starttls=os.getenv("MAIL_STARTTLS", "1") == "1",
+        )
+
+    def start(self) -> None:
+        with self._lock:
+            if self._workers:
+                return
+            for n in range(self.connections):
+                worker = threading.Thread(
+                    target=self._work, name=f"mail-sender-{n}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Sends the mails which are already in the queue and stops the workers
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._queue.put((_STOP, next(self._sequence), None))
+        for worker in workers:
+            worker.join(timeout)
+
+    def submit(self, from_addr: str, to_addr: str, message: str, priority: int = TRANSACTIONAL) -> Future:
+        """
+        Queues the message and returns a Future which is resolved once the mail is delivered
+        """
+        self.start()
+        future: Future = Future()
+        self._queue.put((priority, next(self._sequence), (from_addr, to_addr, message, future)))
+        return future
+
+    def join(self) -> None:
+        """
+        Blocks until every queued mail is either delivered or failed
+        """
+        self._queue.join()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self.stats, "pending": self.pending, "connections": self.connections}
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
+            connection.starttls()
+        if self.password:
+            connection.login(self.user, self.password)
+        self._count("connects")
+        return connection
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    @staticmethod
+    def _close(connection: smtplib.SMTP | None) -> None:
+        if connection is None:
+            return
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def _work(self) -> None:
+        connection = None
+        min_interval = 1 / self.rate_limit if self.rate_limit > 0 else 0
+        last_sent = 0.0
+        while True:
+            try:
+                _, _, job = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Servers drop idle connections anyway, so close it before they do
+                self._close(connection)
+                connection = None
+                continue
+            if job is None:
+                self._close(connection)
+                self._queue.task_done()
+                return
+            from_addr, to_addr, message, future = job
+            try:
+                connection, last_sent = self._deliver(connection, last_sent, min_interval, job)
+            except Exception as e:
+                # Anything else is a bug or a mail which can't be sent, it fails the mail and not the worker
+                logger.exception("Couldn't send mail to %s", to_addr)
+                self._count("failed")
+                if not future.done():
+                    future.set_exception(e)
+                self._close(connection)
+                connection = None
+            finally:
+                self._queue.task_done()
+
+    def _deliver(
+        self, connection: smtplib.SMTP | None, last_sent: float, min_interval: float, job: tuple
+    ) -> tuple[smtplib.SMTP | None, float]:
+        """
+        Sends the mail of job, retrying the temporary failures. Returns the connection and when the mail was sent
+        """
+        from_addr, to_addr, message, future = job
+        # Sent as UTF-8 bytes (smtplib encodes a str as ASCII), with SMTPUTF8 for the internationalized addresses.
+        # A server without SMTPUTF8 refuses those with SMTPNotSupportedError, which is a permanent failure.
+        # smtplib leaves the line endings of bytes alone, so the bare \n are turned into \r\n here like it does for a str
+        data = re.sub(r"\r\n|\n|\r(?!\n)", "\r\n", message).encode() if isinstance(message, str) else message
+        mail_options = [] if (from_addr + to_addr).isascii() else ["SMTPUTF8"]
+        attempt = 0
+        while True:
+            wait = last_sent + min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.sendmail(from_addr, to_addr, data, mail_options)
+                last_sent = time.monotonic()
+                self._count("sent")
+                future.set_result(to_addr)
+                return connection, last_sent
+            except OSError as e:  # smtplib.SMTPException is an OSError as well
+                if is_connection_error(e):
+                    self._close(connection)
+                    connection = None
+                attempt += 1
+                if not is_temporary_error(e) or attempt > self.max_retries:
+                    logger.warning("Couldn't send mail to %s: %s", to_addr, e)
+                    self._count("failed")
+                    future.set_exception(e)
+                    return connection, last_sent
+                self._count("retries")
+                time.sleep(self.retry_delay * attempt)
+
+
+_sender: MailSender | None = None
+_sender_lock = threading.Lock()
+
+
+def get_sender() -> MailSender:
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = MailSender.from_env()
+        return _sender
+
+
+def shutdown() -> None:
+    """
+    Flushes the mail queue, called when the server shuts down
+    """
+    if _sender is not None:
+        _sender.stop()
+
+
+class MailTemplate:
+    """
+    Renders the MIME message only once, every mail just gets its own To and extra headers on top of it
+    """
+
+    def __init__(self, subject: str, html_body: str, from_addr: str) -> None:
+        self.from_addr = from_addr
+        msg = MIMEMultipart()
+        msg["From"] = from_addr
+        msg["Subject"] = subject
+        msg.attach(MIMEText(html_body, "html"))
+        self._rendered = msg.as_string(policy=policy.SMTP)
+
+    def render(self, to_addr: str, headers: dict[str, str] | None = None) -> str:
+        lines = [f"To: {to_addr}"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        return "\r\n".join(lines) + "\r\n" + self._rendered
+
 
 def send(
     email_ids: List[str],
@@ -12,28 +290,25 @@ def send(
     html_body: str,
     mailing_list: bool = False,
     unsubscribe_url: str = "",
-) -> None:
+) -> List[Future]:
     """
-    sends mail to those email_ids
+    Queues the mail for those email_ids and returns without waiting for the delivery
     """
-    with smtplib.SMTP(
-        os.getenv("MAIL_SERVER", "smtp.gmail.com"), int(os.getenv("MAIL_PORT", 587))
-    ) as mail_server:
-        mail_server.starttls()
-        mail_server.login(os.getenv("MAIL_USER", ""), os.getenv("MAIL_PASS", ""))
-        for email_id in email_ids:
-            # Don't send email if it is a test mail
-            if email_id.startswith("test-acm-sist"):
-                continue
-            msg = MIMEMultipart()
-            msg["From"] = os.getenv("MAIL_USER", "")
-            msg["To"] = email_id
-            msg["Subject"] = subject
-            if mailing_list:
-                msg.add_header("List-Unsubscribe", unsubscribe_url)
-            msg.attach(MIMEText(html_body, "html"))
-            mail_server.sendmail(os.getenv("MAIL_USER", ""), email_id, msg.as_string())
-            time.sleep(2)
+    sender = get_sender()
+    template = MailTemplate(subject, html_body, os.getenv("MAIL_USER", ""))
+    headers = {"List-Unsubscribe": unsubscribe_url} if mailing_list else None
+    priority = BULK if mailing_list else TRANSACTIONAL
+    futures = []
+    for email_id in email_ids:
+        # Don't send email if it is a test mail
+        if email_id.startswith("test-acm-sist"):
+            continue
+        futures.append(
+            sender.submit(
+                template.from_addr, email_id, template.render(email_id, headers), priority
+            )
+        )
+    return futures
 
 
 def verification_mail(request, verify_link) -> str:
@@ -0,0 +1,176 @@
+"""
+Keyset (cursor) pagination
+
+A page is ordered by an indexed column plus the primary key as a tiebreak. The cursor of the next page
+is the sort key of the last row of the current page, so the next page is a WHERE (column, id) > (last column, last id)
+query which uses the index instead of an OFFSET that has to walk through all the previous pages.
+The cursor is sent back to the client in the X-Next-Cursor header, the body stays a plain list.
+With count=exact or count=estimate the X-Total-Count header has the number of results. The estimate comes from
+the statistics of the database (sqlite_stat1 / pg_class) when the query has no filters, otherwise it is counted.
+
+Configuration (environment variables):
+    DEFAULT_PAGE_SIZE -> Page size when the client doesn't send limit (default: 50)
+    MAX_PAGE_SIZE -> Max page size a client can ask for (default: 100)
+"""
+
+import os
+import json
+import base64
+import binascii
+from datetime import date, datetime
+from typing import Any, Callable, Sequence
+from uuid import UUID
+from fastapi import HTTPException, Query, Response, status
+from sqlalchemy import and_, or_, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import ColumnElement, Select
+from sqlmodel import Session, func, select
+from sqlmodel.sql.sqltypes import GUID
+from app.schema import CountMode
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+invalid_cursor_exception = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+)
+
+
+class PageParams:
+    """
+    Query parameters of a paginated endpoint, used as Depends()
+    """
+
+    def __init__(
+        self,
+        cursor: str | None = Query(None, description="X-Next-Cursor of the previous page"),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        count: CountMode = Query(CountMode.NONE, description="Send the number of results in X-Total-Count"),
+    ) -> None:
+        self.cursor = cursor
+        self.limit = limit
+        self.count = count
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    data = json.dumps([str(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence[ColumnElement]) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise invalid_cursor_exception
+        return [_load(column, value) for column, value in zip(columns, values)]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise invalid_cursor_exception
+
+
+def _load(column: ColumnElement, value: str) -> Any:
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        # sqlmodel's GUID doesn't tell its python type
+        return UUID(value) if isinstance(column.type, GUID) else value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is UUID:
+        return UUID(value)
+    return python_type(value)
+
+
+def keyset(
+    query: Select,
+    columns: Sequence[ColumnElement],
+    page: PageParams,
+    descending: bool = False,
+) -> Select:
+    """
+    Orders the query by the columns (the last one has to be unique), skips to the cursor and
+    fetches one row more than the limit to know whether there is a next page
+    """
+    if page.cursor:
+        values = decode_cursor(page.cursor, columns)
+        # (a, b) > (x, y) written as a > x OR (a = x AND b > y) so every database can use the index
+        conditions = []
+        for n, column in enumerate(columns):
+            after = column < values[n] if descending else column > values[n]
+            equal = [columns[m] == values[m] for m in range(n)]
+            conditions.append(and_(*equal, after))
+        query = query.where(or_(*conditions))
+    order = [column.desc() if descending else column.asc() for column in columns]
+    return query.order_by(*order).limit(page.limit + 1)
+
+
+def next_page(
+    rows: Sequence[Any],
+    page: PageParams,
+    key: Callable[[Any], Sequence[Any]],
+    response: Response,
+) -> Sequence[Any]:
+    """
+    Drops the extra row fetched by keyset() and sets the X-Next-Cursor header when there is a next page
+    """
+    if len(rows) > page.limit:
+        rows = rows[: page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key(rows[-1]))
+    return rows
+
+
+def model_key(columns: Sequence[ColumnElement]) -> Callable[[Any], list[Any]]:
+    """
+    key for next_page() when the rows are model objects
+    """
+    return lambda row: [getattr(row, column.key) for column in columns]
+
+
+def estimate_rows(db: Session, table: str) -> int | None:
+    """
+    Row count from the statistics of the database (kept up to date by ANALYZE / PRAGMA optimize), None if there aren't any
+    """
+    conn = db.connection()
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        try:
+            stat = conn.execute(
+                text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table LIMIT 1"),
+                {"table": table},
+            ).scalar()
+        except OperationalError:  # sqlite_stat1 is only created by the first ANALYZE
+            return None
+        return int(stat.split()[0]) if stat else None
+    if dialect == "postgresql":
+        rows = conn.execute(
+            text("SELECT reltuples FROM pg_class WHERE relname = :table"),
+            {"table": table},
+        ).scalar()
+        return int(rows) if rows is not None and rows >= 0 else None
+    return None
+
+
+def set_total_count(
+    db: Session,
+    query: Select,
+    page: PageParams,
+    response: Response,
+    table: str | None = None,
+) -> None:
+    """
+    Sets X-Total-Count when the client asked for it. table is the table to estimate from, only when the query has no filters
+    """
+    if page.count == CountMode.NONE:
+        return
+    total = None
+    if page.count == CountMode.ESTIMATE and table:
+        total = estimate_rows(db, table)
+    if total is None:
+        total = db.exec(
+            select(func.count()).select_from(query.order_by(None).subquery())
+        ).one()
+    response.headers[TOTAL_COUNT_HEADER] = str(total)
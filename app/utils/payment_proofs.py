@@ -0,0 +1,143 @@
+"""
+Registry of the payment screenshots
+
+Every upload has a row in Payment_Proofs, and its file is stored by the SHA-256 of its content in two levels of
+directories (payment_proof/ab/cd/abcd….png), so no directory grows past a few hundred files and an image which
+was already uploaded is found by an indexed lookup of its hash instead of being stored again. The upload of a
+duplicate gets the screenshot_id of the first one, which Event_Registeration.screenshot_id only accepts once.
+The id of an upload is its hash with the extension of its detected type (not of its file name), so the primary key
+keeps a single row per image even when it is uploaded twice at once.
+
+The screenshots of the old flat layout (payment_proof/<random id>.png) are moved into the registry at startup,
+keeping their ids.
+
+Configuration (environment variables):
+    PAYMENT_PROOF_DIR -> (default: payment_proof)
+"""
+
+import os
+import logging
+import magic
+from datetime import datetime
+from hashlib import sha256
+from pathlib import Path
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.config import IST
+from app.db.db import DBSession
+from app.db.models import Payment_Proofs
+from app.utils.security import ALLOWED_IMAGE_EXTENSIONS
+from app.utils.uploads import SNIFF_BYTES, save_image
+
+ROOT = Path(os.getenv("PAYMENT_PROOF_DIR", "payment_proof"))
+
+# Extension of the stored file of each image type
+EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg"}
+
+logger = logging.getLogger(__name__)
+
+
+def path_of(proof: Payment_Proofs) -> Path:
+    return ROOT / proof.sha256[:2] / proof.sha256[2:4] / f"{proof.sha256}{proof.extension}"
+
+
+def _extension(file_name: str) -> str:
+    return Path(file_name).suffix.lower()
+
+
+def _inspect(partial: Path, file_name: str) -> tuple[str, int]:
+    """
+    Extension of the detected type of the uploaded file (the one of file_name for the other types) and its size
+    """
+    with partial.open("rb") as file:
+        mime = magic.from_buffer(file.read(SNIFF_BYTES), True)
+    return EXTENSIONS.get(mime, _extension(file_name)), partial.stat().st_size
+
+
+def _find(db: Session, digest: str) -> Payment_Proofs | None:
+    return db.exec(select(Payment_Proofs).where(Payment_Proofs.sha256 == digest).limit(1)).first()
+
+
+def _place(partial: Path, destination: Path) -> None:
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    # Another upload of the same image may have got there first, the content is the same either way
+    os.replace(partial, destination)
+
+
+async def store(
+    db: DBSession, upload: UploadFile, uploaded_by: str | None, uploaded_from: str | None
+) -> tuple[Payment_Proofs, bool]:
+    """
+    Saves the uploaded screenshot unless the same image is already there, returns its proof and whether it is a
+    duplicate
+    """
+    ROOT.mkdir(exist_ok=True)
+    partial, digest = await save_image(upload, ROOT)
+    try:
+        existing = await db.run_sync(_find, digest)
+        if existing:
+            return existing, True
+        extension, size = await run_in_threadpool(_inspect, partial, upload.filename or "")
+        proof = Payment_Proofs(
+            id=f"{digest}{extension}",
+            sha256=digest,
+            extension=extension,
+            size=size,
+            uploaded_by=uploaded_by,
+            uploaded_from=uploaded_from,
+            uploaded_at=datetime.now(IST),
+        )
+        await run_in_threadpool(_place, partial, path_of(proof))
+        db.add(proof)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # The same image uploaded at the same time
+            await db.rollback()
+            return (await db.get(Payment_Proofs, proof.id)), True
+        return proof, False
+    finally:
+        await run_in_threadpool(partial.unlink, missing_ok=True)
+
+
+def import_legacy(engine: Engine) -> int:
+    """
+    Moves the screenshots of the flat layout into the registry, returns how many were moved
+    """
+    if not ROOT.is_dir():
+        return 0
+    moved = 0
+    with Session(engine) as db:
+        for file in ROOT.iterdir():
+            if not file.is_file() or not file.name.lower().endswith(ALLOWED_IMAGE_EXTENSIONS):
+                continue
+            registered = db.get(Payment_Proofs, file.name)
+            if registered:
+                # Stopped between the commit and the move
+                _place(file, path_of(registered))
+                continue
+            digest = sha256()
+            with file.open("rb") as content:
+                while chunk := content.read(1024 * 1024):
+                    digest.update(chunk)
+            existing = _find(db, digest.hexdigest())
+            proof = Payment_Proofs(
+                id=file.name,
+                sha256=digest.hexdigest(),
+                extension=existing.extension if existing else _extension(file.name),
+                size=file.stat().st_size,
+                uploaded_at=datetime.fromtimestamp(file.stat().st_mtime, IST),
+            )
+            db.add(proof)
+            db.commit()
+            if existing:
+                file.unlink()
+            else:
+                _place(file, path_of(proof))
+            moved += 1
+    if moved:
+        logger.info("Moved %d payment screenshots into the registry", moved)
+    return moved
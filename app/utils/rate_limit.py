@@ -0,0 +1,239 @@
+"""
+Rate limits of the unauthenticated endpoints which cost a bcrypt hash, a DNS lookup or a mail
+
+Every rule has a token bucket per client address and one per email: a bucket holds up to `capacity` requests and
+refills at `capacity / period` per second, so a client can send a burst of `capacity` requests and then one every
+`period / capacity` seconds. A request which finds its bucket empty gets 429 with Retry-After. The per email
+buckets stop a single account from being guessed or flooded with mails from many addresses, the per address ones
+stop a single client from going through many emails.
+
+A bucket is two numbers (tokens and the time they were counted at). The in memory backend keeps the buckets of the
+RATE_LIMIT_SIZE most recently seen keys of the worker, the ones it evicts were idle the longest (which is what
+a full bucket looks like). With RATE_LIMIT_URL the buckets are in Redis, shared by all the workers.
+
+The address is the one of the connection, behind a reverse proxy run uvicorn with --proxy-headers (and
+--forwarded-allow-ips) so it is the address of the client. Students on the campus network share an address,
+the per address limits are meant to be generous.
+
+Configuration (environment variables):
+    RATE_LIMIT_URL -> redis:// URL to share the buckets between workers, needs the redis package (default: in memory)
+    RATE_LIMIT_SIZE -> Max keys of the in memory backend (default: 100000)
+    RATE_LIMIT_<RULE> -> Buckets of a rule (LOGIN, SIGNUP, FORGOT_PASSWORD, SUBSCRIBE) as
+                         ip=<capacity>/<period seconds>,email=<capacity>/<period seconds>, like the defaults in RULES
+"""
+
+import os
+import math
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple
+from fastapi import HTTPException, Request, status
+
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+RATE_LIMIT_SIZE = int(os.getenv("RATE_LIMIT_SIZE", 100000))
+
+
+class Bucket(NamedTuple):
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+def parse_rule(value: str) -> dict[str, Bucket]:
+    """
+    "ip=30/60,email=5/300" -> {"ip": Bucket(30, 60), "email": Bucket(5, 300)}
+    """
+    buckets = {}
+    for part in value.split(","):
+        name, _, limit = part.strip().partition("=")
+        capacity, _, period = limit.partition("/")
+        buckets[name.strip()] = Bucket(int(capacity), float(period))
+    return buckets
+
+
+# Rule -> buckets, per client address and per email
+RULES = {
+    name: parse_rule(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+    for name, default in {
+        "login": "ip=30/60,email=10/300",
+        "signup": "ip=10/60,email=3/3600",
+        "forgot_password": "ip=10/60,email=3/3600",
+        "subscribe": "ip=10/60,email=3/3600",
+    }.items()
+}
+
+
+def _take(bucket: Bucket, tokens: float | None, counted_at: float | None, now: float) -> tuple[float, float]:
+    """
+    Refills the bucket (None when there isn't one yet) up to now and takes a token from it. Returns the tokens left
+    and 0, or the seconds until there is a token when it is empty
+    """
+    if tokens is None or counted_at is None:
+        tokens = bucket.capacity
+    else:
+        tokens = min(bucket.capacity, tokens + max(now - counted_at, 0) * bucket.rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / bucket.rate
+
+
+class MemoryBackend:
+    """
+    Buckets of this process, the least recently used are evicted past size keys
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, bucket: Bucket) -> float:
+        """
+        Takes a token from the bucket of key, returns 0 or the seconds until there is one
+        """
+        now = time.monotonic()
+        tokens, wait = _take(bucket, *self._buckets.pop(key, (None, None)), now)
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.size:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def clear(self) -> None:
+        self._buckets.clear()
+
+    async def count(self) -> int:
+        return len(self._buckets)
+
+
+class RedisBackend:
+    """
+    Buckets in Redis (or anything speaking its protocol), shared by all the workers. A bucket is updated in a
+    WATCH / MULTI transaction, which is tried again when another worker changed it in between, and expires once it
+    would be full again. The workers' clocks are expected to agree
+    """
+
+    def __init__(self, client: Any, prefix: str = "acm:rate:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        import redis.asyncio  # Only needed when the buckets are shared
+
+        return cls(redis.asyncio.Redis.from_url(url))
+
+    async def take(self, key: str, bucket: Bucket) -> float:
+        from redis.exceptions import WatchError
+
+        name = self.prefix + key
+        async with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(name)
+                    tokens, counted_at = await pipe.hmget(name, ["tokens", "counted_at"])
+                    now = time.time()
+                    tokens, wait = _take(
+                        bucket,
+                        float(tokens) if tokens is not None else None,
+                        float(counted_at) if counted_at is not None else None,
+                        now,
+                    )
+                    pipe.multi()
+                    pipe.hset(name, mapping={"tokens": tokens, "counted_at": now})
+                    pipe.pexpire(name, math.ceil(bucket.period * 1000))
+                    await pipe.execute()
+                    return wait
+                except WatchError:
+                    continue
+
+    async def clear(self) -> None:
+        keys = [key async for key in self.client.scan_iter(f"{self.prefix}*")]
+        if keys:
+            await self.client.delete(*keys)
+
+    async def count(self) -> int:
+        return len([key async for key in self.client.scan_iter(f"{self.prefix}*")])
+
+
+class RateLimiter:
+    def __init__(self, backend: MemoryBackend | RedisBackend, enabled: bool = True) -> None:
+        self.backend = backend
+        self.enabled = enabled
+        self.allowed = 0
+        self.limited: dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        return cls(RedisBackend.from_url(RATE_LIMIT_URL) if RATE_LIMIT_URL else MemoryBackend(RATE_LIMIT_SIZE))
+
+    async def hit(self, rule: str, **keys: str | None) -> None:
+        """
+        Takes a token from the buckets of the rule for keys (ip=..., email=...), raises 429 when one of them is
+        empty. The buckets are taken in order, an empty one leaves the next ones alone
+        """
+        if not self.enabled:
+            return
+        for name, bucket in RULES[rule].items():
+            value = keys.get(name)
+            if not value:
+                continue
+            wait = await self.backend.take(f"{rule}:{name}:{value}", bucket)
+            if wait > 0:
+                self.limited[rule] = self.limited.get(rule, 0) + 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests, please try again later",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+        self.allowed += 1
+
+    async def metrics(self) -> dict[str, Any]:
+        return {
+            "shared": isinstance(self.backend, RedisBackend),
+            "keys": await self.backend.count(),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+rate_limiter = RateLimiter.from_env()
+
+
+async def _field(request: Request, field: str) -> Any:
+    """
+    field of the query, form or JSON body. FastAPI has already read the body, the request keeps it
+    """
+    if field in request.query_params:
+        return request.query_params[field]
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(("application/x-www-form-urlencoded", "multipart/form-data")):
+        return (await request.form()).get(field)
+    if content_type.startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+        return body.get(field) if isinstance(body, dict) else None
+    return None
+
+
+class RateLimit:
+    """
+    Dependency which applies a rule of RULES to the request, the email is read from email_field of the request
+    """
+
+    def __init__(self, rule: str, email_field: str | None = "email") -> None:
+        if rule not in RULES:
+            raise ValueError(f"Unknown rate limit rule {rule}")
+        self.rule = rule
+        self.email_field = email_field
+
+    async def __call__(self, request: Request) -> None:
+        email = await _field(request, self.email_field) if self.email_field else None
+        await rate_limiter.hit(
+            self.rule,
+            ip=request.client.host if request.client else None,
+            email=email.strip().lower() if isinstance(email, str) else None,
+        )
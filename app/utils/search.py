@@ -0,0 +1,142 @@
+"""
+Full text search of the blogs
+
+SQLite: an FTS5 table blogs_fts with the title, description and author of every blog, kept in sync with the blogs
+table by triggers (so it doesn't matter which code path changes a blog). It is an external content table on the
+rowid of the blogs, so the text isn't stored twice and the triggers find the entry of a blog by its rowid. VACUUM
+can renumber those rowids (blogs has no INTEGER PRIMARY KEY), run create_index(engine, rebuild=True) after one.
+Results are ranked by BM25 with the title weighing the most, and the prefix indexes keep the prefix queries fast.
+PostgreSQL: a GIN index on the tsvector of the same columns, ranked by ts_rank_cd.
+
+Every word of q matches as a prefix ("sea lear" finds "Season of Learning"), all the words have to match.
+"""
+
+import re
+from typing import Any
+from fastapi import Response
+from sqlalchemy import Float, Integer, column, func, literal_column, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import ColumnElement, Select
+from sqlmodel import Session, select
+from app.db.models import Blogs
+from app.utils.pagination import PageParams, keyset, next_page, set_total_count
+
+MARK_START = "<mark>"
+MARK_END = "</mark>"
+# Words around the matches in the snippet
+SNIPPET_WORDS = 16
+# Weights of title, description and author in the ranking
+WEIGHTS = (10.0, 1.0, 5.0)
+
+blogs_fts = table("blogs_fts", column("rowid", Integer), column("id"), column("rank", Float))
+
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS blogs_fts USING fts5(
+        id UNINDEXED, title, description, author, content = 'blogs', content_rowid = 'rowid',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS blogs_fts_insert AFTER INSERT ON blogs BEGIN
+        INSERT INTO blogs_fts (rowid, id, title, description, author)
+        VALUES (new.rowid, new.id, new.title, new.description, new.author);
+    END""",
+    # An external content table is told the old values to remove them from the index
+    """CREATE TRIGGER IF NOT EXISTS blogs_fts_update AFTER UPDATE OF id, title, description, author ON blogs BEGIN
+        INSERT INTO blogs_fts (blogs_fts, rowid, id, title, description, author)
+        VALUES ('delete', old.rowid, old.id, old.title, old.description, old.author);
+        INSERT INTO blogs_fts (rowid, id, title, description, author)
+        VALUES (new.rowid, new.id, new.title, new.description, new.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blogs_fts_delete AFTER DELETE ON blogs BEGIN
+        INSERT INTO blogs_fts (blogs_fts, rowid, id, title, description, author)
+        VALUES ('delete', old.rowid, old.id, old.title, old.description, old.author);
+    END""",
+]
+# The index before it was keyed on the rowid of the blogs
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS blogs_fts_insert",
+    "DROP TRIGGER IF EXISTS blogs_fts_update",
+    "DROP TRIGGER IF EXISTS blogs_fts_delete",
+    "DROP TABLE IF EXISTS blogs_fts",
+]
+
+
+def _document() -> ColumnElement:
+    return func.to_tsvector(
+        "simple",
+        func.concat_ws(" ", Blogs.title, Blogs.description, Blogs.author),
+    )
+
+
+def create_index(engine: Engine, rebuild: bool = False) -> None:
+    """
+    Creates the search index if it doesn't exist yet, filling it with the blogs which are already there.
+    rebuild fills it again from the blogs
+    """
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            existing = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'blogs_fts'")).scalar()
+            if existing is not None and "content_rowid" not in existing:
+                for statement in SQLITE_DROP:
+                    conn.execute(text(statement))
+                existing = None
+            for statement in SQLITE_INDEX:
+                conn.execute(text(statement))
+            weights = ", ".join(str(weight) for weight in WEIGHTS)
+            # Ranks by BM25 with the weights (the id column has none), so the rank column is computed once per match
+            conn.execute(text(f"INSERT INTO blogs_fts (blogs_fts, rank) VALUES ('rank', 'bm25(0.0, {weights})')"))
+            if existing is None or rebuild:
+                conn.execute(text("INSERT INTO blogs_fts (blogs_fts) VALUES ('rebuild')"))
+        elif engine.dialect.name == "postgresql":
+            document = _document().compile(conn, compile_kwargs={"literal_binds": True})
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS blogs_search_idx ON blogs USING GIN ({document})"))
+
+
+def terms(q: str) -> list[str]:
+    """
+    Words of the search, everything else (like the operators of the query syntax) is dropped
+    """
+    return re.findall(r"\w+", q.lower())
+
+
+def search_blogs(db: Session, query: Select, q: str, page: PageParams, response: Response) -> list[tuple[Blogs, str]]:
+    """
+    Page of the blogs of query (a select(Blogs) with the filters) which match q, best match first, with their
+    snippets. The matches are ranked and paginated on the index alone, only the blogs of the page are loaded
+    """
+    words = terms(q)
+    if db.get_bind().dialect.name == "postgresql":
+        tsquery = func.to_tsquery("simple", " & ".join(f"{word}:*" for word in words))
+        rank = (-func.ts_rank_cd(_document(), tsquery)).cast(Float)
+        matches = select(Blogs.id.label("key"), rank.label("score")).where(_document().op("@@")(tsquery))
+        if query.whereclause is not None:
+            matches = matches.where(query.whereclause)
+        set_total_count(db, matches, page, response)
+        found = keyset(matches, [rank, Blogs.id], page).subquery()
+        options = f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}"
+        rows = db.execute(
+            select(Blogs, found.c.score, found.c.key, func.ts_headline("simple", Blogs.description, tsquery, options))
+            .join(found, Blogs.id == found.c.key)
+            .order_by(found.c.score, found.c.key)
+        ).all()
+        rows = next_page(rows, page, lambda row: [row[1], row[2]], response)
+        return [(row[0], row[3]) for row in rows]
+
+    fts: Any = literal_column("blogs_fts")
+    match = fts.op("MATCH")(" ".join(f'"{word}"*' for word in words))
+    # The rank column is BM25 with the WEIGHTS set by create_index()
+    rank = blogs_fts.c.rank
+    matches = select(blogs_fts.c.id, rank.label("score"), blogs_fts.c.rowid.label("key")).where(match)
+    if query.whereclause is not None:
+        matches = matches.join(Blogs, Blogs.id == blogs_fts.c.id).where(query.whereclause)
+    set_total_count(db, matches, page, response)
+    found = keyset(matches, [rank, blogs_fts.c.rowid], page).subquery()
+    rows = db.execute(
+        select(Blogs, found.c.score, found.c.key).join(found, Blogs.id == found.c.id).order_by(found.c.score, found.c.key)
+    ).all()
+    rows = next_page(rows, page, lambda row: [row[1], row[2]], response)
+    # snippet() is slow enough to only run it for the page, column 2 is the description
+    snippet = func.snippet(fts, 2, MARK_START, MARK_END, "…", SNIPPET_WORDS)
+    snippets = dict(
+        db.execute(select(blogs_fts.c.rowid, snippet).where(match, blogs_fts.c.rowid.in_([row[2] for row in rows]))).all()
+    )
+    return [(row[0], snippets.get(row[2])) for row in rows]
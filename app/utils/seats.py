@@ -0,0 +1,59 @@
+"""
+Seats of the events with a capacity
+
+Every such event has a row in Event_Seats with the number of seats taken. A registration takes its seat with a
+single conditional UPDATE (taken + 1 only while taken is below the capacity of the event) in the same transaction as
+the registration itself, so concurrent registrations can't oversell: the database applies them one at a time and the
+ones which find the event full change nothing. A registration which fails later on (already registered, transaction
+id used...) rolls its seat back along with it.
+The seats are taken by the pending and verified registrations, rejecting a payment gives the seat back.
+"""
+
+from collections import Counter
+from typing import Iterable
+from uuid import UUID
+from sqlmodel import Session, func, select, update
+from app.db.models import Event_Registeration, Event_Seats, Events
+
+
+def ensure(db: Session, event_id: UUID) -> Event_Seats:
+    """
+    Seats row of an event which now has a capacity, created by counting the registrations it already has
+    """
+    event_seats = db.get(Event_Seats, event_id)
+    if event_seats:
+        return event_seats
+    taken = db.exec(
+        select(func.count())
+        .select_from(Event_Registeration)
+        .where(Event_Registeration.event_id == event_id, Event_Registeration.status != "rejected")
+    ).one()
+    event_seats = Event_Seats(event_id=event_id, taken=taken)
+    db.add(event_seats)
+    return event_seats
+
+
+def take(db: Session, event_id: UUID) -> bool:
+    """
+    Takes a seat as part of the caller's transaction, False if the event is full
+    """
+    capacity = select(Events.capacity).where(Events.id == event_id).scalar_subquery()
+    return bool(
+        db.exec(
+            update(Event_Seats)
+            .where(Event_Seats.event_id == event_id, Event_Seats.taken < capacity)
+            .values(taken=Event_Seats.taken + 1)
+        ).rowcount
+    )
+
+
+def release(db: Session, event_ids: Iterable[UUID]) -> None:
+    """
+    Gives back a seat per event id (an event can be there more than once), as part of the caller's transaction
+    """
+    for event_id, count in Counter(event_ids).items():
+        db.exec(
+            update(Event_Seats)
+            .where(Event_Seats.event_id == event_id)
+            .values(taken=Event_Seats.taken - count)
+        )
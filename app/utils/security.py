@@ -1,20 +1,110 @@
+import os
 import string
 import time
 import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import bcrypt
 import magic
 from fastapi import HTTPException, status
 
 ALLOWED_IMAGE_EXTENSIONS = (".jpg", ".png", ".jpeg")
 
+# Cost factor of the new password hashes, the old hashes are rehashed when the user logs in
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# bcrypt releases the GIL so a thread per CPU core is enough to keep all of them busy
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+# Number of hashes which can wait for a worker, the requests after that get 503
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", 32))
+
+# Every response of the EqualTimingMiddleware routes takes at least this many seconds (plus a random jitter)
+# It should be more than the time it takes to handle the real request
+EQUAL_TIMING_SECONDS = float(os.getenv("EQUAL_TIMING_SECONDS", 2))
+EQUAL_TIMING_JITTER = float(os.getenv("EQUAL_TIMING_JITTER", 0.5))
+
 def hash_(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
 
 
 def verify(password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed_password.encode())
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """
+    Whether the hash was made with a different cost than BCRYPT_ROUNDS ($2b$<cost>$<salt and hash>)
+    """
+    return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+
+
+class HashExecutor:
+    """
+    Runs bcrypt on its own bounded thread pool so logins and signups don't compete with
+    the other endpoints for the default threadpool.
+    When more than queue_limit hashes are already waiting it fails fast with 503 instead of queueing forever.
+    """
+
+    def __init__(self, workers: int, queue_limit: int) -> None:
+        self.workers = max(workers, 1)
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(self.workers + queue_limit)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+
+    async def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again in a moment",
+                headers={"Retry-After": "1"},
+            )
+        with self._lock:
+            self._in_flight += 1
+        start = time.monotonic()
+        try:
+            return await asyncio.wrap_future(self._executor.submit(func, *args))
+        finally:
+            took = time.monotonic() - start
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+                self._total_seconds += took
+                self._max_seconds = max(self._max_seconds, took)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self._in_flight,
+                "queue_depth": max(self._in_flight - self.workers, 0),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_seconds": self._total_seconds / self._completed if self._completed else 0.0,
+                "max_seconds": self._max_seconds,
+            }
+
+
+hasher = HashExecutor(HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+
+async def hash_async(password: str) -> str:
+    return await hasher.run(hash_, password)
+
+
+async def verify_async(password: str, hashed_password: str) -> bool:
+    return await hasher.run(verify, password, hashed_password)
+
+
 def check_pass(password: str):
     error_ = None
     if len(password) < 8:
@@ -31,13 +121,39 @@ def check_pass(password: str):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_)
 
 
-def pretend_like_sending_mail():
+class EqualTimingMiddleware:
     """
-    Pretend like sending an email to avoid user account enumeration attack
+    Pads the responses of the given routes to the same response time to avoid user account enumeration attack,
+    so sending the mail to an existing account and doing nothing for an unknown email takes the same time.
+    The wait is an asyncio.sleep so it doesn't hold any worker thread.
     """
-    time.sleep(random.choice((6.63, 6.13, 5.32)))
+
+    def __init__(self, app, routes: set[tuple[str, str]]) -> None:
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        deadline = (
+            time.monotonic()
+            + EQUAL_TIMING_SECONDS
+            + random.uniform(0, EQUAL_TIMING_JITTER)
+        )
+
+        async def send_padded(message):
+            if message["type"] == "http.response.start":
+                await asyncio.sleep(max(deadline - time.monotonic(), 0))
+            await send(message)
+
+        await self.app(scope, receive, send_padded)
+
 
 def is_valid_image(file_name: str, file_content: bytes):
+    """
+    file_content can be just the start of the file, libmagic only needs the header of the image
+    """
     file_mime = magic.from_buffer(file_content, True)
     return file_mime.startswith("image/") and any(file_name.lower().endswith(ext) for ext in ALLOWED_IMAGE_EXTENSIONS)
     
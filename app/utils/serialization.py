@@ -0,0 +1,35 @@
+"""
+Fast path from database rows to JSON for the list endpoints
+
+The list endpoints select only the columns of their response schema (plain rows, no ORM objects to build and
+track) and turn them into JSON bytes with a TypeAdapter which is built once per schema, so a page goes through
+pydantic's compiled validator and serializer once instead of FastAPI's response_model validation plus
+jsonable_encoder. Datetimes are converted to IST by the schemas themselves (see schema.ISTDateTime).
+"""
+
+from functools import lru_cache
+from typing import Any, Sequence
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy.sql import ColumnElement
+from sqlmodel import SQLModel
+
+
+@lru_cache
+def _list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def dump_json(model: type[BaseModel], rows: Sequence[Any]) -> bytes:
+    """
+    JSON of the rows (model objects, rows of columns() or dicts) as a list of that response model
+    """
+    adapter = _list_adapter(model)
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+
+@lru_cache
+def columns(table: type[SQLModel], model: type[BaseModel]) -> tuple[ColumnElement, ...]:
+    """
+    Columns of the table which are in the response model, to select(*columns(...)) plain rows
+    """
+    return tuple(getattr(table, name) for name in model.model_fields if name in table.__table__.columns)
@@ -0,0 +1,107 @@
+"""
+Streaming image uploads
+
+The file is copied to a temporary file in the directory of its destination in UPLOAD_CHUNK_BYTES chunks, hashing it
+on the way, with the file I/O on worker threads (anyio) so the event loop keeps serving the other requests. The
+caller renames it into place once it is complete, so a half written file is never visible under its final name.
+Only the first UPLOAD_SNIFF_BYTES are given to libmagic, the image formats are recognized from their header.
+
+The size limit is enforced twice: BodySizeLimitMiddleware counts the bytes of the request body while they are being
+received (a request which announces a larger Content-Length is refused before reading anything), and save_image()
+counts the bytes of the file itself. Starlette keeps up to 1 MiB of a file part in memory and spools the rest to
+disk, so the memory of an upload doesn't grow with the size of the image.
+
+Configuration (environment variables):
+    UPLOAD_MAX_BYTES -> Largest image accepted (default: 5 MiB)
+    UPLOAD_CHUNK_BYTES -> (default: 64 KiB)
+    UPLOAD_SNIFF_BYTES -> Bytes of the file used to detect its type (default: 8 KiB)
+"""
+
+import os
+from hashlib import sha256
+from pathlib import Path
+from secrets import token_urlsafe
+import anyio
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+from app.utils.security import is_valid_image
+
+MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 5 * 1024 * 1024))
+CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 64 * 1024))
+SNIFF_BYTES = int(os.getenv("UPLOAD_SNIFF_BYTES", 8 * 1024))
+# Room for the multipart boundaries and headers around the file in the request body
+FORM_OVERHEAD_BYTES = 16 * 1024
+
+TOO_LARGE = f"The image can't be larger than {MAX_BYTES // (1024 * 1024)} MiB"
+
+
+def too_large() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=TOO_LARGE)
+
+
+class BodySizeLimitMiddleware:
+    """
+    Refuses the requests of the given routes whose body is larger than their limit with 413, without reading
+    more than the limit
+    """
+
+    def __init__(self, app, limits: dict[tuple[str, str], int]) -> None:
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": TOO_LARGE}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the form parsing of the route, it becomes the 413 response
+                    raise too_large()
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+
+async def save_image(upload: UploadFile, directory: Path, max_bytes: int = MAX_BYTES) -> tuple[Path, str]:
+    """
+    Streams the uploaded image to a temporary file in directory, 400 if it isn't a JPG / PNG and 413 if it is larger
+    than max_bytes. Returns the temporary file (to be renamed by the caller) and the SHA-256 of the image
+    """
+    head = await upload.read(SNIFF_BYTES)
+    if not is_valid_image(upload.filename or "", head):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only JPG, JPEG and PNG image files are allowed"
+        )
+
+    partial = anyio.Path(directory) / f".{token_urlsafe(16)}.part"
+    digest = sha256()
+    size = 0
+    try:
+        async with await anyio.open_file(partial, "wb") as file:
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large()
+                digest.update(chunk)
+                await file.write(chunk)
+                chunk = await upload.read(CHUNK_BYTES)
+    except BaseException:
+        await partial.unlink(missing_ok=True)
+        raise
+    return Path(partial), digest.hexdigest()
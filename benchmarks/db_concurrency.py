@@ -0,0 +1,118 @@
+"""
+Throughput and latency of the read endpoints under many simultaneous clients, in DB_MODE=sync and DB_MODE=async
+
+    python benchmarks/db_concurrency.py --clients 300 --requests 10
+
+Every mode runs in its own process (the mode is read when the app is imported) against a fresh SQLite database
+with --events events, with the response cache off so every request reaches the database.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ENDPOINTS = ["/events/search?limit=50", "/events/search?upcoming=true&limit=20", "/achievements/"]
+
+
+def seed(engine, events: int) -> None:
+    from sqlmodel import Session
+    from app.config import IST
+    from app.db.models import Events
+
+    now = datetime.now(IST)
+    with Session(engine) as db:
+        for n in range(events):
+            db.add(
+                Events(
+                    name=f"Event {n}",
+                    description="Benchmark Event",
+                    start=now + timedelta(hours=n - events // 2),
+                    end=now + timedelta(hours=n - events // 2 + 2),
+                    rules="None",
+                    venue="Hall",
+                    fee=0,
+                    image_url="",
+                )
+            )
+        db.commit()
+
+
+async def client_loop(client, requests: int, latencies: list[float]) -> None:
+    for n in range(requests):
+        start = time.perf_counter()
+        res = await client.get(ENDPOINTS[n % len(ENDPOINTS)])
+        latencies.append(time.perf_counter() - start)
+        assert res.status_code == 200, res.text
+
+
+async def run(clients: int, requests: int) -> dict:
+    import httpx
+    from app.main import app
+
+    latencies: list[float] = []
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        await client.get(ENDPOINTS[0])  # Warm up
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, requests, latencies) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 2),
+        "req_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 1),
+    }
+
+
+def child(args) -> None:
+    from app import config, main  # noqa: F401, importing the app creates the tables
+
+    seed(config.db_engine, args.events)
+    print(json.dumps(asyncio.run(run(args.clients, args.requests))))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=10, help="Requests per client")
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    print(f"{args.clients} clients x {args.requests} requests, {args.events} events")
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                **os.environ,
+                "DB_MODE": mode,
+                "SQL_DB_URL": f"sqlite:///{tmp}/bench.db",
+                "RESPONSE_CACHE_SIZE": "0",
+            }
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", *sys.argv[1:]],
+                env=env,
+                capture_output=True,
+                text=True,
+                cwd=Path(__file__).resolve().parent.parent,
+            )
+            if out.returncode:
+                sys.exit(out.stderr)
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{mode:>6}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
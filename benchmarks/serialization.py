@@ -0,0 +1,98 @@
+"""
+Time to turn a page of events into the JSON body, per 10k rows
+
+    python benchmarks/serialization.py --rows 10000 --repeat 5
+
+orm + jsonable_encoder is the way the list endpoints used to do it (ORM objects, the IST conversion in a loop, then
+FastAPI's response_model validation, jsonable_encoder and json.dumps), columns + TypeAdapter is app/utils/serialization.py.
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+from app import schema  # noqa: E402
+from app.config import IST  # noqa: E402
+from app.db.db import create_table  # noqa: E402
+from app.db.engine import create_db_engine  # noqa: E402
+from app.db.models import Events  # noqa: E402
+from app.utils.serialization import columns, dump_json  # noqa: E402
+
+
+def seed(engine, rows: int) -> None:
+    now = datetime.now(IST)
+    with Session(engine) as db:
+        for n in range(rows):
+            db.add(
+                Events(
+                    name=f"Event {n}",
+                    description="Benchmark Event " * 8,
+                    start=now + timedelta(hours=n),
+                    end=now + timedelta(hours=n + 2),
+                    rules="None",
+                    venue="Hall",
+                    fee=n % 500,
+                    image_url=f"/static/events/{n}.png",
+                )
+            )
+        db.commit()
+
+
+def orm_jsonable_encoder(db: Session) -> bytes:
+    events = db.exec(select(Events).order_by(Events.start)).all()
+    for event in events:
+        event.start = event.start.astimezone(IST)
+        event.end = event.end.astimezone(IST)
+    adapter = TypeAdapter(list[schema.EventOut])  # FastAPI builds the response field once, like this
+    content = adapter.validate_python(events, from_attributes=True)
+    return json.dumps(jsonable_encoder(content)).encode()
+
+
+def orm_type_adapter(db: Session) -> bytes:
+    return dump_json(schema.EventOut, db.exec(select(Events).order_by(Events.start)).all())
+
+
+def columns_type_adapter(db: Session) -> bytes:
+    return dump_json(schema.EventOut, db.exec(select(*columns(Events, schema.EventOut)).order_by(Events.start)).all())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{tmp}/bench.db")
+        create_table(engine)
+        seed(engine, args.rows)
+        bodies = []
+        print(f"{args.rows} rows, best of {args.repeat} (ms per 10k rows)")
+        for name, serialize in (
+            ("orm + jsonable_encoder", orm_jsonable_encoder),
+            ("orm + TypeAdapter", orm_type_adapter),
+            ("columns + TypeAdapter", columns_type_adapter),
+        ):
+            timings = []
+            for _ in range(args.repeat):
+                with Session(engine) as db:
+                    start = time.perf_counter()
+                    body = serialize(db)
+                    timings.append(time.perf_counter() - start)
+            bodies.append(json.loads(body))
+            print(f"{name:>24}: {min(timings) * 1000 * 10000 / args.rows:.1f}")
+        engine.dispose()
+        assert all(body == bodies[0] for body in bodies), "The bodies differ"
+
+
+if __name__ == "__main__":
+    main()
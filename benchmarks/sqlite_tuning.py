@@ -0,0 +1,131 @@
+"""
+Mixed read/write throughput of SQLite with a bare engine and with the tuned engine of app/db/engine.py
+
+    python benchmarks/sqlite_tuning.py --readers 8 --writers 4 --seconds 10
+
+Readers list upcoming events and look up users, writers register users the way POST /users/ does
+(insert + counter update in one transaction). Each engine gets a fresh database file.
+"""
+
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlmodel import Session, create_engine, select, update  # noqa: E402
+from app.config import IST  # noqa: E402
+from app.db.db import create_table  # noqa: E402
+from app.db.engine import create_db_engine  # noqa: E402
+from app.db.models import Counters, Events, Users  # noqa: E402
+
+
+def seed(engine, events: int, users: int) -> None:
+    now = datetime.now(IST)
+    with Session(engine) as db:
+        for n in range(events):
+            db.add(
+                Events(
+                    name=f"Event {n}",
+                    description="Benchmark Event",
+                    start=now + timedelta(hours=n - events // 2),
+                    end=now + timedelta(hours=n - events // 2 + 2),
+                    rules="None",
+                    venue="Hall",
+                    fee=0,
+                    image_url="",
+                )
+            )
+        for n in range(users):
+            db.add(user(n))
+        db.add(Counters(name="users_count", value=users))
+        db.commit()
+
+
+def user(reg_no: int) -> Users:
+    return Users(
+        reg_no=reg_no,
+        name=f"User {reg_no}",
+        email=f"user{reg_no}@bench.com",
+        department="CSE",
+        university="Sathyabama University",
+        year=2,
+        joined_at=datetime.now(IST),
+        verified=True,
+    )
+
+
+def read(engine, users: int) -> None:
+    with Session(engine) as db:
+        db.exec(select(Events).where(Events.start > datetime.now(IST)).order_by(Events.start).limit(20)).all()
+        db.get(Users, random.randrange(users))
+
+
+def write(engine, reg_no: int) -> None:
+    with Session(engine) as db:
+        db.add(user(reg_no))
+        db.exec(update(Counters).where(Counters.name == "users_count").values(value=Counters.value + 1))
+        db.commit()
+
+
+def run(engine, args) -> dict:
+    seed(engine, args.events, args.users)
+    stop = time.perf_counter() + args.seconds
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lock = threading.Lock()
+    next_reg_no = iter(range(args.users, 10**9))
+
+    def worker(writer: bool) -> None:
+        while time.perf_counter() < stop:
+            try:
+                if writer:
+                    with lock:
+                        reg_no = next(next_reg_no)
+                    write(engine, reg_no)
+                else:
+                    read(engine, args.users)
+                kind = "writes" if writer else "reads"
+            except OperationalError:  # database is locked
+                kind = "locked"
+            with lock:
+                counts[kind] += 1
+
+    threads = [threading.Thread(target=worker, args=(n < args.writers,)) for n in range(args.readers + args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return {key: round(value / args.seconds, 1) for key, value in counts.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds}s (per second)")
+    for name, make_engine in (
+        # timeout=0 is SQLite's own default, Python's sqlite3 waits 5s on its own
+        ("bare", lambda url: create_engine(url, connect_args={"timeout": 0})),
+        ("tuned", create_db_engine),
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = make_engine(f"sqlite:///{tmp}/bench.db")
+            create_table(engine)
+            result = run(engine, args)
+            print(f"{name:>6}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
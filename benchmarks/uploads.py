@@ -0,0 +1,93 @@
+"""
+Concurrent payment screenshot uploads: the old buffered handler against app/utils/uploads.py
+
+    python benchmarks/uploads.py --uploads 32 --size 4
+
+Both handlers run in a throwaway app writing to a temporary directory. Reports the longest stall of the event loop
+(a task which should wake up every millisecond) and the peak of the memory allocated by Python during the burst.
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from secrets import token_urlsafe
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI, File, UploadFile  # noqa: E402
+from app.utils import uploads  # noqa: E402
+from app.utils.security import is_valid_image  # noqa: E402
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+
+
+def make_app(directory: Path) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/buffered")
+    async def buffered(image_file: UploadFile = File()):
+        # The handler before app/utils/uploads.py
+        file_content = await image_file.read()
+        assert is_valid_image(image_file.filename, file_content)
+        with (directory / f"{token_urlsafe(32)}.png").open("wb") as buffer:
+            buffer.write(file_content)
+
+    @app.post("/streamed")
+    async def streamed(image_file: UploadFile = File()):
+        partial, digest = await uploads.save_image(image_file, directory)
+        partial.rename(directory / f"{digest}.png")
+
+    return app
+
+
+async def burst(app: FastAPI, path: str, count: int, content: bytes, trace: bool) -> float:
+    """
+    Longest stall of the event loop in ms, or with trace the peak memory in MiB (tracemalloc slows everything down)
+    """
+    stalls = []
+
+    async def ticker():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - start - 0.001)
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        tick = asyncio.create_task(ticker())
+        if trace:
+            tracemalloc.start()
+        await asyncio.gather(
+            *(client.post(path, files={"image_file": ("proof.png", content)}) for _ in range(count))
+        )
+        tick.cancel()
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # The request bodies are built by the client in the same process, they are the same for both handlers
+            return peak / 1024 / 1024
+    return max(stalls) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=32)
+    parser.add_argument("--size", type=float, default=4, help="MiB per image")
+    args = parser.parse_args()
+
+    content = PNG + b"\x00" * int(args.size * 1024 * 1024)
+    print(f"{args.uploads} concurrent uploads of {args.size} MiB")
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(Path(tmp))
+        for path in ("/buffered", "/streamed"):
+            stall = asyncio.run(burst(app, path, args.uploads, content, trace=False))
+            peak = asyncio.run(burst(app, path, args.uploads, content, trace=True))
+            print(f"{path[1:]:>9}: longest event loop stall {stall:.1f} ms, peak memory {peak:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,126 @@
-from sqlmodel import create_engine, Session
-from app.db.db import create_table, get_db
+from contextlib import contextmanager
+from datetime import datetime
+from fastapi import Request
+from sqlmodel import Session, select
+from app import oauth2
+from app.config import DB_MODE, IST, async_url
+from app.db.db import EngineRouter, create_table, get_db, get_write_db
+from app.db.engine import create_async_db_engine, create_db_engine
+from app.db.models import Members, Payment_Proofs, Users
 from app.main import app
+from app.utils import payment_proofs
+from app.utils.cache import response_cache
+from app.utils.idempotency import idempotency_keys
+from app.utils.rate_limit import rate_limiter
 
 TEST_DATABASE_URL = "sqlite:///acm-test.db"
 
-db_engine = create_engine(TEST_DATABASE_URL)
+db_engine = create_db_engine(TEST_DATABASE_URL)
+# The endpoints run in the same DB_MODE as the app, the tests themselves use the sync engine
+async_db_engine = create_async_db_engine(async_url(TEST_DATABASE_URL)) if DB_MODE == "async" else None
+# Reads go through a read only pool like in the app
+read_db_engine = create_db_engine(TEST_DATABASE_URL, read_only=True)
+async_read_db_engine = (
+    create_async_db_engine(async_url(TEST_DATABASE_URL), read_only=True) if DB_MODE == "async" else None
+)
+# Engines the statements of the endpoints go through, for the tests which count them
+app_engines = [
+    engine.sync_engine if engine is not None else sync_engine
+    for sync_engine, engine in ((db_engine, async_db_engine), (read_db_engine, async_read_db_engine))
+]
 
 create_table(db_engine)
 
+db_router = EngineRouter((db_engine, async_db_engine), (read_db_engine, async_read_db_engine))
 
-def _get_db():
-    with Session(db_engine) as db:
+
+async def _get_db(request: Request):
+    async with db_router.session(request) as db:
+        yield db
+
+
+async def _get_write_db(request: Request):
+    async with db_router.session(request, write=True) as db:
         yield db
 
 
 app.dependency_overrides[get_db] = _get_db
+app.dependency_overrides[get_write_db] = _get_write_db
+
+# Most tests add their data straight to the database, which the response cache can't know about.
+# test_response_cache.py turns it on for its own tests
+response_cache.enabled = False
+
+# The tests send many requests from the same address, test_rate_limit.py turns it on for its own tests
+rate_limiter.enabled = False
+
+# The idempotency keys are stored in the test database too
+idempotency_keys.engine = db_engine
+
+
+def member_token(reg_no: int = 900001, email: str = "test-acm-member@test.com") -> str:
+    """
+    Adds the member straight to the test database (creating it through the API checks the email domain over the network)
+    and returns the access token of that member
+    """
+    with Session(db_engine) as db:
+        if not db.get(Members, reg_no):
+            db.add(
+                Members(
+                    reg_no=reg_no,
+                    name="TestMember",
+                    email=email,
+                    position="member",
+                    team="technical",
+                    season=2,
+                    chapter="acm",
+                    department="CSE",
+                    year=2,
+                    linkedin_tag="test_username",
+                    instagram_tag="test_username",
+                    joined_at=datetime.now(IST),
+                )
+            )
+            db.commit()
+    return oauth2.create_access_token({"email": email, "account_type": "member"})
+
+
+def user_token(reg_no: int = 900101, email: str = "test-acm-user@test.com") -> str:
+    """
+    Same as member_token() but for a verified user
+    """
+    with Session(db_engine) as db:
+        if not db.get(Users, reg_no):
+            db.add(
+                Users(
+                    reg_no=reg_no,
+                    name="TestUser",
+                    email=email,
+                    department="CSE",
+                    university="Sathyabama University",
+                    year=2,
+                    joined_at=datetime.now(IST),
+                    verified=True,
+                )
+            )
+            db.commit()
+    return oauth2.create_access_token({"email": email, "account_type": "user"})
+
+
+@contextmanager
+def removing_payment_proofs():
+    """
+    Removes the payment screenshots uploaded inside the block, with their files
+    """
+    with Session(db_engine) as db:
+        before = set(db.exec(select(Payment_Proofs.id)).all())
+    yield
+    with Session(db_engine) as db:
+        for proof in db.exec(select(Payment_Proofs).where(Payment_Proofs.id.not_in(before))).all():
+            path = payment_proofs.path_of(proof)
+            path.unlink(missing_ok=True)
+            for directory in (path.parent, path.parent.parent):
+                if directory.is_dir() and not any(directory.iterdir()):
+                    directory.rmdir()
+            db.delete(proof)
+        db.commit()
@@ -0,0 +1,70 @@
+"""
+Local SMTP sink used to test the mail delivery without a real mail server
+"""
+
+import socket
+import pytest
+from aiosmtpd.controller import Controller
+from app.utils.mail import MailSender
+
+
+class Sink:
+    """
+    Collects every mail and counts the SMTP sessions opened by the sender
+    """
+
+    def __init__(self):
+        self.mails = []
+        self.contents = []
+        self.raw = []
+        self.sessions = 0
+        self.reject = set()
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.mails.append((envelope.mail_from, envelope.rcpt_tos))
+        self.contents.append(envelope.content.decode())
+        self.raw.append(envelope.original_content)
+        return "250 Message accepted for delivery"
+
+
+class SinkServer:
+    def __init__(self):
+        self.handler = Sink()
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.controller = None
+
+    def start(self):
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+        self.controller.start()
+
+    def stop(self):
+        if self.controller:
+            self.controller.stop()
+            self.controller = None
+
+
+@pytest.fixture()
+def sink():
+    server = SinkServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+def make_sender(sink: SinkServer, **kwargs) -> MailSender:
+    options = {"rate_limit": 0, "retry_delay": 0.05, "starttls": False}
+    options.update(kwargs)
+    return MailSender("127.0.0.1", sink.port, "acm@test.com", **options)
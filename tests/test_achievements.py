@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import event
+from sqlmodel import Session, update
+from app.config import IST
+from app.db.models import Counters
+from app.utils import counters
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server"
+    ) as client:
+        yield client
+
+
+def actual_counts() -> dict[str, int]:
+    with Session(config.db_engine) as db:
+        return {name: db.exec(query).one() for name, query in counters.COUNTERS.items()}
+
+
+@pytest.mark.asyncio
+async def test_achievements_reads_only_counters(client: httpx.AsyncClient):
+    # Done by the reconciler at startup
+    with Session(config.db_engine) as db:
+        counters.reconcile(db)
+    await client.get("/achievements/")
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    for engine in config.app_engines:
+        event.listen(engine, "before_cursor_execute", listener)
+    try:
+        res = await client.get("/achievements/")
+    finally:
+        for engine in config.app_engines:
+            event.remove(engine, "before_cursor_execute", listener)
+    assert res.status_code == 200
+    assert res.json() == actual_counts()
+    # The table versions for the ETag and the counters
+    assert len(statements) == 2
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_counters_follow_changes(client: httpx.AsyncClient):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    with Session(config.db_engine) as db:
+        counters.reconcile(db)
+    before = (await client.get("/achievements/")).json()
+    now = datetime.now(IST)
+    res = await client.post(
+        "/events/",
+        json={
+            "name": "Counter Event",
+            "description": "Test Event",
+            "rules": "None",
+            "venue": "Test Venue",
+            "fee": 0,
+            "start": now.isoformat(),
+            "end": (now + timedelta(hours=1)).isoformat(),
+            "image_url": "",
+        },
+        headers=headers,
+    )
+    assert res.status_code == 200
+    after = (await client.get("/achievements/")).json()
+    assert after["events_count"] == before["events_count"] + 1
+    res = await client.request("DELETE", "/events/", json={"id": res.json()["id"]}, headers=headers)
+    assert res.status_code == 204
+    assert (await client.get("/achievements/")).json() == before == actual_counts()
+
+
+def test_reconcile_repairs_drift():
+    with Session(config.db_engine) as db:
+        counters.reconcile(db)
+        db.exec(update(Counters).where(Counters.name == "users_count").values(value=Counters.value + 5))
+        db.commit()
+        assert counters.reconcile(db) == {"users_count": -5}
+        assert counters.get_all(db) == actual_counts()
+        assert counters.reconcile(db) == {}
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import AsyncIterable
+from uuid import UUID
+import pytest
+import pytest_asyncio
+import httpx
+from sqlmodel import Session, delete, select
+from app.config import IST
+from app.db.models import Campaign, Campaign_Delivery, Mailing_List
+from app.utils import campaign
+from . import config
+from .smtp import make_sender, sink  # noqa: F401
+
+EMAILS = [f"campaign{n:02}@test.com" for n in range(25)]
+
+
+@pytest.fixture()
+def mailing_list():
+    with Session(config.db_engine) as db:
+        for email in EMAILS + ["test-acm-sist-campaign@test.com"]:
+            db.add(Mailing_List(email=email))
+        db.commit()
+    yield EMAILS
+    with Session(config.db_engine) as db:
+        db.exec(delete(Mailing_List).where(Mailing_List.email.like("%campaign%")))
+        db.exec(delete(Campaign_Delivery))
+        db.exec(delete(Campaign))
+        db.commit()
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server/mail"
+    ) as client:
+        yield client
+
+
+def new_campaign(**kwargs) -> Campaign:
+    data = {
+        "subject": "Hello",
+        "body": "<p>Hello World</p>",
+        "unsubscribe_url": "http://test.server/mail/unsubscribe",
+        "status": "pending",
+        "rate": 0,
+        "total": len(EMAILS) + 1,
+        "created_by": "test-acm-member@test.com",
+        "created_at": datetime.now(IST),
+    }
+    data.update(kwargs)
+    with Session(config.db_engine) as db:
+        new = Campaign(**data)
+        db.add(new)
+        db.commit()
+        db.refresh(new)
+        return new
+
+
+def test_campaign_sends_to_whole_list(sink, mailing_list):
+    sender = make_sender(sink)
+    new = new_campaign()
+    campaign.run(config.db_engine, new.id, sender, batch_size=10)
+    sender.stop()
+    assert sorted(rcpt[0] for _, rcpt in sink.handler.mails) == mailing_list
+    # Only the headers are personalized
+    assert "List-Unsubscribe: <http://test.server/mail/unsubscribe?email=campaign00%40test.com>" in sink.handler.contents[0]
+    assert sink.handler.sessions == 1
+    with Session(config.db_engine) as db:
+        done = db.get(Campaign, new.id)
+        assert (done.status, done.sent, done.failed, done.skipped) == ("completed", 25, 0, 1)
+        assert len(db.exec(select(Campaign_Delivery)).all()) == 26
+
+
+def test_campaign_resumes_after_crash(sink, mailing_list):
+    sender = make_sender(sink)
+    # Stopped after the first batch and after sending one mail of the second batch
+    new = new_campaign(status="running", started_at=datetime.now(IST), last_email=mailing_list[9], sent=11)
+    with Session(config.db_engine) as db:
+        for email in mailing_list[:11]:
+            db.add(campaign._delivery(new.id, email, "sent"))
+        db.commit()
+    campaign.run(config.db_engine, new.id, sender, batch_size=10)
+    sender.stop()
+    assert sorted(rcpt[0] for _, rcpt in sink.handler.mails) == mailing_list[11:]
+    with Session(config.db_engine) as db:
+        done = db.get(Campaign, new.id)
+        assert (done.status, done.sent, done.skipped) == ("completed", 25, 1)
+
+
+class FakeSender:
+    """
+    Resolves the mails at once, fails some of them, never finishes others and crashes after crash_after mails
+    """
+
+    user = "acm@test.com"
+
+    def __init__(self, fail=(), hang=(), crash_after=None):
+        self.fail = fail
+        self.hang = hang
+        self.crash_after = crash_after
+        self.submitted = []
+
+    def submit(self, from_addr, to_addr, message, priority=None):
+        if self.crash_after is not None and len(self.submitted) == self.crash_after:
+            raise RuntimeError("Crashed")
+        self.submitted.append(to_addr)
+        future = Future()
+        if to_addr in self.fail:
+            future.set_exception(UnicodeEncodeError("ascii", to_addr, 0, 1, "not ascii"))
+        elif to_addr not in self.hang:
+            future.set_result(to_addr)
+        return future
+
+
+def test_every_delivery_is_committed(mailing_list):
+    new = new_campaign()
+    # Crashed in the middle of the first batch
+    with pytest.raises(RuntimeError):
+        campaign.run(config.db_engine, new.id, FakeSender(crash_after=4), batch_size=10)
+    with Session(config.db_engine) as db:
+        assert db.get(Campaign, new.id).sent == 4
+    sender = FakeSender(fail={mailing_list[5]}, hang={mailing_list[6]})
+    campaign.run(config.db_engine, new.id, sender, batch_size=10, timeout=0.2)
+    assert sender.submitted == mailing_list[4:]
+    with Session(config.db_engine) as db:
+        done = db.get(Campaign, new.id)
+        assert (done.status, done.sent, done.failed, done.skipped) == ("completed", 23, 2, 1)
+        errors = {
+            delivery.email: delivery.error
+            for delivery in db.exec(select(Campaign_Delivery).where(Campaign_Delivery.status == "failed")).all()
+        }
+        assert errors[mailing_list[6]] == "Timed out"
+        assert "not ascii" in errors[mailing_list[5]]
+
+
+def test_campaign_is_run_by_one_worker(mailing_list):
+    # Held by a worker which is still running it
+    new = new_campaign(status="running", runner="other", lease_until=datetime.now(IST) + timedelta(minutes=1))
+    sender = FakeSender()
+    assert campaign.run(config.db_engine, new.id, sender) is False
+    assert sender.submitted == []
+    # That worker was stopped, its lease expires and the campaign is taken over by two workers at once
+    with Session(config.db_engine) as db:
+        db.get(Campaign, new.id).lease_until = datetime.now(IST) - timedelta(seconds=1)
+        db.commit()
+    runs = [threading.Thread(target=campaign.run, args=(config.db_engine, new.id, sender)) for _ in range(2)]
+    for run in runs:
+        run.start()
+    for run in runs:
+        run.join()
+    assert sorted(sender.submitted) == mailing_list
+    with Session(config.db_engine) as db:
+        done = db.get(Campaign, new.id)
+        assert (done.status, done.sent, done.runner, done.lease_until) == ("completed", 25, None, None)
+    # Nothing left to send
+    assert campaign.run(config.db_engine, new.id, sender) is True
+
+
+def test_lost_lease(mailing_list, monkeypatch):
+    new = new_campaign()
+    sender = FakeSender()
+    original = sender.submit
+
+    def submit(from_addr, to_addr, message, priority=None):
+        if len(sender.submitted) == 3:
+            # Stalled past the lease, another worker has the campaign
+            with Session(config.db_engine) as db:
+                db.get(Campaign, new.id).runner = "other"
+                db.commit()
+        return original(from_addr, to_addr, message, priority)
+
+    monkeypatch.setattr(sender, "submit", submit)
+    # Renewed after every mail
+    monkeypatch.setattr(campaign, "LEASE_SECONDS", 0)
+    with pytest.raises(campaign.LeaseLost):
+        campaign.run(config.db_engine, new.id, sender)
+    assert len(sender.submitted) == 4
+    with Session(config.db_engine) as db:
+        # The lease of the other worker is left alone
+        assert db.get(Campaign, new.id).runner == "other"
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_create_campaign(client: httpx.AsyncClient, sink, mailing_list, monkeypatch):
+    sender = make_sender(sink)
+    monkeypatch.setattr(campaign, "get_sender", lambda: sender)
+    res = await client.post("/campaign", json={"subject": "Hi", "body": "<p>Hi</p>"})
+    assert res.status_code == 401
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    res = await client.post(
+        "/campaign", json={"subject": "Hi", "body": "<p>Hi</p>", "rate": 100}, headers=headers
+    )
+    assert res.status_code == 202
+    campaign_id = res.json()["id"]
+    await asyncio.to_thread(campaign.join, UUID(campaign_id), 30)
+    res = await client.get(f"/campaign?id={campaign_id}", headers=headers)
+    report = res.json()
+    assert report["status"] == "completed"
+    assert report["sent"] == len(mailing_list)
+    assert report["throughput"] > 0
+    sender.stop()
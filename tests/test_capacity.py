@@ -0,0 +1,165 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import text
+from sqlmodel import Session, delete, func, select
+from app import oauth2
+from app.config import IST
+from app.db.db import ensure_columns
+from app.db.models import Event_Registeration, Event_Seats, Events, Users
+from . import config
+
+CAPACITY = 25
+USERS = 200
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(app=config.app, base_url="http://test.server") as client:
+        yield client
+
+
+@pytest.fixture()
+def users():
+    now = datetime.now(IST)
+    with Session(config.db_engine) as db:
+        for n in range(USERS):
+            db.add(
+                Users(
+                    reg_no=900700 + n,
+                    name="CapacityUser",
+                    email=f"test-acm-capacity{n}@test.com",
+                    department="CSE",
+                    university="Sathyabama University",
+                    year=2,
+                    joined_at=now,
+                    verified=True,
+                )
+            )
+        db.commit()
+    yield [
+        oauth2.create_access_token({"email": f"test-acm-capacity{n}@test.com", "account_type": "user"})
+        for n in range(USERS)
+    ]
+    with Session(config.db_engine) as db:
+        db.exec(delete(Users).where(Users.email.startswith("test-acm-capacity")))
+        db.commit()
+
+
+@pytest_asyncio.fixture()
+async def workshop(client: httpx.AsyncClient) -> AsyncIterable[str]:
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    now = datetime.now(IST)
+    data = {
+        "name": "test-capacity-workshop",
+        "description": "Test Event",
+        "start": (now + timedelta(days=1)).isoformat(),
+        "end": (now + timedelta(days=1, hours=2)).isoformat(),
+        "rules": "None",
+        "venue": "Lab",
+        "fee": 0,
+        "image_url": "",
+        "capacity": CAPACITY,
+    }
+    res = await client.post("/events/", json=data, headers=headers)
+    assert res.status_code == 200
+    assert res.json()["capacity"] == CAPACITY
+    event_id = res.json()["id"]
+    yield event_id
+    with Session(config.db_engine) as db:
+        db.exec(delete(Event_Registeration).where(Event_Registeration.event_id == event_id))
+        db.exec(delete(Event_Seats).where(Event_Seats.event_id == event_id))
+        db.exec(delete(Events).where(Events.name == "test-capacity-workshop"))
+        db.commit()
+
+
+@pytest_asyncio.fixture()
+async def burst() -> AsyncIterable[None]:
+    yield
+    # The async pools waited for connections on the event loop of this test, the next tests run on other loops
+    for engine in (config.async_db_engine, config.async_read_db_engine):
+        if engine is not None:
+            await engine.dispose()
+
+
+def seats_taken(event_id: str) -> tuple[int, int]:
+    with Session(config.db_engine) as db:
+        registrations = db.exec(
+            select(func.count()).select_from(Event_Registeration).where(Event_Registeration.event_id == event_id)
+        ).one()
+        return db.get(Event_Seats, event_id).taken, registrations
+
+
+@pytest.mark.asyncio
+async def test_no_oversell(client: httpx.AsyncClient, users, workshop, burst):
+    async def register(token: str) -> int:
+        res = await client.post(
+            "/events/register", json={"event_id": workshop}, headers={"Authorization": f"Bearer {token}"}
+        )
+        return res.status_code
+
+    statuses = await asyncio.gather(*(register(token) for token in users))
+    assert statuses.count(200) == CAPACITY
+    assert statuses.count(409) == USERS - CAPACITY
+    assert seats_taken(workshop) == (CAPACITY, CAPACITY)
+
+
+@pytest.mark.asyncio
+async def test_failed_registration_gives_seat_back(client: httpx.AsyncClient, users, workshop):
+    headers = {"Authorization": f"Bearer {users[0]}"}
+    assert (await client.post("/events/register", json={"event_id": workshop}, headers=headers)).status_code == 200
+    # Already registered, the seat taken by the second attempt is rolled back
+    assert (await client.post("/events/register", json={"event_id": workshop}, headers=headers)).status_code == 400
+    assert seats_taken(workshop) == (1, 1)
+
+    # A new capacity takes effect right away
+    member = {"Authorization": f"Bearer {config.member_token()}"}
+    res = await client.patch("/events/", json={"id": workshop, "new_capacity": 1}, headers=member)
+    assert res.json()["capacity"] == 1
+    res = await client.post("/events/register", json={"event_id": workshop}, headers={"Authorization": f"Bearer {users[1]}"})
+    assert res.status_code == 409
+    await client.patch("/events/", json={"id": workshop, "new_capacity": 2}, headers=member)
+    res = await client.post("/events/register", json={"event_id": workshop}, headers={"Authorization": f"Bearer {users[1]}"})
+    assert res.status_code == 200
+    # Full, but the user is told they are already registered
+    res = await client.post("/events/register", json={"event_id": workshop}, headers=headers)
+    assert res.status_code == 400
+    assert res.json()["detail"] == "You have already registed for this event"
+
+
+@pytest.mark.asyncio
+async def test_change_capacity(client: httpx.AsyncClient, users, workshop):
+    member = {"Authorization": f"Bearer {config.member_token()}"}
+    for token in users[:3]:
+        res = await client.post("/events/register", json={"event_id": workshop}, headers={"Authorization": f"Bearer {token}"})
+        assert res.status_code == 200
+    # Less than the seats already taken
+    res = await client.patch("/events/", json={"id": workshop, "new_capacity": 2}, headers=member)
+    assert res.status_code == 409
+    res = await client.patch("/events/", json={"id": workshop, "new_capacity": 3}, headers=member)
+    assert res.json()["capacity"] == 3
+    res = await client.patch("/events/", json={"id": workshop, "new_capacity": 4, "remove_capacity": True}, headers=member)
+    assert res.status_code == 400
+
+    res = await client.patch("/events/", json={"id": workshop, "remove_capacity": True}, headers=member)
+    assert res.status_code == 200
+    assert res.json()["capacity"] is None
+    with Session(config.db_engine) as db:
+        assert db.get(Event_Seats, workshop) is None
+    res = await client.post("/events/register", json={"event_id": workshop}, headers={"Authorization": f"Bearer {users[3]}"})
+    assert res.status_code == 200
+    # A new limit counts the registrations made without one
+    res = await client.patch("/events/", json={"id": workshop, "new_capacity": 4}, headers=member)
+    assert res.status_code == 200
+    assert seats_taken(workshop) == (4, 4)
+
+
+def test_missing_columns_are_added():
+    with config.db_engine.begin() as conn:
+        conn.execute(text("ALTER TABLE events DROP COLUMN capacity"))
+    ensure_columns(config.db_engine)
+    with config.db_engine.connect() as conn:
+        assert "capacity" in [row[1] for row in conn.execute(text("PRAGMA table_info(events)")).all()]
@@ -0,0 +1,58 @@
+import pytest
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from app.db import engine
+from app.db.db import EngineRouter
+from . import config
+
+
+def test_sqlite_pragmas():
+    with config.db_engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == engine.PRAGMAS["busy_timeout"]
+        assert conn.execute(text("PRAGMA temp_store")).scalar() == 2  # MEMORY
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == engine.PRAGMAS["cache_size"]
+    engine.optimize(config.db_engine)
+
+
+def test_engine_options():
+    server = engine.engine_options("postgresql://acm@localhost/acm")
+    assert server["pool_pre_ping"] and server["pool_recycle"] > 0
+    assert server["pool_size"] == engine.POOL_SIZE
+    sqlite = engine.engine_options("sqlite:///acm.db")
+    assert not sqlite["pool_pre_ping"] and sqlite["pool_recycle"] == -1
+    # The in memory database of SQLite isn't pooled
+    assert engine.engine_options("sqlite://") == {}
+    memory = engine.create_db_engine("sqlite://")
+    with memory.connect() as conn:
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+
+
+def test_reader_is_read_only():
+    with config.read_db_engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("CREATE TABLE read_only_test (id INTEGER)"))
+
+
+def request(method: str, token: str | None = None) -> Request:
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    return Request({"type": "http", "method": method, "headers": headers, "client": ("127.0.0.1", 1234)})
+
+
+def test_routing():
+    writer, reader = (config.db_engine, None), (config.read_db_engine, None)
+    router = EngineRouter(writer, reader, stick_for=60)
+    assert router.route(request("GET", "a")) is reader
+    assert router.route(request("POST", "a")) is writer
+    # Read your writes, only for the client who wrote
+    assert router.route(request("GET", "a")) is writer
+    assert router.route(request("GET", "b")) is reader
+    assert router.route(request("GET")) is reader
+    assert router.route(request("GET", "b"), write=True) is writer
+    assert router.metrics() == {"replica": True, "reads": 3, "writes": 2, "sticky_reads": 1}
+    router.stick_for = 0
+    assert router.route(request("GET", "a")) is reader
+    # Without a reader everything goes to the writer
+    assert EngineRouter(writer).route(request("GET")) is writer
@@ -0,0 +1,68 @@
+import time
+import asyncio
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlmodel import Session
+from app.db.models import Auth
+from app.utils import security
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server"
+    ) as client:
+        yield client
+
+
+@pytest.fixture()
+def envelope(monkeypatch) -> float:
+    monkeypatch.setattr(security, "EQUAL_TIMING_SECONDS", 1.0)
+    monkeypatch.setattr(security, "EQUAL_TIMING_JITTER", 0.0)
+    return 1.0
+
+
+async def timed(request) -> tuple[httpx.Response, float]:
+    start = time.monotonic()
+    res = await request
+    return res, time.monotonic() - start
+
+
+@pytest.mark.asyncio
+async def test_found_and_not_found_take_same_time(client: httpx.AsyncClient, envelope: float):
+    email = "test-acm-sist-timing@test.com"
+    with Session(config.db_engine) as db:
+        if not db.get(Auth, (email, "user")):
+            db.add(Auth(email=email, password="", account_type="user"))
+            db.commit()
+    found, found_time = await timed(client.post("/users/forgot_password", json={"email": email}))
+    not_found, not_found_time = await timed(
+        client.post("/users/forgot_password", json={"email": "nobody@test.com"})
+    )
+    assert found.status_code == not_found.status_code == 200
+    assert envelope <= found_time < envelope + 0.5
+    assert envelope <= not_found_time < envelope + 0.5
+
+
+@pytest.mark.asyncio
+async def test_fake_requests_do_not_block_other_endpoints(client: httpx.AsyncClient, envelope: float):
+    # More requests than the threads in the default threadpool (40)
+    fakes = asyncio.gather(
+        *(
+            timed(client.post("/users/forgot_password", json={"email": f"nobody{n}@test.com"}))
+            for n in range(60)
+        )
+    )
+    await asyncio.sleep(0.2)
+    start = time.monotonic()
+    others = await asyncio.gather(*(client.get("/achievements/") for _ in range(20)))
+    others_time = time.monotonic() - start
+    assert all(res.status_code == 200 for res in others)
+    # The achievements don't wait for the padded requests to finish
+    assert others_time < envelope / 2
+    for res, took in await fakes:
+        assert res.status_code == 200
+        assert took >= envelope
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import event
+from sqlmodel import Session, delete
+from app import oauth2
+from app.config import IST
+from app.db.models import Event_Registeration, Events
+from . import config
+
+USER_REG_NO = 900101
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server/events"
+    ) as client:
+        yield client
+
+
+@pytest.fixture()
+def registrations(monkeypatch):
+    """
+    12 events (half of them in the past) the test user registered for, odd ones are still pending
+    """
+    monkeypatch.setattr(oauth2.principal_cache, "enabled", False)
+    now = datetime.now(IST)
+    events = [
+        Events(
+            name=f"test-event-{n}",
+            description="Test Event",
+            start=now + timedelta(days=n - 6, hours=12),
+            end=now + timedelta(days=n - 6, hours=14),
+            rules="None",
+            venue="Online",
+            fee=0,
+            image_url="",
+        )
+        for n in range(12)
+    ]
+    with Session(config.db_engine) as db:
+        db.add_all(events)
+        db.commit()
+        for n, new_event in enumerate(events):
+            db.add(
+                Event_Registeration(
+                    user_reg_no=USER_REG_NO,
+                    event_id=new_event.id,
+                    transaction_id=None,
+                    screenshot_id=None,
+                    status="pending" if n % 2 else "verified",
+                )
+            )
+        db.commit()
+        ids = [new_event.id for new_event in events]
+    yield ids
+    with Session(config.db_engine) as db:
+        db.exec(delete(Event_Registeration).where(Event_Registeration.event_id.in_(ids)))
+        db.exec(delete(Events).where(Events.id.in_(ids)))
+        db.commit()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in config.app_engines:
+            event.listen(engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *args):
+        for engine in config.app_engines:
+            event.remove(engine, "before_cursor_execute", self)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_my_events_pages(client: httpx.AsyncClient, registrations):
+    headers = {"Authorization": f"Bearer {config.user_token()}"}
+    seen = []
+    url = "/me?limit=5"
+    while url:
+        res = await client.get(url, headers=headers)
+        assert res.status_code == 200
+        seen += [(reg["event"]["start"], reg["event_id"]) for reg in res.json()]
+        assert all(reg["event_id"] == reg["event"]["id"] for reg in res.json())
+        cursor = res.headers.get("x-next-cursor")
+        url = f"/me?limit=5&cursor={cursor}" if cursor else None
+    assert len(seen) == 12
+    assert {event_id for _, event_id in seen} == {str(_id) for _id in registrations}
+    # Latest event first
+    assert seen == sorted(seen, reverse=True)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_my_events_filters(client: httpx.AsyncClient, registrations):
+    headers = {"Authorization": f"Bearer {config.user_token()}"}
+    res = await client.get("/me?status=pending", headers=headers)
+    assert len(res.json()) == 6
+    assert {reg["status"] for reg in res.json()} == {"pending"}
+    res = await client.get("/me?upcoming=true&status=verified", headers=headers)
+    assert len(res.json()) == 3
+    res = await client.get("/me?past=true", headers=headers)
+    assert len(res.json()) == 6
+    res = await client.get("/me?past=true&upcoming=true", headers=headers)
+    assert res.status_code == 400
+    res = await client.get("/me?cursor=not-a-cursor", headers=headers)
+    assert res.status_code == 400
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_my_events_query_count(client: httpx.AsyncClient, registrations):
+    headers = {"Authorization": f"Bearer {config.user_token()}"}
+    with QueryCounter() as few:
+        res = await client.get("/me?limit=2", headers=headers)
+        assert len(res.json()) == 2
+    with QueryCounter() as many:
+        res = await client.get("/me?limit=12", headers=headers)
+        assert len(res.json()) == 12
+    # Current user + registrations joined with the events, whatever the number of registrations is
+    assert few.count == many.count == 2
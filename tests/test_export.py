@@ -0,0 +1,108 @@
+import csv
+import json
+import hashlib
+import zipfile
+from io import BytesIO, StringIO
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlmodel import Session, delete
+from app import schema
+from app.db.models import Mailing_List, Members
+from app.routers import export
+from . import config
+
+EMAILS = [f"export{n:04}@test.com" for n in range(250)]
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server/export"
+    ) as client:
+        yield client
+
+
+@pytest.fixture()
+def mailing_list(monkeypatch):
+    monkeypatch.setattr(export, "BATCH_SIZE", 100)
+    with Session(config.db_engine) as db:
+        db.add_all(Mailing_List(email=email) for email in EMAILS)
+        db.commit()
+    yield EMAILS
+    with Session(config.db_engine) as db:
+        db.exec(delete(Mailing_List).where(Mailing_List.email.like("export%")))
+        db.commit()
+
+
+def test_csv_is_written_in_batches(mailing_list):
+    chunks = list(export.table_chunks(config.db_engine, Mailing_List, ["email"]))
+    # One chunk per batch of rows, whatever else is in the table
+    sizes = [len(chunk.splitlines()) for chunk in chunks]
+    sizes[0] -= 1  # The header
+    assert all(size == export.BATCH_SIZE for size in sizes[:-1])
+    assert 0 < sizes[-1] <= export.BATCH_SIZE
+    assert len(chunks) >= 3
+    rows = list(csv.reader(StringIO(b"".join(chunks).decode())))
+    assert rows[0] == ["email"]
+    assert [row[0] for row in rows[1:] if row[0].startswith("export")] == mailing_list
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_export(client: httpx.AsyncClient, mailing_list):
+    headers = {"Authorization": f"Bearer {config.member_token()}", "Accept-Encoding": "identity"}
+    res = await client.get("/?table=mailing_list", headers=headers)
+    assert res.status_code == 200
+    assert "content-encoding" not in res.headers
+    assert res.text.splitlines()[0] == "email"
+    assert set(mailing_list) <= set(res.text.splitlines()[1:])
+
+    headers["Accept-Encoding"] = "gzip"
+    res = await client.get("/?table=members&columns=reg_no&columns=email", headers=headers)
+    assert res.headers["content-encoding"] == "gzip"
+    # httpx decompresses the body
+    rows = list(csv.reader(StringIO(res.text)))
+    assert rows[0] == ["reg_no", "email"]
+    with Session(config.db_engine) as db:
+        assert len(rows) == len(db.exec(Members.__table__.select()).all()) + 1
+
+    res = await client.get("/?table=members&columns=password", headers=headers)
+    assert res.status_code == 400
+
+
+def read_snapshot(content: bytes) -> tuple[dict, dict[str, bytes]]:
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        files = {name: archive.read(name) for name in archive.namelist()}
+    return json.loads(files.pop("manifest.json")), files
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_snapshot(client: httpx.AsyncClient, mailing_list):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    res = await client.get("/snapshot", headers=headers)
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/zip"
+    manifest, files = read_snapshot(res.content)
+    assert set(files) == {f"{table.value}.csv" for table in schema.Tables}
+    for name, table in manifest["tables"].items():
+        content = files[table["file"]]
+        assert hashlib.sha256(content).hexdigest() == table["sha256"]
+        assert len(list(csv.reader(StringIO(content.decode())))) == table["rows"] + 1
+    assert manifest["tables"]["mailing_list"]["rows"] >= len(mailing_list)
+
+    # Nothing changed so only the manifest is sent
+    res = await client.post("/snapshot", json=manifest, headers=headers)
+    unchanged, files = read_snapshot(res.content)
+    assert files == {}
+    assert all(table["unchanged"] for table in unchanged["tables"].values())
+
+    with Session(config.db_engine) as db:
+        db.add(Mailing_List(email="export-new@test.com"))
+        db.commit()
+    res = await client.post("/snapshot", json=unchanged, headers=headers)
+    changed, files = read_snapshot(res.content)
+    assert set(files) == {"mailing_list.csv"}
+    assert changed["tables"]["mailing_list"]["rows"] == manifest["tables"]["mailing_list"]["rows"] + 1
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import event
+from sqlmodel import Session, delete, select
+from app.config import IST
+from app.db.models import Blogs, Events, Table_Versions
+from app.utils import http_cache
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server"
+    ) as client:
+        yield client
+
+
+@pytest.fixture()
+def cleanup():
+    yield
+    with Session(config.db_engine) as db:
+        db.exec(delete(Blogs).where(Blogs.author == "test-http-cache"))
+        db.exec(delete(Events).where(Events.name == "HTTP Cache Event"))
+        db.commit()
+
+
+def blog(title: str) -> dict:
+    return {
+        "title": title,
+        "description": "Test Blog",
+        "date": "2024-01-01",
+        "author": "test-http-cache",
+        "image_url": "",
+    }
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_etag(client: httpx.AsyncClient, cleanup):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    assert (await client.post("/blogs/", json=blog("First"), headers=headers)).status_code == 201
+    res = await client.get("/blogs/search?author=test-http-cache")
+    assert res.status_code == 200
+    assert res.headers["cache-control"] == http_cache.CACHE_CONTROL
+    etag = res.headers["etag"]
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    for engine in config.app_engines:
+        event.listen(engine, "before_cursor_execute", listener)
+    try:
+        res = await client.get("/blogs/search?author=test-http-cache", headers={"If-None-Match": etag})
+    finally:
+        for engine in config.app_engines:
+            event.remove(engine, "before_cursor_execute", listener)
+    assert res.status_code == 304
+    assert res.content == b""
+    assert res.headers["etag"] == etag
+    # Only the versions are read
+    assert len(statements) == 1
+
+    res = await client.get("/blogs/search?author=test-http-cache&limit=1", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert (await client.post("/blogs/", json=blog("Second"), headers=headers)).status_code == 201
+    res = await client.get("/blogs/search?author=test-http-cache", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["etag"] != etag
+    assert len(res.json()) == 2
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_last_modified(client: httpx.AsyncClient, cleanup):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    await client.post("/blogs/", json=blog("First"), headers=headers)
+    last_modified = (await client.get("/blogs/search")).headers["last-modified"]
+    res = await client.get("/blogs/search", headers={"If-Modified-Since": last_modified})
+    assert res.status_code == 304
+    res = await client.get("/blogs/search", headers={"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"})
+    assert res.status_code == 200
+    # If-None-Match wins over If-Modified-Since
+    res = await client.get("/blogs/search", headers={"If-Modified-Since": last_modified, "If-None-Match": '"old"'})
+    assert res.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_upcoming_events_change_with_time(client: httpx.AsyncClient, cleanup):
+    etag = (await client.get("/events/search?upcoming=true")).headers["etag"]
+    assert (await client.get("/events/search?upcoming=true", headers={"If-None-Match": etag})).status_code == 304
+    now = datetime.now(IST)
+    with Session(config.db_engine) as db:
+        # An event which has just started, without any change through the API
+        db.add(
+            Events(
+                name="HTTP Cache Event",
+                description="Test Event",
+                start=now - timedelta(seconds=1),
+                end=now + timedelta(hours=1),
+                rules="None",
+                venue="Test Venue",
+                fee=0,
+                image_url="",
+            )
+        )
+        db.commit()
+    assert (await client.get("/events/search?upcoming=true", headers={"If-None-Match": etag})).status_code == 200
+
+
+def test_bump_upserts():
+    tables = ("test-bump-a", "test-bump-b")
+    try:
+        with Session(config.db_engine) as db:
+            http_cache.bump(db, *tables)
+            db.commit()
+            http_cache.bump(db, tables[0])
+            http_cache.bump(db, tables[0])
+            db.commit()
+            versions = {row.name: row.version for row in db.exec(select(Table_Versions).where(Table_Versions.name.in_(tables)))}
+        assert versions == {"test-bump-a": 3, "test-bump-b": 1}
+    finally:
+        with Session(config.db_engine) as db:
+            db.exec(delete(Table_Versions).where(Table_Versions.name.in_(tables)))
+            db.commit()
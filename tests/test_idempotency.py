@@ -0,0 +1,159 @@
+import asyncio
+from datetime import datetime, timedelta
+from secrets import token_bytes, token_urlsafe
+from typing import AsyncIterable
+from uuid import uuid4
+import pytest
+import pytest_asyncio
+import httpx
+from sqlmodel import Session, delete, func, select
+from app import oauth2
+from app.config import IST
+from app.db.models import Event_Registeration, Events, Idempotency_Keys, Payment_Proofs
+from app.utils import idempotency
+from app.utils.idempotency import HEADER, REPLAYED_HEADER, idempotency_keys
+from . import config
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(app=config.app, base_url="http://test.server") as client:
+        yield client
+
+
+@pytest.fixture()
+def free_event(monkeypatch):
+    monkeypatch.setattr(oauth2.principal_cache, "enabled", False)
+    now = datetime.now(IST)
+    new_event = Events(
+        name="Idempotency Event",
+        description="Test Event",
+        start=now + timedelta(days=1),
+        end=now + timedelta(days=1, hours=2),
+        rules="None",
+        venue="Online",
+        fee=0,
+        image_url="",
+    )
+    with Session(config.db_engine) as db:
+        db.add(new_event)
+        db.commit()
+        event_id = new_event.id
+    yield event_id
+    with Session(config.db_engine) as db:
+        db.exec(delete(Event_Registeration).where(Event_Registeration.event_id == event_id))
+        db.exec(delete(Events).where(Events.id == event_id))
+        db.commit()
+
+
+def registrations(event_id) -> int:
+    with Session(config.db_engine) as db:
+        return db.exec(
+            select(func.count()).select_from(Event_Registeration).where(Event_Registeration.event_id == event_id)
+        ).one()
+
+
+@pytest.mark.asyncio
+async def test_replay(client: httpx.AsyncClient, free_event):
+    headers = {"Authorization": f"Bearer {config.user_token()}", HEADER: str(uuid4())}
+    first = await client.post("/events/register", json={"event_id": str(free_event)}, headers=headers)
+    assert first.status_code == 200
+    assert REPLAYED_HEADER not in first.headers
+    # Without the key, registering again would be a 400
+    again = await client.post("/events/register", json={"event_id": str(free_event)}, headers=headers)
+    assert again.status_code == 200
+    assert again.headers[REPLAYED_HEADER] == "true"
+    assert again.json() == first.json()
+    assert registrations(free_event) == 1
+
+    # Same key with another body
+    res = await client.post("/events/register", json={"event_id": str(uuid4())}, headers=headers)
+    assert res.status_code == 422
+    # Same key from another client is another request
+    other = {"Authorization": f"Bearer {config.user_token(900102, 'test-acm-user2@test.com')}", HEADER: headers[HEADER]}
+    res = await client.post("/events/register", json={"event_id": str(free_event)}, headers=other)
+    assert res.status_code == 200 and REPLAYED_HEADER not in res.headers
+    assert registrations(free_event) == 2
+
+    res = await client.post("/events/register", json={"event_id": str(free_event)}, headers={HEADER: "x" * 256})
+    assert res.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_cors(client: httpx.AsyncClient, free_event):
+    origin = {"Origin": "https://acm.test"}
+    # Browsers ask before sending the header
+    res = await client.options(
+        "/events/register",
+        headers={**origin, "Access-Control-Request-Method": "POST", "Access-Control-Request-Headers": "authorization, content-type, idempotency-key"},
+    )
+    assert res.status_code == 200
+    headers = {**origin, "Authorization": f"Bearer {config.user_token()}", HEADER: str(uuid4())}
+    for _ in range(2):
+        res = await client.post("/events/register", json={"event_id": str(free_event)}, headers=headers)
+        assert res.status_code == 200
+        assert res.headers["access-control-allow-origin"] == "*"
+    # The replay can be told apart by the script
+    assert REPLAYED_HEADER.lower() in res.headers["access-control-expose-headers"].lower()
+    res = await client.post("/events/register", json={"event_id": str(uuid4())}, headers=headers)
+    assert res.status_code == 422
+    assert res.headers["access-control-allow-origin"] == "*"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads(client: httpx.AsyncClient):
+    content = PNG + token_bytes(16)
+    headers = {HEADER: token_urlsafe(16)}
+    with config.removing_payment_proofs():
+        with Session(config.db_engine) as db:
+            before = db.exec(select(func.count()).select_from(Payment_Proofs)).one()
+        # httpx makes a new multipart boundary for every request, like a browser retrying
+        responses = await asyncio.gather(
+            *(client.post("/payment_proof/", files={"image_file": ("proof.png", content)}, headers=headers) for _ in range(5))
+        )
+        assert {res.status_code for res in responses} == {200}
+        assert len({res.json()["screenshot_id"] for res in responses}) == 1
+        # Only one of them was uploaded, the others waited for it
+        assert [REPLAYED_HEADER in res.headers for res in responses].count(False) == 1
+        assert {res.json()["duplicate"] for res in responses} == {False}
+        with Session(config.db_engine) as db:
+            assert db.exec(select(func.count()).select_from(Payment_Proofs)).one() == before + 1
+
+        res = await client.post("/payment_proof/", files={"image_file": ("proof.png", PNG)}, headers=headers)
+        assert res.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_in_flight(client: httpx.AsyncClient, free_event, monkeypatch):
+    headers = {"Authorization": f"Bearer {config.user_token()}", HEADER: str(uuid4())}
+    key = idempotency.IdempotencyMiddleware._key(
+        {"method": "POST", "path": "/events/register"}, httpx.Headers(headers), headers[HEADER]
+    )
+    # A request which is still running on another worker
+    assert idempotency_keys.claim(key) == (True, None)
+    try:
+        monkeypatch.setattr(idempotency, "WAIT_SECONDS", 0.3)
+        monkeypatch.setattr(idempotency, "POLL_SECONDS", 0.05)
+        res = await client.post("/events/register", json={"event_id": str(free_event)}, headers=headers)
+        assert res.status_code == 409
+        assert res.headers["Retry-After"] == "1"
+    finally:
+        idempotency_keys.release(key)
+
+
+@pytest.mark.asyncio
+async def test_expiry(client: httpx.AsyncClient, free_event, monkeypatch):
+    monkeypatch.setattr(idempotency_keys, "ttl", 0)
+    headers = {"Authorization": f"Bearer {config.user_token()}", HEADER: str(uuid4())}
+    res = await client.post("/events/register", json={"event_id": str(free_event)}, headers=headers)
+    assert res.status_code == 200
+    # The key has expired, the request runs again
+    res = await client.post("/events/register", json={"event_id": str(free_event)}, headers=headers)
+    assert res.status_code == 400
+    assert REPLAYED_HEADER not in res.headers
+
+    assert idempotency_keys.purge() >= 1
+    with Session(config.db_engine) as db:
+        assert not db.exec(select(Idempotency_Keys).where(Idempotency_Keys.expires_at <= datetime.now(IST))).all()
@@ -0,0 +1,126 @@
+import io
+import os
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from PIL import Image
+from app import schema
+from app.utils import images
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(app=config.app, base_url="http://test.server") as client:
+        yield client
+
+
+@pytest.fixture()
+def uploaded():
+    before = set(images.ROOT.glob("*/*"))
+    yield
+    for directory in set(images.ROOT.glob("*/*")) - before:
+        shutil.rmtree(directory)
+
+
+def png(width: int, height: int, color: tuple) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (width, height), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def local(url: str) -> Path:
+    return images.ROOT / url.removeprefix(f"{images.URL_PREFIX}/")
+
+
+@pytest.mark.asyncio
+async def test_variants(client: httpx.AsyncClient, uploaded):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    content = png(2000, 1000, (200, 10, 10, 128))
+    res = await client.post("/images/?kind=events", files={"image_file": ("poster.png", content)}, headers=headers)
+    assert res.status_code == 201
+    url, variants = res.json()["url"], res.json()["variants"]
+    assert url.endswith("/original-2000.png")
+    assert local(url).read_bytes() == content
+    for name, width in images.VARIANTS.items():
+        for extension in images.FORMATS:
+            with Image.open(local(variants[name]).with_suffix(f".{extension}")) as variant:
+                assert variant.size == (width, width // 2)
+    assert variants["srcset"].endswith("/full.webp 1280w")
+
+    # Made once
+    modified = local(variants["card"]).stat().st_mtime_ns
+    res = await client.post("/images/?kind=events", files={"image_file": ("again.png", content)}, headers=headers)
+    assert res.json()["url"] == url
+    assert local(variants["card"]).stat().st_mtime_ns == modified
+
+    res = await client.get(variants["thumbnail"])
+    assert res.status_code == 200
+    assert res.headers["cache-control"] == images.CACHE_CONTROL
+
+
+@pytest.mark.asyncio
+async def test_small_image(client: httpx.AsyncClient, uploaded):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    res = await client.post(
+        "/images/?kind=members", files={"image_file": ("avatar.png", png(300, 300, (0, 0, 255, 255)))}, headers=headers
+    )
+    variants = res.json()["variants"]
+    # Never upscaled, the sizes which would be wider than the original are listed once
+    assert variants["srcset"].count("300w") == 1
+    with Image.open(local(variants["full"])) as full:
+        assert full.size == (300, 300)
+
+
+@pytest.mark.asyncio
+async def test_not_an_image(client: httpx.AsyncClient, uploaded):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    res = await client.post("/images/?kind=events", files={"image_file": ("poster.png", b"Not an image")}, headers=headers)
+    assert res.status_code == 400
+    res = await client.post("/images/?kind=events", files={"image_file": ("poster.png", png(10, 10, (0, 0, 0, 0)))})
+    assert res.status_code == 401
+
+
+def test_same_image_at_once(tmp_path):
+    content = png(600, 400, (0, 128, 0, 255))
+    partials = [tmp_path / f"upload{n}.part" for n in range(4)]
+    for partial in partials:
+        partial.write_bytes(content)
+    with ThreadPoolExecutor(len(partials)) as pool:
+        names = list(pool.map(lambda partial: images.make_variants(partial, tmp_path / "image", ".png"), partials))
+    assert set(names) == {"original-600.png"}
+    assert not list((tmp_path / "image").glob(".*"))
+    with Image.open(tmp_path / "image" / "card.webp") as card:
+        assert card.size == (480, 320)
+
+
+@pytest.mark.asyncio
+async def test_broken_pool(client: httpx.AsyncClient, uploaded, monkeypatch):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    # A worker which died, like killed for running out of memory
+    broken = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+    monkeypatch.setattr(images, "_pool", broken)
+    files = {"image_file": ("poster.png", png(10, 10, (0, 0, 0, 255)))}
+    res = await client.post("/images/?kind=events", files=files, headers=headers)
+    assert res.status_code == 503
+    assert images._pool is None
+    # The next upload gets a new pool
+    res = await client.post("/images/?kind=events", files=files, headers=headers)
+    assert res.status_code == 201
+    images.shutdown()
+
+
+def test_response_fields():
+    url = f"{images.URL_PREFIX}/events/{'a' * 64}/original-800.jpg"
+    variants = schema.variants_of(url)
+    assert variants.thumbnail.endswith("/thumbnail.jpg")
+    assert variants.jpeg_srcset.split(", ")[-1].endswith("/full.jpg 800w")
+    assert schema.variants_of("https://example.com/poster.png") is None
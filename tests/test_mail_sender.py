@@ -0,0 +1,108 @@
+import time
+import smtplib
+import pytest
+from app.utils.mail import BULK, MailTemplate
+from .smtp import make_sender, sink  # noqa: F401
+
+MESSAGE = "Subject: Test\r\n\r\nHello from the tests"
+
+
+def test_send_reuses_connection(sink):
+    handler = sink.handler
+    sender = make_sender(sink)
+    futures = [
+        sender.submit("acm@test.com", f"user{n}@test.com", MESSAGE) for n in range(10)
+    ]
+    assert [f.result(timeout=5) for f in futures] == [
+        f"user{n}@test.com" for n in range(10)
+    ]
+    sender.stop()
+    assert len(handler.mails) == 10
+    assert handler.sessions == 1
+    assert sender.stats["connects"] == 1
+
+
+def test_submit_does_not_block(sink):
+    sender = make_sender(sink, rate_limit=2)
+    start = time.monotonic()
+    futures = [
+        sender.submit("acm@test.com", f"user{n}@test.com", MESSAGE) for n in range(3)
+    ]
+    assert time.monotonic() - start < 0.1
+    for future in futures:
+        future.result(timeout=5)
+    # 3 mails at 2 mails per second on a single connection
+    assert time.monotonic() - start >= 1
+    sender.stop()
+
+
+def test_transactional_mails_go_first(sink):
+    sender = make_sender(sink, rate_limit=10)
+    bulk = [sender.submit("acm@test.com", f"bulk{n}@test.com", MESSAGE, BULK) for n in range(5)]
+    sender.submit("acm@test.com", "reset@test.com", MESSAGE).result(timeout=5)
+    for future in bulk:
+        future.result(timeout=5)
+    sender.stop()
+    recipients = [rcpt[0] for _, rcpt in sink.handler.mails]
+    # Only the bulk mail which was already being sent goes before it
+    assert recipients.index("reset@test.com") <= 1
+    assert [rcpt for rcpt in recipients if rcpt.startswith("bulk")] == [f"bulk{n}@test.com" for n in range(5)]
+
+
+def test_reconnects_after_disconnect(sink):
+    handler = sink.handler
+    sender = make_sender(sink)
+    sender.submit("acm@test.com", "first@test.com", MESSAGE).result(timeout=5)
+    # Restarting the server drops the pooled connection behind the sender's back
+    sink.stop()
+    sink.start()
+    sender.submit("acm@test.com", "second@test.com", MESSAGE).result(timeout=5)
+    sender.stop()
+    assert [rcpt for _, rcpt in handler.mails] == [["first@test.com"], ["second@test.com"]]
+    assert sender.stats["connects"] == 2
+
+
+def test_permanent_failure_is_not_retried(sink):
+    sink.handler.reject.add("nobody@test.com")
+    sender = make_sender(sink)
+    future = sender.submit("acm@test.com", "nobody@test.com", MESSAGE)
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        future.result(timeout=5)
+    sender.submit("acm@test.com", "somebody@test.com", MESSAGE).result(timeout=5)
+    sender.stop()
+    assert sender.stats == {"sent": 1, "failed": 1, "retries": 0, "connects": 1}
+
+
+def test_internationalized_address(sink):
+    sender = make_sender(sink)
+    # Sent with SMTPUTF8 instead of failing to encode the To line as ASCII
+    assert sender.submit("acm@test.com", "ünïcode@test.com", "Subject: Tést\r\n\r\nHéllo").result(timeout=5)
+    sender.stop(timeout=5)
+    assert sink.handler.mails == [("acm@test.com", ["ünïcode@test.com"])]
+
+
+def test_lines_end_with_crlf(sink):
+    sender = make_sender(sink)
+    template = MailTemplate("Test", "<p>Hello\nfrom the tests</p>", "acm@test.com")
+    sender.submit("acm@test.com", "first@test.com", template.render("first@test.com", {"List-Unsubscribe": "x"})).result(timeout=5)
+    sender.submit("acm@test.com", "second@test.com", "Subject: Test\n\nHello\nfrom the tests").result(timeout=5)
+    sender.stop(timeout=5)
+    for raw in sink.handler.raw:
+        assert b"\r\n" in raw
+        # No bare line feeds, which hardened servers reject
+        assert b"\n" not in raw.replace(b"\r\n", b"")
+
+
+def test_unexpected_error_does_not_stop_the_worker(sink, monkeypatch):
+    sender = make_sender(sink)
+    connect = sender._connect
+    monkeypatch.setattr(sender, "_connect", lambda: (_ for _ in ()).throw(ValueError("broken")))
+    future = sender.submit("acm@test.com", "first@test.com", MESSAGE)
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+    monkeypatch.setattr(sender, "_connect", connect)
+    assert sender.submit("acm@test.com", "second@test.com", MESSAGE).result(timeout=5) == "second@test.com"
+    # Every job was marked done, so nothing waits forever
+    sender.join()
+    sender.stop(timeout=5)
+    assert (sender.stats["failed"], sender.stats["sent"]) == (1, 1)
@@ -0,0 +1,80 @@
+import time
+from datetime import timedelta
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlmodel import Session
+from app import oauth2
+from app.db.models import Members
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server/members"
+    ) as client:
+        yield client
+
+
+@pytest.fixture()
+def cache(monkeypatch) -> oauth2.PrincipalCache:
+    cache = oauth2.PrincipalCache(size=2, ttl=300)
+    monkeypatch.setattr(oauth2, "principal_cache", cache)
+    return cache
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_cached_principal(client: httpx.AsyncClient, cache: oauth2.PrincipalCache):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    for _ in range(3):
+        res = await client.get("/me", headers=headers)
+        assert res.status_code == 200
+    assert (cache.misses, cache.hits) == (1, 2)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_update_invalidates_principal(client: httpx.AsyncClient, cache: oauth2.PrincipalCache):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    assert (await client.get("/me", headers=headers)).json()["name"] == "TestMember"
+    res = await client.patch("/", json={"new_name": "RenamedMember"}, headers=headers)
+    assert res.status_code == 200
+    assert (await client.get("/me", headers=headers)).json()["name"] == "RenamedMember"
+    res = await client.patch("/", json={"new_name": "TestMember"}, headers=headers)
+    assert (await client.get("/me", headers=headers)).json()["name"] == "TestMember"
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_entry_lives_until_token_expires(client: httpx.AsyncClient, cache: oauth2.PrincipalCache):
+    config.member_token()
+    token = oauth2.create_access_token(
+        {"email": "test-acm-member@test.com", "account_type": "member"},
+        timedelta(seconds=1),
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+    assert (await client.get("/me", headers=headers)).status_code == 200
+    assert cache.get(token) is not None
+    # The token is still accepted during the second it expires
+    time.sleep(2.1)
+    assert cache.get(token) is None
+    assert (await client.get("/me", headers=headers)).status_code == 401
+
+
+def test_lru_eviction_and_switch_off(cache: oauth2.PrincipalCache):
+    config.member_token()
+    tokens = [
+        oauth2.create_access_token({"email": "test-acm-member@test.com", "account_type": "member", "n": n})
+        for n in range(3)
+    ]
+    with Session(config.db_engine) as db:
+        member = db.get(Members, 900001)
+    for token in tokens:
+        cache.set(token, member)
+    assert cache.get(tokens[0]) is None
+    assert cache.get(tokens[2]) is not None
+    cache.enabled = False
+    assert cache.get(tokens[2]) is None
@@ -0,0 +1,114 @@
+from datetime import date, datetime, timedelta
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import text
+from sqlmodel import Session, delete, func, select
+from app.config import IST
+from app.db.models import Blogs, Members
+from app.utils import pagination
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server"
+    ) as client:
+        yield client
+
+
+@pytest.fixture()
+def seeded():
+    now = datetime.now(IST)
+    with Session(config.db_engine) as db:
+        for n in range(7):
+            db.add(
+                Members(
+                    reg_no=900200 + n,
+                    name=f"PageMember{n}",
+                    email=f"test-acm-page{n}@test.com",
+                    position="member",
+                    team="design",
+                    season=99,
+                    chapter="acm",
+                    department="CSE",
+                    year=2,
+                    linkedin_tag="test_username",
+                    instagram_tag="test_username",
+                    # Two members joined at the same time to check the tiebreak
+                    joined_at=now + timedelta(minutes=min(n, 5)),
+                )
+            )
+        for n in range(5):
+            db.add(
+                Blogs(
+                    title=f"Blog {n}",
+                    description="Test Blog",
+                    date=date(2024, 1, 1) + timedelta(days=n // 2),
+                    author="test-pagination",
+                    image_url="",
+                )
+            )
+        db.commit()
+    yield
+    with Session(config.db_engine) as db:
+        db.exec(delete(Members).where(Members.season == 99))
+        db.exec(delete(Blogs).where(Blogs.author == "test-pagination"))
+        db.commit()
+
+
+async def fetch_all(client: httpx.AsyncClient, url: str) -> list[dict]:
+    items = []
+    cursor = None
+    while True:
+        res = await client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert res.status_code == 200
+        items += res.json()
+        cursor = res.headers.get("x-next-cursor")
+        if not cursor:
+            return items
+
+
+@pytest.mark.asyncio
+async def test_members_pages(client: httpx.AsyncClient, seeded):
+    members = await fetch_all(client, "/members/search?season=99&limit=3")
+    assert [m["reg_no"] for m in members] == list(range(900200, 900207))
+    members = await fetch_all(client, "/members/search?season=99&limit=2&order=desc")
+    assert [m["reg_no"] for m in members] == list(range(900206, 900199, -1))
+    members = await fetch_all(client, "/members/search?season=99&limit=4&sort=reg_no&order=desc")
+    assert [m["reg_no"] for m in members] == list(range(900206, 900199, -1))
+
+
+@pytest.mark.asyncio
+async def test_blogs_pages(client: httpx.AsyncClient, seeded):
+    res = await client.get("/blogs/search?author=test-pagination&limit=2&count=exact")
+    assert res.headers["x-total-count"] == "5"
+    blogs = await fetch_all(client, "/blogs/search?author=test-pagination&limit=2")
+    assert len({blog["id"] for blog in blogs}) == 5
+    dates = [blog["date"] for blog in blogs]
+    # Latest first
+    assert dates == sorted(dates, reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_page_size_and_cursor_validation(client: httpx.AsyncClient):
+    res = await client.get(f"/events/search?limit={pagination.MAX_PAGE_SIZE + 1}")
+    assert res.status_code == 422
+    for cursor in ("x", pagination.encode_cursor(["a"]), pagination.encode_cursor(["not a date", "x"])):
+        res = await client.get(f"/events/search?cursor={cursor}")
+        assert res.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_estimated_count(client: httpx.AsyncClient, seeded):
+    with Session(config.db_engine) as db:
+        db.exec(text("ANALYZE"))
+        db.commit()
+        exact = db.exec(select(func.count()).select_from(Members)).one()
+    res = await client.get("/members/search?limit=1&count=estimate")
+    assert res.headers["x-total-count"] == str(exact)
+    # Filters can't be estimated so they are counted
+    res = await client.get("/members/search?season=99&limit=1&count=estimate")
+    assert res.headers["x-total-count"] == "7"
@@ -0,0 +1,120 @@
+import io
+from datetime import datetime, timedelta
+from secrets import token_bytes, token_urlsafe
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from PIL import Image
+from sqlmodel import Session, delete
+from app import oauth2
+from app.config import IST
+from app.db.models import Event_Registeration, Events, Payment_Proofs
+from app.utils import payment_proofs
+from . import config
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(app=config.app, base_url="http://test.server") as client:
+        yield client
+
+
+@pytest.fixture()
+def uploaded():
+    with config.removing_payment_proofs():
+        yield
+
+
+@pytest.fixture()
+def paid_event(monkeypatch):
+    monkeypatch.setattr(oauth2.principal_cache, "enabled", False)
+    now = datetime.now(IST)
+    new_event = Events(
+        name="Payment Proof Event",
+        description="Test Event",
+        start=now + timedelta(days=1),
+        end=now + timedelta(days=1, hours=2),
+        rules="None",
+        venue="Online",
+        fee=100,
+        image_url="",
+    )
+    with Session(config.db_engine) as db:
+        db.add(new_event)
+        db.commit()
+        event_id = new_event.id
+    yield event_id
+    with Session(config.db_engine) as db:
+        db.exec(delete(Event_Registeration).where(Event_Registeration.event_id == event_id))
+        db.exec(delete(Events).where(Events.id == event_id))
+        db.commit()
+
+
+@pytest.mark.asyncio
+async def test_duplicates(client: httpx.AsyncClient, uploaded):
+    content = PNG + token_bytes(16)
+    first = await client.post("/payment_proof/", files={"image_file": ("proof.png", content)})
+    assert first.json()["duplicate"] is False
+    second = await client.post("/payment_proof/", files={"image_file": ("again.PNG", content)})
+    assert second.json() == {"screenshot_id": first.json()["screenshot_id"], "duplicate": True}
+
+    with Session(config.db_engine) as db:
+        proof = db.get(Payment_Proofs, first.json()["screenshot_id"])
+    path = payment_proofs.path_of(proof)
+    # Two levels of directories named after the start of the hash
+    assert path.relative_to(payment_proofs.ROOT).parts[:2] == (proof.sha256[:2], proof.sha256[2:4])
+    assert path.read_bytes() == content
+
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    res = await client.get("/payment_proof/view", params={"id": proof.id}, headers=headers)
+    assert res.content == content
+    res = await client.get("/payment_proof/view", params={"id": "../acm.db"}, headers=headers)
+    assert res.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_id_from_the_image_type(client: httpx.AsyncClient, uploaded):
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (4, 4), token_bytes(48)).save(buffer, "JPEG")
+    first = await client.post("/payment_proof/", files={"image_file": ("proof.jpeg", buffer.getvalue())})
+    assert first.json()["screenshot_id"].endswith(".jpg")
+    second = await client.post("/payment_proof/", files={"image_file": ("proof.JPG", buffer.getvalue())})
+    assert second.json() == {"screenshot_id": first.json()["screenshot_id"], "duplicate": True}
+    # A PNG named .jpg is stored as a PNG
+    res = await client.post("/payment_proof/", files={"image_file": ("proof.jpg", PNG + token_bytes(16))})
+    assert res.json()["screenshot_id"].endswith(".png")
+
+
+@pytest.mark.asyncio
+async def test_register_checks_registry(client: httpx.AsyncClient, uploaded, paid_event):
+    headers = {"Authorization": f"Bearer {config.user_token()}"}
+    data = {"event_id": str(paid_event), "transaction_id": token_urlsafe(8), "screenshot_id": "unknown.png"}
+    res = await client.post("/events/register", json=data, headers=headers)
+    assert res.status_code == 400
+
+    upload = await client.post("/payment_proof/", files={"image_file": ("proof.png", PNG + token_bytes(16))}, headers=headers)
+    with Session(config.db_engine) as db:
+        assert db.get(Payment_Proofs, upload.json()["screenshot_id"]).uploaded_by == "test-acm-user@test.com"
+    data["screenshot_id"] = upload.json()["screenshot_id"]
+    res = await client.post("/events/register", json=data, headers=headers)
+    assert res.status_code == 200
+    assert res.json()["status"] == "pending"
+
+
+def test_import_legacy(uploaded):
+    content = PNG + token_bytes(16)
+    names = [f"{token_urlsafe(32)}.png" for _ in range(2)]
+    for name in names:
+        (payment_proofs.ROOT / name).write_bytes(content)
+
+    assert payment_proofs.import_legacy(config.db_engine) == 2
+    with Session(config.db_engine) as db:
+        proofs = [db.get(Payment_Proofs, name) for name in names]
+    # The old ids still work, the copies share one file
+    assert proofs[0].sha256 == proofs[1].sha256
+    assert payment_proofs.path_of(proofs[0]).read_bytes() == content
+    assert not any((payment_proofs.ROOT / name).exists() for name in names)
+    assert payment_proofs.import_legacy(config.db_engine) == 0
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+from typing import AsyncIterable
+from uuid import uuid4
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import event
+from sqlmodel import Session, delete, select
+from app import oauth2
+from app.config import IST
+from app.db.models import Counters, Event_Registeration, Events, Users
+from app.utils import counters
+from . import config
+
+USERS = 100
+EVENTS = 20
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(app=config.app, base_url="http://test.server") as client:
+        yield client
+
+
+@pytest.fixture()
+def backlog(monkeypatch):
+    """
+    2,000 pending registrations, half of them with a transaction id
+    """
+    monkeypatch.setattr(oauth2.principal_cache, "enabled", False)
+    now = datetime.now(IST)
+    events = [
+        Events(
+            name="test-payment-verification",
+            description="Test Event",
+            start=now + timedelta(days=n),
+            end=now + timedelta(days=n, hours=2),
+            rules="None",
+            venue="Online",
+            fee=100,
+            image_url="",
+        )
+        for n in range(EVENTS)
+    ]
+    with Session(config.db_engine) as db:
+        db.add_all(events)
+        for n in range(USERS):
+            db.add(
+                Users(
+                    reg_no=900500 + n,
+                    name="VerifyUser",
+                    email=f"test-acm-verify{n}@test.com",
+                    department="CSE",
+                    university="Sathyabama University",
+                    year=2,
+                    joined_at=now,
+                    verified=True,
+                )
+            )
+        db.commit()
+        ids = [new_event.id for new_event in events]
+        for event_id in ids:
+            for n in range(USERS):
+                db.add(
+                    Event_Registeration(
+                        user_reg_no=900500 + n,
+                        event_id=event_id,
+                        transaction_id=f"test-verify-{event_id}-{n}" if n % 2 else None,
+                        screenshot_id=None,
+                        status="pending",
+                    )
+                )
+        db.commit()
+    yield ids
+    with Session(config.db_engine) as db:
+        db.exec(delete(Event_Registeration).where(Event_Registeration.event_id.in_(ids)))
+        db.exec(delete(Events).where(Events.id.in_(ids)))
+        db.exec(delete(Users).where(Users.email.startswith("test-acm-verify")))
+        db.commit()
+
+
+def verified_payments() -> int:
+    with Session(config.db_engine) as db:
+        counter = db.get(Counters, "verified_payments_count")
+        return counter.value if counter else 0
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_backlog(client: httpx.AsyncClient, backlog):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    with Session(config.db_engine) as db:
+        counters.reconcile(db)
+    before = verified_payments()
+
+    pending = []
+    url = "/events/verify?limit=100&count=exact"
+    while url:
+        res = await client.get(url, headers=headers)
+        assert res.status_code == 200
+        pending += [row for row in res.json() if row["event_id"] in {str(event_id) for event_id in backlog}]
+        cursor = res.headers.get("x-next-cursor")
+        url = f"/events/verify?limit=100&cursor={cursor}" if cursor else None
+    assert len(pending) == USERS * EVENTS
+    assert pending[0]["user"]["name"] == "VerifyUser"
+
+    decisions = [
+        {"user_reg_no": row["user_reg_no"], "event_id": row["event_id"], "decision": "verified" if n % 4 else "rejected"}
+        for n, row in enumerate(pending)
+    ]
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    for engine in config.app_engines:
+        event.listen(engine, "before_cursor_execute", listener)
+    try:
+        for start in range(0, len(decisions), 1000):
+            res = await client.post("/events/verify", json={"decisions": decisions[start : start + 1000]}, headers=headers)
+            assert res.status_code == 200
+            assert all(result["updated"] for result in res.json())
+    finally:
+        for engine in config.app_engines:
+            event.remove(engine, "before_cursor_execute", listener)
+    # One UPDATE of the registrations per batch
+    assert sum(statement.lstrip().startswith("UPDATE event_registeration") for statement in statements) == 2
+
+    with Session(config.db_engine) as db:
+        statuses = db.exec(select(Event_Registeration.status).where(Event_Registeration.event_id.in_(backlog))).all()
+    assert statuses.count("rejected") == len(decisions) // 4
+    assert statuses.count("verified") == len(decisions) - len(decisions) // 4
+    # The odd users have a transaction id, every 4th decision is a rejection
+    assert verified_payments() == before + sum(1 for n, row in enumerate(pending) if n % 4 and row["transaction_id"])
+
+
+@pytest.mark.asyncio
+async def test_results(client: httpx.AsyncClient, backlog):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    decision = {"user_reg_no": 900501, "event_id": str(backlog[0]), "decision": "verified"}
+    unknown = {"user_reg_no": 900501, "event_id": str(uuid4()), "decision": "rejected"}
+    res = await client.post("/events/verify", json={"decisions": [decision, unknown]}, headers=headers)
+    assert res.json() == [
+        {"user_reg_no": 900501, "event_id": str(backlog[0]), "updated": True, "status": "verified"},
+        {"user_reg_no": 900501, "event_id": unknown["event_id"], "updated": False, "status": None},
+    ]
+    # Already decided
+    res = await client.post("/events/verify", json={"decisions": [{**decision, "decision": "rejected"}]}, headers=headers)
+    assert res.json()[0] == {**res.json()[0], "updated": False, "status": "verified"}
+
+    res = await client.post("/events/verify", json={"decisions": [decision, decision]}, headers=headers)
+    assert res.status_code == 400
+    res = await client.post("/events/verify", json={"decisions": [decision]})
+    assert res.status_code == 401
@@ -0,0 +1,179 @@
+"""
+EXPLAIN QUERY PLAN of every query the read endpoints run, on a seeded database.
+A query which reads a whole table (a plain "SCAN <table>" without an index) fails the test, unless it reads the
+table in the order of the page and stops at the limit. The plans are made without the statistics of ANALYZE,
+so they depend on the indexes and not on how the rows of the test database happen to be distributed
+"""
+
+import re
+from datetime import date, datetime, timedelta
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import event, text
+from sqlmodel import Session, SQLModel, delete
+from app import oauth2
+from app.config import IST
+from app.db.db import ensure_indexes
+from app.db.models import Blogs, Event_Registeration, Events, Members
+from . import config
+
+# Small tables which are fine to scan
+SMALL_TABLES = {"counters", "table_versions"}
+
+URLS = [
+    "/events/search?limit=2",
+    "/events/search?upcoming=true&limit=2&count=exact",
+    "/events/search?past=true&order=desc&limit=2",
+    "/members/search?limit=2&count=estimate",
+    "/members/search?season=98&limit=2&count=exact",
+    "/members/search?season=98&team=design&limit=2",
+    "/members/search?team=design&limit=2",
+    "/members/search?sort=reg_no&order=desc&limit=2",
+    "/blogs/search?limit=2",
+    "/blogs/search?author=test-query-plans&limit=2",
+    "/blogs/search?q=plan&limit=2",
+    "/events/me?limit=2",
+    "/events/me?upcoming=true&status=verified&limit=2",
+    "/events/verify?limit=2&count=exact",
+    "/achievements/",
+]
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server"
+    ) as client:
+        yield client
+
+
+@pytest.fixture()
+def seeded(monkeypatch):
+    monkeypatch.setattr(oauth2.principal_cache, "enabled", False)
+    now = datetime.now(IST)
+    events = [
+        Events(
+            name="test-query-plans",
+            description="Test Event",
+            start=now + timedelta(days=n - 50),
+            end=now + timedelta(days=n - 50, hours=2),
+            rules="None",
+            venue="Online",
+            fee=0,
+            image_url="",
+        )
+        for n in range(100)
+    ]
+    with Session(config.db_engine) as db:
+        db.add_all(events)
+        for n in range(100):
+            db.add(
+                Members(
+                    reg_no=900300 + n,
+                    name="PlanMember",
+                    email=f"test-acm-plan{n}@test.com",
+                    position="member",
+                    team=("design", "technical", "management")[n % 3],
+                    season=98,
+                    chapter="acm",
+                    department="CSE",
+                    year=2,
+                    linkedin_tag="test_username",
+                    instagram_tag="test_username",
+                    joined_at=now + timedelta(minutes=n),
+                )
+            )
+            db.add(
+                Blogs(
+                    title=f"Query plan {n}",
+                    description="Test Blog",
+                    date=date(2024, 1, 1) + timedelta(days=n),
+                    author="test-query-plans",
+                    image_url="",
+                )
+            )
+        db.commit()
+        for n, new_event in enumerate(events[::10]):
+            db.add(
+                Event_Registeration(
+                    user_reg_no=900101,
+                    event_id=new_event.id,
+                    transaction_id=None,
+                    screenshot_id=None,
+                    status="pending" if n % 2 else "verified",
+                )
+            )
+        db.commit()
+        ids = [new_event.id for new_event in events]
+    yield
+    with Session(config.db_engine) as db:
+        db.exec(delete(Event_Registeration).where(Event_Registeration.event_id.in_(ids)))
+        db.exec(delete(Events).where(Events.name == "test-query-plans"))
+        db.exec(delete(Members).where(Members.season == 98))
+        db.exec(delete(Blogs).where(Blogs.author == "test-query-plans"))
+        db.commit()
+
+
+async def run_queries(client: httpx.AsyncClient) -> list[tuple[str, tuple]]:
+    """
+    Statements of every URL and of its next page
+    """
+    statements = []
+    listener = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    headers = {"Authorization": f"Bearer {config.user_token()}"}
+    member_headers = {"Authorization": f"Bearer {config.member_token()}"}
+    for engine in config.app_engines:
+        event.listen(engine, "before_cursor_execute", listener)
+    try:
+        for url in URLS:
+            url_headers = member_headers if url.startswith("/events/verify") else headers
+            res = await client.get(url, headers=url_headers)
+            assert res.status_code == 200, url
+            if "x-next-cursor" in res.headers:
+                res = await client.get(f"{url}&cursor={res.headers['x-next-cursor']}", headers=url_headers)
+                assert res.status_code == 200, url
+    finally:
+        for engine in config.app_engines:
+            event.remove(engine, "before_cursor_execute", listener)
+    return [(statement, parameters) for statement, parameters in statements if statement.lstrip().upper().startswith("SELECT")]
+
+
+def full_scans(statement: str, plan: list[str]) -> set[str]:
+    if "ORDER BY" in statement and "LIMIT" in statement and not any("TEMP B-TREE" in line for line in plan):
+        return set()
+    scans = {match[1] for line in plan if (match := re.fullmatch(r"SCAN (\w+)", line))}
+    # Not the subqueries or the tables of SQLite itself
+    return scans & set(SQLModel.metadata.tables) - SMALL_TABLES
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_no_full_scans(client: httpx.AsyncClient, seeded):
+    statements = await run_queries(client)
+    assert len(statements) > len(URLS)
+    failures = []
+    # A connection of its own, as it forgets the statistics
+    with config.db_engine.connect() as conn:
+        has_statistics = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").first()
+        if has_statistics:
+            conn.exec_driver_sql("DELETE FROM sqlite_stat1")
+            conn.exec_driver_sql("ANALYZE sqlite_schema")  # Reloads the (now empty) statistics
+            conn.rollback()
+        for statement, parameters in statements:
+            if "sqlite_stat1" in statement and not has_statistics:
+                continue
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", tuple(parameters)).all()
+            plan = [row[-1] for row in rows]
+            if full_scans(statement, plan):
+                failures.append(f"{statement}\n  " + "\n  ".join(plan))
+    assert not failures, "Full table scans:\n" + "\n".join(failures)
+
+
+def test_missing_indexes_are_added():
+    with config.db_engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_events_start_id"))
+    ensure_indexes(config.db_engine)
+    with config.db_engine.connect() as conn:
+        assert conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'ix_events_start_id'")).first()
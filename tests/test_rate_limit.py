@@ -0,0 +1,93 @@
+from typing import AsyncIterable
+import fakeredis
+import pytest
+import pytest_asyncio
+import httpx
+from app.utils import rate_limit
+from app.utils.rate_limit import Bucket, parse_rule, rate_limiter
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(app=config.app, base_url="http://test.server") as client:
+        yield client
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, monkeypatch):
+    if request.param == "memory":
+        backend = rate_limit.MemoryBackend(size=1000)
+    else:
+        backend = rate_limit.RedisBackend(fakeredis.FakeAsyncRedis())
+    monkeypatch.setattr(rate_limiter, "backend", backend)
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    return backend
+
+
+@pytest.mark.asyncio
+async def test_bucket(backend, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(rate_limit.time, "time", lambda: clock[0])
+    bucket = Bucket(3, 30)
+    # A burst of capacity, then one every period / capacity seconds
+    assert [await backend.take("a", bucket) for _ in range(3)] == [0, 0, 0]
+    assert await backend.take("a", bucket) == pytest.approx(10)
+    assert await backend.take("b", bucket) == 0
+    clock[0] += 10
+    assert await backend.take("a", bucket) == 0
+    assert await backend.take("a", bucket) == pytest.approx(10)
+    # Never more than capacity after a long wait
+    clock[0] += 3600
+    assert [await backend.take("a", bucket) for _ in range(4)][-1] == pytest.approx(10)
+
+
+@pytest.mark.asyncio
+async def test_eviction():
+    backend = rate_limit.MemoryBackend(size=2)
+    bucket = Bucket(1, 60)
+    for key in ("a", "b", "a", "c"):
+        await backend.take(key, bucket)
+    # b was the least recently used
+    assert await backend.count() == 2
+    assert await backend.take("b", bucket) == 0
+    assert await backend.take("c", bucket) > 0
+
+
+def test_parse_rule():
+    assert parse_rule("ip=30/60, email=5/300") == {"ip": Bucket(30, 60), "email": Bucket(5, 300)}
+
+
+@pytest.mark.asyncio
+async def test_login(client: httpx.AsyncClient, backend, monkeypatch):
+    monkeypatch.setitem(rate_limit.RULES, "login", parse_rule("ip=4/60,email=2/60"))
+    login = {"username": "test-rate-limit@test.com", "password": "Wrong@2024"}
+    for _ in range(2):
+        res = await client.post("/users/login", data=login)
+        assert res.status_code == 401
+    # The same account from the same address, then from another one
+    res = await client.post("/members/login", data={**login, "username": "Test-Rate-Limit@test.com"})
+    assert res.status_code == 429
+    assert 0 < int(res.headers["Retry-After"]) <= 30
+    transport = httpx.ASGITransport(config.app, client=("10.0.0.1", 123))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test.server") as elsewhere:
+        res = await elsewhere.post("/users/login", data=login)
+        assert res.status_code == 429
+    # Other accounts from the same address, until the address has used its own bucket
+    res = await client.post("/users/login", data={**login, "username": "other@test.com"})
+    assert res.status_code == 401
+    res = await client.post("/users/login", data={**login, "username": "another@test.com"})
+    assert res.status_code == 429
+    assert rate_limiter.limited["login"] >= 3
+
+
+@pytest.mark.asyncio
+async def test_subscribe(client: httpx.AsyncClient, backend, monkeypatch):
+    monkeypatch.setitem(rate_limit.RULES, "subscribe", parse_rule("ip=10/60,email=1/3600"))
+    # Invalid emails are counted too
+    res = await client.get("/mail/subscribe?email=Not-An-Email")
+    assert res.status_code == 422
+    res = await client.get("/mail/subscribe?email=not-an-email")
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) == 3600
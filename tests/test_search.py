@@ -0,0 +1,118 @@
+from datetime import date
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, delete
+from app.db.engine import create_db_engine
+from app.db.models import Blogs
+from app.utils import search
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server"
+    ) as client:
+        yield client
+
+
+def add_blogs(engine) -> None:
+    with Session(engine) as db:
+        # Left behind by an interrupted run
+        db.exec(delete(Blogs).where(Blogs.author == "test-search"))
+        db.add(Blogs(title="Quasarflux Workshop", description="Hands on session", date=date(2024, 1, 1), author="test-search", image_url=""))
+        db.add(Blogs(title="Recap", description="A long day of talks. " * 10 + "Then the quasarflux demo ran late.", date=date(2024, 1, 2), author="test-search", image_url=""))
+        for n in range(5):
+            db.add(Blogs(title=f"Weekly {n}", description="quasarflux notes", date=date(2024, 1, 3), author="test-search", image_url=""))
+        db.commit()
+
+
+@pytest.fixture()
+def blogs():
+    add_blogs(config.db_engine)
+    yield
+    with Session(config.db_engine) as db:
+        db.exec(delete(Blogs).where(Blogs.author == "test-search"))
+        db.commit()
+
+
+@pytest.mark.asyncio
+async def test_ranking_and_snippets(client: httpx.AsyncClient, blogs):
+    res = await client.get("/blogs/search?q=quasarflux&count=exact")
+    assert res.status_code == 200
+    assert res.headers["x-total-count"] == "7"
+    results = res.json()
+    # A match in the title ranks first
+    assert results[0]["title"] == "Quasarflux Workshop"
+    recap = next(blog for blog in results if blog["title"] == "Recap")
+    assert f"{search.MARK_START}quasarflux{search.MARK_END}" in recap["snippet"]
+    assert len(recap["snippet"]) < len(recap["description"])
+
+
+@pytest.mark.asyncio
+async def test_prefix_and_pages(client: httpx.AsyncClient, blogs):
+    ids = []
+    url = "/blogs/search?q=QUASAR&limit=3"
+    while url:
+        res = await client.get(url)
+        assert res.status_code == 200
+        ids += [blog["id"] for blog in res.json()]
+        cursor = res.headers.get("x-next-cursor")
+        url = f"/blogs/search?q=QUASAR&limit=3&cursor={cursor}" if cursor else None
+    assert len(set(ids)) == 7
+    # Every word has to match, the query syntax is ignored
+    assert len((await client.get("/blogs/search?q=quasar%20work")).json()) == 1
+    assert len((await client.get('/blogs/search?q="quasar" -(weekly:')).json()) == 5
+    assert (await client.get("/blogs/search?q=%2A%22")).status_code == 400
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_index_follows_changes(client: httpx.AsyncClient, blogs):
+    headers = {"Authorization": f"Bearer {config.member_token()}"}
+    blog = (await client.get("/blogs/search?q=workshop")).json()[0]
+    res = await client.patch("/blogs/", json={"id": blog["id"], "new_title": "Zyxtrophy Meetup"}, headers=headers)
+    assert res.status_code == 200
+    assert (await client.get("/blogs/search?q=workshop")).json() == []
+    assert [b["id"] for b in (await client.get("/blogs/search?q=zyxtroph")).json()] == [blog["id"]]
+    res = await client.request("DELETE", "/blogs/", json={"id": blog["id"]}, headers=headers)
+    assert res.status_code == 204
+    assert (await client.get("/blogs/search?q=zyxtroph")).json() == []
+
+
+OLD_INDEX = [
+    "CREATE VIRTUAL TABLE blogs_fts USING fts5(id UNINDEXED, title, description, author)",
+    """CREATE TRIGGER blogs_fts_delete AFTER DELETE ON blogs BEGIN
+        DELETE FROM blogs_fts WHERE id = old.id;
+    END""",
+]
+
+
+def test_index_of_existing_blogs(tmp_path):
+    # A database of its own, the pooled connections to the shared one would keep the dropped index in their schema
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    try:
+        SQLModel.metadata.create_all(engine, tables=[Blogs.__table__])
+        # Blogs which were there before the index, and the index before it was keyed on their rowid
+        with engine.begin() as conn:
+            for statement in OLD_INDEX:
+                conn.execute(text(statement))
+        add_blogs(engine)
+        search.create_index(engine)
+        search.create_index(engine)
+        count = text("SELECT count(*) FROM blogs_fts WHERE blogs_fts MATCH 'quasarflux'")
+        with Session(engine) as db:
+            assert db.exec(count).one() == (7,)
+            db.exec(delete(Blogs).where(Blogs.title == "Recap"))
+            db.commit()
+            assert db.exec(count).one() == (6,)
+            # The index is consistent with the blogs
+            db.exec(text("INSERT INTO blogs_fts (blogs_fts, rank) VALUES ('integrity-check', 1)"))
+        search.create_index(engine, rebuild=True)
+        with Session(engine) as db:
+            assert db.exec(count).one() == (6,)
+    finally:
+        engine.dispose()
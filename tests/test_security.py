@@ -0,0 +1,68 @@
+import time
+import asyncio
+from typing import AsyncIterable
+import bcrypt
+import pytest
+import pytest_asyncio
+import httpx
+from fastapi import HTTPException
+from sqlmodel import Session
+from app.db.models import Auth
+from app.utils import security
+from . import config
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        app=config.app, base_url="http://test.server"
+    ) as client:
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_hash_executor_rejects_when_saturated():
+    executor = security.HashExecutor(workers=1, queue_limit=1)
+    results = await asyncio.gather(
+        *(executor.run(time.sleep, 0.2) for _ in range(3)), return_exceptions=True
+    )
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert rejected[0].headers == {"Retry-After": "1"}
+    metrics = executor.metrics()
+    assert (metrics["completed"], metrics["rejected"], metrics["in_flight"]) == (2, 1, 0)
+    assert metrics["max_seconds"] >= 0.4
+
+
+def test_needs_rehash(monkeypatch):
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 4)
+    hashed = security.hash_("Test@2024")
+    assert hashed.startswith("$2b$04$")
+    assert not security.needs_rehash(hashed)
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 5)
+    assert security.needs_rehash(hashed)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.asyncio
+async def test_login_rehashes_password(client: httpx.AsyncClient, monkeypatch):
+    token = config.member_token()
+    with Session(config.db_engine) as db:
+        auth = db.get(Auth, ("test-acm-member@test.com", "member"))
+        if not auth:
+            auth = Auth(email="test-acm-member@test.com", account_type="member", password="")
+            db.add(auth)
+        auth.password = bcrypt.hashpw(b"Test@2024", bcrypt.gensalt(4)).decode()
+        db.commit()
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 5)
+    res = await client.post(
+        "/members/login",
+        data={"username": "test-acm-member@test.com", "password": "Test@2024"},
+    )
+    assert res.status_code == 200
+    with Session(config.db_engine) as db:
+        assert db.get(Auth, ("test-acm-member@test.com", "member")).password.startswith("$2b$05$")
+    res = await client.get("/metrics/", headers={"Authorization": f"Bearer {token}"})
+    assert res.status_code == 200
+    assert res.json()["password_hashing"]["completed"] >= 2
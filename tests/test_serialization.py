@@ -0,0 +1,36 @@
+import json
+from datetime import datetime, timedelta
+from sqlmodel import Session, select
+from app import schema
+from app.config import IST
+from app.db.models import Events
+from app.utils.serialization import columns, dump_json
+from . import config
+
+
+def test_rows_serialize_like_models():
+    now = datetime.now(IST)
+    event = Events(
+        name="Serialization Event",
+        description="Test Event",
+        start=now,
+        end=now + timedelta(hours=1),
+        rules="None",
+        venue="Test Venue",
+        fee=0,
+        image_url="",
+    )
+    with Session(config.db_engine) as db:
+        db.add(event)
+        db.commit()
+        try:
+            query = select(*columns(Events, schema.EventOut)).where(Events.id == event.id)
+            rows = db.execute(query).all()
+            model = db.get(Events, event.id)
+            assert dump_json(schema.EventOut, rows) == dump_json(schema.EventOut, [model])
+            # SQLite gives the datetimes back without the timezone, they go out in IST
+            body = json.loads(dump_json(schema.EventOut, rows))
+            assert datetime.fromisoformat(body[0]["start"]).utcoffset() == timedelta(hours=5, minutes=30)
+        finally:
+            db.delete(db.get(Events, event.id))
+            db.commit()
@@ -0,0 +1,85 @@
+import io
+from pathlib import Path
+from secrets import token_bytes
+from typing import AsyncIterable
+import pytest
+import pytest_asyncio
+import httpx
+from fastapi import HTTPException, UploadFile
+from sqlmodel import Session
+from app.db.models import Payment_Proofs
+from app.utils import payment_proofs, uploads
+from . import config
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+
+
+@pytest_asyncio.fixture()
+async def client() -> AsyncIterable[httpx.AsyncClient]:
+    async with httpx.AsyncClient(app=config.app, base_url="http://test.server") as client:
+        yield client
+
+
+@pytest.fixture()
+def uploaded():
+    with config.removing_payment_proofs():
+        yield
+
+
+def leftovers() -> list[Path]:
+    return list(payment_proofs.ROOT.glob(".*.part"))
+
+
+@pytest.mark.asyncio
+async def test_upload(client: httpx.AsyncClient, uploaded):
+    content = PNG + token_bytes(16) + b"\x00" * (3 * uploads.CHUNK_BYTES)
+    res = await client.post("/payment_proof/", files={"image_file": ("proof.png", content)})
+    assert res.status_code == 200
+    with Session(config.db_engine) as db:
+        proof = db.get(Payment_Proofs, res.json()["screenshot_id"])
+    assert payment_proofs.path_of(proof).read_bytes() == content
+    assert not leftovers()
+
+
+@pytest.mark.asyncio
+async def test_not_an_image(client: httpx.AsyncClient, uploaded):
+    res = await client.post("/payment_proof/", files={"image_file": ("proof.png", b"Not an image")})
+    assert res.status_code == 400
+    res = await client.post("/payment_proof/", files={"image_file": ("proof.txt", PNG)})
+    assert res.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_too_large(client: httpx.AsyncClient, uploaded):
+    content = PNG + b"\x00" * (uploads.MAX_BYTES + uploads.FORM_OVERHEAD_BYTES)
+    # Refused from the Content-Length, with the CORS headers so a browser on another site can read the message
+    res = await client.post(
+        "/payment_proof/", files={"image_file": ("proof.png", content)}, headers={"Origin": "https://acm.test"}
+    )
+    assert res.status_code == 413
+    assert res.headers["access-control-allow-origin"] == "*"
+    assert res.json()["detail"] == uploads.TOO_LARGE
+
+    # Without a Content-Length the body is cut off while it is being received
+    async def chunked():
+        yield b'--limit\r\nContent-Disposition: form-data; name="image_file"; filename="proof.png"\r\n\r\n'
+        for start in range(0, len(content), uploads.CHUNK_BYTES):
+            yield content[start : start + uploads.CHUNK_BYTES]
+
+    headers = {"Content-Type": "multipart/form-data; boundary=limit"}
+    res = await client.post("/payment_proof/", content=chunked(), headers=headers)
+    assert res.status_code == 413
+    assert not leftovers()
+
+
+@pytest.mark.asyncio
+async def test_file_size_limit(client: httpx.AsyncClient, uploaded, tmp_path: Path):
+    upload = UploadFile(io.BytesIO(PNG + b"\x00"), filename="proof.png")
+    with pytest.raises(HTTPException) as error:
+        await uploads.save_image(upload, tmp_path, max_bytes=len(PNG))
+    assert error.value.status_code == 413
+    assert not list(tmp_path.iterdir())
+    # Over the limit of the file but not of the request body
+    res = await client.post("/payment_proof/", files={"image_file": ("proof.png", PNG + b"\x00" * uploads.MAX_BYTES)})
+    assert res.status_code == 413
+    assert not leftovers()
@@ -180,8 +180,11 @@ async def test_user_me(client: httpx.AsyncClient):
 
 def test_cleanup():
     """
-    Removes the acm-test.db so it won't conflict when we run the tests again
+    Removes the acm-test.db (with its WAL files) so it won't conflict when we run the tests again
     """
-    os.remove("acm-test.db")
+    config.db_engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(f"acm-test.db{suffix}"):
+            os.remove(f"acm-test.db{suffix}")
 
 # TODO: Complete remaining tests